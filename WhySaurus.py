@@ -54,6 +54,9 @@ routes = [
     Route('/getPointContent', 
           handler='WhySaurus.ViewPoint:getPointContent', 
           name='getPointContent'),
+    Route('/getPointTree', 
+          handler='WhySaurus.ViewPoint:getPointTree', 
+          name='getPointTree'),
     Route('/getPointComments', 
           handler='WhySaurus.ViewPoint:getPointComments', 
           name='getPointComments'),
@@ -70,6 +73,7 @@ routes = [
     Route('/ajaxSearch', AjaxSearch),
     Route('/pointHistory', PointHistory),
     Route('/getPointCreator', handler='WhySaurus.PointHistory:getPointCreator', name='getPointCreator'), 
+    Route('/getPointHistoryPage', handler='WhySaurus.PointHistory:getHistoryPage', name='getPointHistoryPage'),
     Route('/getPointsList', GetPointsList),
     Route('/outliner', Outliner),
     Route('/addTree', AddTree),
@@ -89,6 +93,8 @@ routes = [
     Route('/job/updateSupportingPointsSchema', UpdateSupportingPointsSchema),
     Route('/job/ArchiveAllComments', handler='WhySaurus.AaronTask:ArchiveAllComments'),  
     Route('/job/sendNotificationEmails', handler='WhySaurus.NotificationHandler:sendNotificationEmails'),  
+    Route('/job/sendNotificationEmailsPage', handler='WhySaurus.NotificationHandler:sendNotificationEmailsPage'),
+    Route('/job/notificationEmailStatus', handler='WhySaurus.NotificationHandler:notificationEmailStatus'),
     # Route('/job/MakeLinks', handler='WhySaurus.AaronTask:MakeLinks'),
     # Route('/job/MakeLinksAll', handler='WhySaurus.AaronTask:MakeLinksAllAreas'),    
     Route('/job/DBCheck', handler='WhySaurus.AaronTask:DBCheck'),   
@@ -97,9 +103,19 @@ routes = [
     Route('/job/QueueTask', handler='WhySaurus.AaronTask:QueueTask', name='queueTask'),
     Route('/job/CalculateTopPoints', handler='WhySaurus.AaronTask:CalculateTopPoints'),
     Route('/job/PopulateCreators', handler='WhySaurus.AaronTask:PopulateCreators'),
+    Route('/job/PopulatePointValues', handler='WhySaurus.AaronTask:PopulatePointValues'),
+    Route('/job/MigrateUserVotes', handler='WhySaurus.AaronTask:MigrateUserVotes'),
+    Route('/job/MigrateUserPointIndex', handler='WhySaurus.AaronTask:MigrateUserPointIndex'),
+    Route('/job/FlushViewCounts', handler='WhySaurus.AaronTask:FlushViewCounts'),
+    Route('/job/MigratePointURLs', handler='WhySaurus.AaronTask:MigratePointURLs'),
+    Route('/job/BuildPointAdjacency', handler='WhySaurus.AaronTask:BuildPointAdjacency'),
+    Route('/job/EncodeVersionHistory', handler='WhySaurus.AaronTask:EncodeVersionHistory'),
     Route('/job/RebuildSearchIndex', RebuildSearchIndex),
     Route('/job/DBIntegrityCheck', DBIntegrityCheck),
     Route('/job/addDBTask', 'WhySaurus.DBIntegrityCheck:addDBTask', name='addDBTask'),
+    Route('/job/DBIntegrityReport/<reportID>', 
+          'WhySaurus.DBIntegrityCheck:showReport', 
+          name='showDBReport'),
     Route('/job/fixPoint/<pointURL>', 'WhySaurus.DBIntegrityCheck:fixPoint', name='fixPoint'),
     Route('/job/cleanDeadBacklinks/<pointURL>', 
           'WhySaurus.DBIntegrityCheck:cleanDeadBacklinks', 
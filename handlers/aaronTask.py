@@ -15,6 +15,10 @@ from models.point import Link
 from models.privateArea import PrivateArea
 from models.follow import Follow
 from models.comment import Comment
+from models.viewCounter import PointViewShard
+from models.pointURL import PointURL
+from models.pointAdjacency import PointAdjacency
+from models.redirecturl import RedirectURL
 
 from models.whysaurususer import WhysaurusUser
 
@@ -95,6 +99,311 @@ def IndUpdatePointsAllNamespace():
 
     IndClearLowQualityFlags(namespaces=namespaces)
     
+def IndPopulatePointValues(cursor=None, num_updated=0, batch_size=100, namespace=None, namespaces=None):
+    logging.info('PopulatePointValues Update: Start: %d  Batch: %d  Namespace: %s' % (num_updated, batch_size, namespace))
+
+    if namespace:
+        previous_namespace = namespace_manager.get_namespace()
+        namespace_manager.set_namespace(namespace)
+    else:
+        previous_namespace = None
+
+    try:
+        query = Point.query(Point.current == True)
+        points, next_cursor, more = query.fetch_page(batch_size, start_cursor=cursor)
+        for p in points:
+            p.updateCachedValues()
+        ndb.put_multi(points)
+        logging.info('PopulatePointValues Incremental: Count: %d' % len(points))
+    finally:
+        if previous_namespace:
+            namespace_manager.set_namespace(previous_namespace)
+
+    if more:
+        deferred.defer(IndPopulatePointValues,
+                       cursor=next_cursor,
+                       num_updated=(num_updated + len(points)),
+                       batch_size=batch_size,
+                       namespace=namespace,
+                       namespaces=namespaces)
+    else:
+        logging.warning('PopulatePointValues Complete! - Updated: %d  Namespace: %s' % (num_updated + len(points), namespace))
+
+        if namespaces and len(namespaces) > 0:
+            nextNamespace = namespaces[0]
+            del namespaces[0]
+            deferred.defer(IndPopulatePointValues,
+                           batch_size=batch_size,
+                           namespace=nextNamespace,
+                           namespaces=namespaces)
+
+def IndPopulatePointValuesAllNamespace():
+    namespaces = [namespace for namespace in metadata.get_namespaces()]
+    assert (namespaces[0] == "")
+    IndPopulatePointValues(namespaces=namespaces[1:])
+
+def IndMigrateUserVotes(cursor=None, num_updated=0, batch_size=50):
+    # USERS ARE STORED IN THE DEFAULT NAMESPACE
+    namespace_manager.set_namespace('')
+    query = WhysaurusUser.query()
+    users, next_cursor, more = query.fetch_page(batch_size, start_cursor=cursor)
+
+    cntUpdate = 0
+    for u in users:
+        if u.votesMigrated:
+            continue
+        movedCount = u.migrateVotes()
+        logging.info('MigrateUserVotes: Moved %d votes for %s' % (movedCount, u.url))
+        cntUpdate += 1
+
+    if more:
+        deferred.defer(IndMigrateUserVotes,
+                       cursor=next_cursor,
+                       num_updated=(num_updated + cntUpdate),
+                       batch_size=batch_size)
+    else:
+        logging.warning('MigrateUserVotes Complete! - Users Updated: %d' % (num_updated + cntUpdate))
+
+def IndMigrateUserPointIndex(cursor=None, num_updated=0, batch_size=50):
+    # USERS ARE STORED IN THE DEFAULT NAMESPACE
+    namespace_manager.set_namespace('')
+    query = WhysaurusUser.query()
+    users, next_cursor, more = query.fetch_page(batch_size, start_cursor=cursor)
+
+    cntUpdate = 0
+    for u in users:
+        if u.pointIndexMigrated:
+            continue
+        movedCount = u.migratePointIndex()
+        logging.info('MigrateUserPointIndex: Moved %d points for %s' % (movedCount, u.url))
+        cntUpdate += 1
+
+    if more:
+        deferred.defer(IndMigrateUserPointIndex,
+                       cursor=next_cursor,
+                       num_updated=(num_updated + cntUpdate),
+                       batch_size=batch_size)
+    else:
+        logging.warning('MigrateUserPointIndex Complete! - Users Updated: %d' % (num_updated + cntUpdate))
+
+MAX_REDIRECT_HOPS = 10
+
+# The root a legacy redirect's target leads to. Redirects made before they were all
+#  pointed straight at their point can lead to another redirect, so the target is
+#  followed through those, whichever order the job reaches them in.
+def resolveLegacyRedirectTarget(url):
+    for i in range(MAX_REDIRECT_HOPS):
+        entry = PointURL.keyForUrl(url).get()
+        if entry and entry.pointRoot:
+            return entry.pointRoot.get()
+        redirectURL = RedirectURL.getByFromURL_asynch(url).get_result()
+        if not redirectURL or not redirectURL.toURL or redirectURL.toURL == url:
+            return None
+        url = redirectURL.toURL
+    logging.warning('MigratePointURLs: More than %d redirects from %s' % (MAX_REDIRECT_HOPS, url))
+    return None
+
+# Registers the URLs of existing points, then the redirects, in each namespace.
+# Redirects are re-keyed by fromURL and pointed straight at their point's URL.
+def IndMigratePointURLs(cursor=None, num_updated=0, batch_size=100, phase='roots', namespace=None, namespaces=None):
+    logging.info('MigratePointURLs: Start: %d  Batch: %d  Phase: %s  Namespace: %s' % (num_updated, batch_size, phase, namespace))
+
+    if namespace:
+        previous_namespace = namespace_manager.get_namespace()
+        namespace_manager.set_namespace(namespace)
+    else:
+        previous_namespace = None
+
+    try:
+        if phase == 'roots':
+            query = PointRoot.query()
+        else:
+            query = RedirectURL.query()
+        entities, next_cursor, more = query.fetch_page(batch_size, start_cursor=cursor)
+
+        cntUpdate = 0
+        for e in entities:
+            if phase == 'roots':
+                added = PointURL.addLegacy(e.url, e.key, e.numCopies)
+            else:
+                targetRoot = resolveLegacyRedirectTarget(e.toURL)
+                added = PointURL.addLegacy(e.fromURL, targetRoot.key if targetRoot else None,
+                                           e.numCopies)
+                if e.key.id() != e.fromURL:
+                    e.rekey(targetRoot.url if targetRoot else None)
+                    added = True
+            if added:
+                cntUpdate += 1
+        logging.info('MigratePointURLs Incremental: Count: %d  Updated: %d' % (len(entities), cntUpdate))
+
+        if not (more and next_cursor) and phase != 'roots':
+            PointURL.setMigrated()
+    finally:
+        if previous_namespace:
+            namespace_manager.set_namespace(previous_namespace)
+
+    if more and next_cursor:
+        deferred.defer(IndMigratePointURLs,
+                       cursor=next_cursor,
+                       num_updated=(num_updated + cntUpdate),
+                       batch_size=batch_size,
+                       phase=phase,
+                       namespace=namespace,
+                       namespaces=namespaces)
+    elif phase == 'roots':
+        deferred.defer(IndMigratePointURLs,
+                       num_updated=(num_updated + cntUpdate),
+                       batch_size=batch_size,
+                       phase='redirects',
+                       namespace=namespace,
+                       namespaces=namespaces)
+    else:
+        logging.warning('MigratePointURLs Complete! - Updated: %d  Namespace: %s' % (num_updated + cntUpdate, namespace))
+
+        if namespaces and len(namespaces) > 0:
+            nextNamespace = namespaces[0]
+            del namespaces[0]
+            deferred.defer(IndMigratePointURLs,
+                           batch_size=batch_size,
+                           namespace=nextNamespace,
+                           namespaces=namespaces)
+
+def IndMigratePointURLsAllNamespace():
+    namespaces = [namespace for namespace in metadata.get_namespaces()]
+    assert (namespaces[0] == "")
+    IndMigratePointURLs(namespaces=namespaces[1:])
+
+# Builds the adjacency index entries of every point root, in each namespace
+def IndBuildPointAdjacency(cursor=None, num_updated=0, batch_size=100, namespace=None, namespaces=None):
+    logging.info('BuildPointAdjacency: Start: %d  Batch: %d  Namespace: %s' % (num_updated, batch_size, namespace))
+
+    if namespace:
+        previous_namespace = namespace_manager.get_namespace()
+        namespace_manager.set_namespace(namespace)
+    else:
+        previous_namespace = None
+
+    try:
+        query = PointRoot.query()
+        pointRoots, next_cursor, more = query.fetch_page(batch_size, start_cursor=cursor)
+        currents = ndb.get_multi([pr.current for pr in pointRoots if pr.current])
+        currentsByRoot = dict((p.key.parent(), p) for p in currents if p)
+        adjacencies = [PointAdjacency.build(pr, currentsByRoot[pr.key])
+                       for pr in pointRoots if pr.key in currentsByRoot]
+        ndb.put_multi(adjacencies)
+        logging.info('BuildPointAdjacency Incremental: Roots: %d  Built: %d' % (len(pointRoots), len(adjacencies)))
+    finally:
+        if previous_namespace:
+            namespace_manager.set_namespace(previous_namespace)
+
+    if more and next_cursor:
+        deferred.defer(IndBuildPointAdjacency,
+                       cursor=next_cursor,
+                       num_updated=(num_updated + len(adjacencies)),
+                       batch_size=batch_size,
+                       namespace=namespace,
+                       namespaces=namespaces)
+    else:
+        logging.warning('BuildPointAdjacency Complete! - Built: %d  Namespace: %s' % (num_updated + len(adjacencies), namespace))
+
+        if namespaces and len(namespaces) > 0:
+            nextNamespace = namespaces[0]
+            del namespaces[0]
+            deferred.defer(IndBuildPointAdjacency,
+                           batch_size=batch_size,
+                           namespace=nextNamespace,
+                           namespaces=namespaces)
+
+def IndBuildPointAdjacencyAllNamespace():
+    namespaces = [namespace for namespace in metadata.get_namespaces()]
+    assert (namespaces[0] == "")
+    IndBuildPointAdjacency(namespaces=namespaces[1:])
+
+def IndEncodeVersionHistory(cursor=None, num_updated=0, batch_size=20, namespace=None, namespaces=None):
+    logging.info('EncodeVersionHistory: Start: %d  Batch: %d  Namespace: %s' % (num_updated, batch_size, namespace))
+
+    if namespace:
+        previous_namespace = namespace_manager.get_namespace()
+        namespace_manager.set_namespace(namespace)
+    else:
+        previous_namespace = None
+
+    try:
+        query = PointRoot.query()
+        pointRoots, next_cursor, more = query.fetch_page(batch_size, start_cursor=cursor)
+        encoded = 0
+        for pointRoot in pointRoots:
+            encoded += pointRoot.encodeHistory()
+        logging.info('EncodeVersionHistory Incremental: Roots: %d  Encoded: %d' % (len(pointRoots), encoded))
+    finally:
+        if previous_namespace:
+            namespace_manager.set_namespace(previous_namespace)
+
+    if more and next_cursor:
+        deferred.defer(IndEncodeVersionHistory,
+                       cursor=next_cursor,
+                       num_updated=(num_updated + encoded),
+                       batch_size=batch_size,
+                       namespace=namespace,
+                       namespaces=namespaces)
+    else:
+        logging.warning('EncodeVersionHistory Complete! - Encoded: %d  Namespace: %s' % (num_updated + encoded, namespace))
+
+        if namespaces and len(namespaces) > 0:
+            nextNamespace = namespaces[0]
+            del namespaces[0]
+            deferred.defer(IndEncodeVersionHistory,
+                           batch_size=batch_size,
+                           namespace=nextNamespace,
+                           namespaces=namespaces)
+
+def IndEncodeVersionHistoryAllNamespace():
+    namespaces = [namespace for namespace in metadata.get_namespaces()]
+    assert (namespaces[0] == "")
+    IndEncodeVersionHistory(namespaces=namespaces[1:])
+
+def IndFlushViewCounts(cursor=None, num_updated=0, batch_size=100, namespace=None, namespaces=None):
+    logging.info('FlushViewCounts: Start: %d  Batch: %d  Namespace: %s' % (num_updated, batch_size, namespace))
+
+    if namespace:
+        previous_namespace = namespace_manager.get_namespace()
+        namespace_manager.set_namespace(namespace)
+    else:
+        previous_namespace = None
+
+    try:
+        rootKeys, next_cursor, more = PointViewShard.getPendingRootKeysPage(cursor, batch_size)
+        views = 0
+        for rootKey in rootKeys:
+            views += PointViewShard.flushRoot(rootKey)
+        logging.info('FlushViewCounts Incremental: Roots: %d  Views: %d' % (len(rootKeys), views))
+    finally:
+        if previous_namespace:
+            namespace_manager.set_namespace(previous_namespace)
+
+    if more and next_cursor:
+        deferred.defer(IndFlushViewCounts,
+                       cursor=next_cursor,
+                       num_updated=(num_updated + len(rootKeys)),
+                       batch_size=batch_size,
+                       namespace=namespace,
+                       namespaces=namespaces)
+    else:
+        logging.info('FlushViewCounts Complete! - Roots: %d  Namespace: %s' % (num_updated + len(rootKeys), namespace))
+
+        if namespaces and len(namespaces) > 0:
+            nextNamespace = namespaces[0]
+            del namespaces[0]
+            deferred.defer(IndFlushViewCounts,
+                           batch_size=batch_size,
+                           namespace=nextNamespace,
+                           namespaces=namespaces)
+
+def IndFlushViewCountsAllNamespace():
+    namespaces = [namespace for namespace in metadata.get_namespaces()]
+    assert (namespaces[0] == "")
+    IndFlushViewCounts(namespaces=namespaces[1:])
+
 def ChangeUserUrl(cursor=None, num_updated=0, batch_size=250, cntUpdatedNet=0, namespace=None, namespaces=None):
     logging.info('ChangeUserUrl Update: Start: %d  Batch: %d  Namespace: %s' % (num_updated, batch_size, namespace))
 
@@ -338,6 +647,41 @@ class AaronTask(AuthHandler):
             t.add(queue_name="notifications")
             logging.info('Requeing MakeFollows task to start at url %s ' % nextURL)
         
+    # Fill in Point.pointValueCached for points written before it existed
+    def PopulatePointValues(self):
+        deferred.defer(IndPopulatePointValuesAllNamespace)
+        self.response.out.write('Queued point value population for all namespaces')
+
+    # Move created/edited point lists off the users (see WhysaurusUser.migratePointIndex)
+    def MigrateUserPointIndex(self):
+        deferred.defer(IndMigrateUserPointIndex)
+        self.response.out.write('Queued point index migration for all users')
+
+    # Register existing point URLs and redirects in PointURL (see makeURL)
+    def MigratePointURLs(self):
+        deferred.defer(IndMigratePointURLsAllNamespace)
+        self.response.out.write('Queued point URL migration for all namespaces')
+
+    # Build PointAdjacency entries for roots written before the index existed
+    def BuildPointAdjacency(self):
+        deferred.defer(IndBuildPointAdjacencyAllNamespace)
+        self.response.out.write('Queued adjacency index build for all namespaces')
+
+    # Store versions replaced before versions were kept as deltas as deltas (see Point.encodeAsDelta)
+    def EncodeVersionHistory(self):
+        deferred.defer(IndEncodeVersionHistoryAllNamespace)
+        self.response.out.write('Queued version history encoding for all namespaces')
+
+    # Called by cron: adds pending views to PointRoot.viewCount (see PointViewShard)
+    def FlushViewCounts(self):
+        deferred.defer(IndFlushViewCountsAllNamespace)
+        self.response.out.write('Queued view count flush for all namespaces')
+
+    # Re-key every user's votes by point root (see WhysaurusUser.migrateVotes)
+    def MigrateUserVotes(self):
+        deferred.defer(IndMigrateUserVotes)
+        self.response.out.write('Queued vote migration for all users')
+
     def PopulateCreators(self):
         prs = PointRoot.query()
         cnt = 0
@@ -12,6 +12,7 @@ from google.appengine.api import namespace_manager
 from google.appengine.api import app_identity
 from authhandler import AuthHandler
 from models.whysaurususer import WhysaurusUser
+from models.userActivity import UserActivity
 from models.privateArea import PrivateArea
 from models.areauser import AreaUser
 from models.whysaurusexception import WhysaurusException
@@ -111,6 +112,11 @@ class AdminPage(AuthHandler):
             # If page is out of range (e.g. 9999), deliver last page of results.
             paginatedUsers = paginator.page(paginator.num_pages)
 
+        # Visit statistics for the page in one batch
+        pageUsers = [yUser['u'] for yUser in paginatedUsers.object_list]
+        for yUser, activity in zip(pageUsers, UserActivity.getForUsers(pageUsers)):
+            yUser._activity = activity
+        WhysaurusUser.prefetchPointCounts(pageUsers)
             
         template_values = {
             'user': user,
@@ -256,6 +262,8 @@ class AdminPage(AuthHandler):
         }
         
         namespace_manager.set_namespace(userNamespace)   
+        # Point counts are per area, so read once back in it
+        WhysaurusUser.prefetchPointCounts([yUser['u'] for yUser in paginatedUsers.object_list])
         self.response.out.write(
             self.template_render('adminPrivateArea.html', template_values))
                 
\ No newline at end of file
@@ -1,22 +1,294 @@
-import os
 import logging
 import constants
 import datetime
 
-from google.appengine.ext.webapp import template
 from google.appengine.ext import ndb
+from google.appengine.ext import deferred
+from google.appengine.ext.ndb import metadata
+from google.appengine.datastore.datastore_query import Cursor
 from google.appengine.api import mail
 
 
 from authhandler import AuthHandler
 from models.point import PointRoot
 from models.point import Point
-from models.privateArea import PrivateArea
+from models.pointAdjacency import PointAdjacency, LINK_TYPES
+from models.pointCard import PointCard
+from models.integrityReport import IntegrityReport, IntegrityShard
 from models.timezones import PST
 from google.appengine.api import namespace_manager
   
 from google.appengine.api.taskqueue import Task
 
+ROOT_PAGE_SIZE = 50
+# Incremental runs page through the versions written since the last run
+VERSION_PAGE_SIZE = 100
+MAX_CURRENTS_REPORTED = 10
+
+
+def rootLink(url):
+    return "<a href=\"/point/%s\">%s</a>" % (url, url)
+
+# Gets the keys not already in found into it, with None for those that do not exist
+@ndb.tasklet
+def _getInto_async(found, keys):
+    keys = list(set(k for k in keys if k and k not in found))
+    if keys:
+        entities = yield ndb.get_multi_async(keys)
+        found.update(zip(keys, entities))
+
+# None for a link with neither key, which cleanEmptyLinks removes
+def _linkRootKey(link):
+    if link.root:
+        return link.root
+    return link.version.parent() if link.version else None
+
+def _links(point):
+    return [(linkType, link) for linkType in LINK_TYPES
+            for link in point.getStructuredLinkCollection(linkType)]
+
+# Returns a list of (message, neighbour root key) for the errors in pointRoot.
+# Each message has a %s for the link to the neighbouring root, if there is one.
+def _rootProblems(pointRoot, currentKeys, found):
+    problems = []
+    here = rootLink(pointRoot.url)
+    point = found.get(pointRoot.current)
+    if not point:
+        problems.append(("Not able to get current from %s. " % here, None))
+    elif not point.current:
+        problems.append(("Root %s: Current point is not marked current" % here, None))
+
+    if len(currentKeys) != 1:
+        problems.append(("Root %s: Found %d points marked current. URL keys: %s" %
+                         (here, len(currentKeys), ",".join(k.urlsafe() for k in currentKeys)), None))
+        problems.append(("<a href=\"/job/cleanCurrents/%s\">Clean multiple current points</a>" %
+                         pointRoot.url, None))
+
+    if point:
+        adjacency = found.get(PointAdjacency.keyForRoot(pointRoot.key))
+        expected = PointAdjacency.build(pointRoot, point)
+        if adjacency is None or adjacency.links != expected.links or \
+                adjacency.backlinks != expected.backlinks:
+            problems.append(("Root %s: Adjacency index entry is missing or out of date" % here, None))
+
+        # A missing card is rebuilt on its first read, but one from another version is stale
+        card = found.get(PointCard.keyForRoot(pointRoot.key))
+        if card and card.point != point.key:
+            problems.append(("Root %s: Card is of version %s, not the current version" %
+                             (here, card.point.id() if card.point else None), None))
+
+        for linkType, link in _links(point):
+            linkRootKey = _linkRootKey(link)
+            if not linkRootKey:
+                problems.append(("Root %s: Has a %s link with no root or version. \
+                    <a href=\"/job/cleanEmptyLinks/%s\">Clean empty links</a>" % \
+                    (here, linkType, pointRoot.url), None))
+                continue
+            linkAdjacency = found.get(PointAdjacency.keyForRoot(linkRootKey))
+            linkRoot = found.get(linkRootKey)
+            if linkAdjacency:
+                backlinks = linkAdjacency.getBacklinkRootKeys(linkType)
+            elif linkRoot:
+                backlinks = linkRoot.getBacklinkCollections(linkType)[0]
+            else:
+                problems.append(("Root %s: Has %s link to a root that does not exist: %s" %
+                                 (here, linkType, linkRootKey.urlsafe()), None))
+                continue
+            if pointRoot.key not in backlinks:
+                problems.append(("Point %s. Version %d: Has %s link to %%s with no BACKLINK" %
+                                 (pointRoot.url, point.version, linkType), linkRootKey))
+
+    for linkType in LINK_TYPES:
+        for linkRootKey in pointRoot.getBacklinkCollections(linkType)[0]:
+            linkAdjacency = found.get(PointAdjacency.keyForRoot(linkRootKey))
+            if linkAdjacency and pointRoot.key in linkAdjacency.getLinkRootKeys(linkType):
+                continue
+            linkRoot = found.get(linkRootKey)
+            if not linkRoot:
+                problems.append(("Root %s: Not able to get %s backlink root by link root key %s" %
+                                 (here, linkType, linkRootKey), None))
+                continue
+            linkPoint = found.get(linkRoot.current)
+            if not linkPoint or pointRoot.key not in linkPoint.getLinkedPointsRootKeys(linkType):
+                problems.append(("Root %s: Have %s backlink to %%s but no link root." %
+                                 (here, linkType), linkRootKey))
+    return problems
+
+def _problemMessage(message, neighbourKey, found):
+    if neighbourKey is None:
+        return message
+    neighbour = found.get(neighbourKey)
+    return message % (rootLink(neighbour.url) if neighbour else neighbourKey.urlsafe())
+
+# Checks the roots with a handful of batched gets rather than gets per link: the
+#  roots, then their current versions, adjacency entries and cards, then the
+#  adjacency entries of every root they link to or are linked from, and only for
+#  neighbours whose entries do not settle the check, the roots and their current versions.
+# Returns a list of (pointRoot, messages) for the roots with errors.
+@ndb.tasklet
+def checkRoots_async(rootKeys):
+    roots = yield ndb.get_multi_async(rootKeys)
+    roots = [r for r in roots if r]
+    # There should be one current version, so two are enough to tell, but a few more are listed
+    currentFutures = [Point.query(Point.current == True, ancestor=r.key).fetch_async(
+                      MAX_CURRENTS_REPORTED, keys_only=True) for r in roots]
+    found = dict((r.key, r) for r in roots)
+    yield _getInto_async(found, [r.current for r in roots] +
+                         [PointAdjacency.keyForRoot(r.key) for r in roots] +
+                         [PointCard.keyForRoot(r.key) for r in roots])
+
+    linkRootKeys = set()
+    backlinkRootKeys = []
+    for pointRoot in roots:
+        point = found.get(pointRoot.current)
+        if point:
+            linkRootKeys.update(k for k in (_linkRootKey(link) for linkType, link in _links(point)) if k)
+        for linkType in LINK_TYPES:
+            backlinkRootKeys.extend((pointRoot.key, linkType, k)
+                                    for k in pointRoot.getBacklinkCollections(linkType)[0])
+    yield _getInto_async(found, [PointAdjacency.keyForRoot(k) for k in linkRootKeys] +
+                         [PointAdjacency.keyForRoot(k) for rootKey, linkType, k in backlinkRootKeys])
+
+    fallbackKeys = [k for k in linkRootKeys if not found.get(PointAdjacency.keyForRoot(k))]
+    for rootKey, linkType, k in backlinkRootKeys:
+        adjacency = found.get(PointAdjacency.keyForRoot(k))
+        if not adjacency or rootKey not in adjacency.getLinkRootKeys(linkType):
+            fallbackKeys.append(k)
+    yield _getInto_async(found, fallbackKeys)
+    yield _getInto_async(found, [found[k].current for k in fallbackKeys if found.get(k)])
+
+    problems = []
+    for pointRoot, future in zip(roots, currentFutures):
+        try:
+            problems.append((pointRoot, _rootProblems(pointRoot, future.get_result(), found)))
+        except Exception as e:
+            logging.exception(e)
+            problems.append((pointRoot, [('Exception %s when checking %s' % (str(e), pointRoot.url), None)]))
+    # The neighbours named in messages, usually none, for their URLs
+    yield _getInto_async(found, [k for r, rootProblems in problems for m, k in rootProblems if k])
+    raise ndb.Return([(r, [_problemMessage(m, k, found) for m, k in rootProblems])
+                      for r, rootProblems in problems if rootProblems])
+
+# Returns the keys of the next page of roots to check, the next cursor and whether there are more
+def getRootKeysPage(report, cursor):
+    if not report.incremental:
+        return PointRoot.query().fetch_page(ROOT_PAGE_SIZE, start_cursor=cursor, keys_only=True)
+    versionKeys, nextCursor, more = Point.query(Point.dateEdited >= report.since).fetch_page(
+        VERSION_PAGE_SIZE, start_cursor=cursor, keys_only=True)
+    rootKeys = []
+    for versionKey in versionKeys:
+        if versionKey.parent() not in rootKeys:
+            rootKeys.append(versionKey.parent())
+    return rootKeys, nextCursor, more
+
+def startIntegrityCheck(incremental=True):
+    lastReport = IntegrityReport.getLastComplete() if incremental else None
+    report = IntegrityReport(namespace='',
+                             since=lastReport.started if lastReport else None,
+                             namespaces=[ns for ns in metadata.get_namespaces()])
+    report.put()
+    shards = [IntegrityShard(key=IntegrityShard.keyFor(report.key, ns),
+                             report=report.key, namespace=ns) for ns in report.namespaces]
+    ndb.put_multi(shards)
+    for shard in shards:
+        deferred.defer(checkShardPage, shard.key)
+    logging.info('DBIntegrityCheck: Started %s check of %d namespaces' %
+                 ('incremental' if report.incremental else 'full', len(shards)))
+    return report
+
+# Restarts the namespaces of the latest run that have not finished, from their cursors
+def resumeIntegrityCheck():
+    report = IntegrityReport.getLatest()
+    if not report or report.complete:
+        return None
+    for shard in ndb.get_multi(report.shardKeys()):
+        if shard and not shard.done:
+            deferred.defer(checkShardPage, shard.key)
+    return report
+
+# Checks a page of roots together, or one at a time if that fails, so a root that
+#  cannot be read is reported rather than failing the page's task on every retry
+def checkPage(rootKeys):
+    try:
+        return checkRoots_async(rootKeys).get_result()
+    except Exception as e:
+        logging.exception(e)
+    results = []
+    for rootKey in rootKeys:
+        try:
+            results.extend(checkRoots_async([rootKey]).get_result())
+        except Exception as e:
+            logging.exception(e)
+            results.append((None, ['Exception %s when checking %s' % (str(e), rootKey)]))
+    return results
+
+def checkShardPage(shardKey):
+    shard = shardKey.get()
+    if not shard or shard.done:
+        return
+    report = shard.report.get()
+    previous_namespace = namespace_manager.get_namespace()
+    namespace_manager.set_namespace(shard.namespace)
+    try:
+        cursor = Cursor(urlsafe=shard.cursor) if shard.cursor else None
+        rootKeys, nextCursor, more = getRootKeysPage(report, cursor)
+        results = checkPage(rootKeys)
+    finally:
+        namespace_manager.set_namespace(previous_namespace)
+    for pointRoot, messages in results:
+        logging.info(messages)
+    recordShardPage(shardKey, shard.cursor, len(rootKeys), [m for r, m in results],
+                    nextCursor.urlsafe() if more and nextCursor else None)
+
+# Records a page and queues the next one, unless a retried or resumed task has already
+#  recorded it, in which case the task that did so has queued the next one.
+@ndb.transactional(xg=True)
+def recordShardPage(shardKey, cursor, rootsChecked, rootMessages, nextCursor):
+    shard = shardKey.get()
+    if shard.done or shard.cursor != cursor:
+        return
+    shard.addPage(rootsChecked, rootMessages)
+    if nextCursor:
+        shard.cursor = nextCursor
+        deferred.defer(checkShardPage, shardKey, _transactional=True)
+        shard.put()
+        return
+    shard.done = True
+    report = shard.report.get()
+    if report.namespaceDone(shard.namespace):
+        deferred.defer(sendIntegrityReport, report.key, _transactional=True)
+    ndb.put_multi([shard, report])
+
+def reportMessages(report):
+    messages = []
+    for shard in ndb.get_multi(report.shardKeys()):
+        if not shard:
+            continue
+        messages.append("ooooooooooooooooooooooooooooooooooooooooooooooooooo")
+        messages.append("          NAMESPACE: " + shard.namespace)
+        messages.append("ooooooooooooooooooooooooooooooooooooooooooooooooooo")
+        messages.extend(shard.messages)
+        if shard.messagesDropped:
+            messages.append("%d more messages not kept" % shard.messagesDropped)
+        messages.append("%d roots checked%s. Errors detected in %d roots" %
+                        (shard.rootsChecked, '' if shard.done else ' so far', shard.rootsWithErrors))
+    return messages
+
+def sendIntegrityReport(reportKey):
+    report = reportKey.get()
+    messages = reportMessages(report)
+    message = mail.EmailMessage(
+        sender='aaron@whysaurus.com',
+        to='aaronlifshin@gmail.com',
+        cc='joshua@whysaurus.com',
+        subject='Database Integrity Check Results %s%s' %
+            (str(PST.convert(report.started)), ' (incremental)' if report.incremental else ''),
+        body='\n'.join(messages),
+        html='<br>'.join(messages),
+        reply_to="aaron@whysaurus.com"
+    )
+    message.send()
+
 
 class DBIntegrityCheck(AuthHandler):
     
@@ -119,253 +391,68 @@ class DBIntegrityCheck(AuthHandler):
             'user': self.current_user,
             'currentArea':self.session.get('currentArea')
         }
-        self.response.out.write(self.template_render('message.html', template_values))                
-      
-    def checkPointNew(self, point):
-        try:
-            retVal = False
-            messages = []
-            for linkType in ["supporting", "counter"]:
-                links = point.getStructuredLinkCollection(linkType)   
-                if links and point.current:
-                    for link in links:
-                        # Check the roots of points we link to for backlinks
-                        linkRoot = link.version.parent().get()
-                        backlinks, archiveBacklinks = linkRoot.getBacklinkCollections(linkType)
-                        if not point.key.parent() in backlinks:
-                            linkedPointURL = linkRoot.key.urlsafe()
-                            messages.append(
-                            "Point %s. Version %d: Has %s link to \
-                             <a href=\"/point/%s\">%s</a> with no BACKLINK" \
-                             % (point.url, point.version, linkType, \
-                                 linkRoot.url, linkRoot.url))
-                            retVal = True
-            return retVal, messages
-        except Exception as e:
-            errMsg = 'Exception %s when checking %s' % (point.url, str(e))
-            return True, messages + [errMsg]                                            
-        
-   
-    
-    def checkRoot(self, pointRoot): 
-        try:
-            foundError = False
-            messages = []
-            # linkVal = pointRoot.key.urlsafe()
-            # bigMessage.append("--------  Checking Root %s: <a href=\"%s%s\">%s</a> "\
-            # % (pointRoot.url, constants.ADMIN_DATA_URL, linkVal, pointRoot.key))
-            curPoint = pointRoot.getCurrent()
-            if not curPoint:
-                messages.append("Not able to get current from <a href=\"/point/%s\">%s</a>. " % \
-                (pointRoot.url, pointRoot.url))
-                foundError = True
-            elif not curPoint.current:
-                messages.append("Root <a href=\"/point/%s\">%s</a>: \
-                Current point is not marked current" % \
-                (pointRoot.url, curPoint.title))
-                foundError = True
-    
-            pointQuery = Point.query(ancestor=pointRoot.key)
-            points = pointQuery.fetch()
-            curCount = 0
-            curURLs = ""
-            for point in points:
-                if point.current:
-                    curCount = curCount + 1
-                    curURLs = curURLs + point.key.urlsafe()+ ","
-            if curCount != 1:
-                messages.append("Root <a href=\"/point/%s\">%s</a>: \
-                Found %d points marked current. URL keys: %s" % \
-                (pointRoot.url, pointRoot.url, \
-                 curCount, curURLs))
-                messages.append('<a href=\"/job/cleanCurrents/%s\"> \
-                    Clean multiple current points</a>' % pointRoot.url)
-                foundError = True
-                
-            for linkType in ["supporting", "counter"]:
-                linkPoints, archivedLinkPoints = \
-                    pointRoot.getBacklinkCollections(linkType)
-                for linkRootKey in linkPoints:
-                    linkRoot = linkRootKey.get()
-                    if not linkRoot:
-                        messages.append("Root <a href=\"/point/%s\">%s</a>: \
-                        Not able to get %s backlink root by link root key %s" % \
-                        ( pointRoot.url, pointRoot.url, \
-                         linkType, linkRootKey))
-                        foundError = True
-                        continue
-                    currentLinkPoint = linkRoot.getCurrent()
-                    linkedPoints = currentLinkPoint.getLinkedPointsRootKeys(linkType)
-                    if not pointRoot.key in linkedPoints:
-                        versionKeyURL = currentLinkPoint.key.urlsafe()
-                        messages.append("Root <a href=\"/point/%s\">%s</a>: \
-                             Have %s backlink to ' \
-                            <a href=\"%s%s\">%s</a> but no link root." % \
-                            ( pointRoot.url, pointRoot.url,\
-                             linkType, currentLinkPoint.url, \
-                             currentLinkPoint.title))
-                        foundError = True  
-            return foundError, messages
-        except Exception as e:
-            errMsg = 'Exception %s when checking %s' % (pointRoot.url, str(e))
-            return True, messages + [errMsg]
-    
-    def checkNamespace(self, areaName): 
-        bigMessage = []
-        noErrors = 0
-        pointCount = 0
-        bigMessage.append("ooooooooooooooooooooooooooooooooooooooooooooooooooo")
-        bigMessage.append("          NAMESPACE: " + areaName)
-        bigMessage.append("ooooooooooooooooooooooooooooooooooooooooooooooooooo")
-        
-        namespace_manager.set_namespace(areaName) 
-        
-        # Take every point version
-        query = Point.query()
-        for point in query.iter():
-            foundError, newMessages = self.checkPoint(point)   
-            bigMessage = bigMessage + newMessages      
-            if not foundError:
-                noErrors = noErrors + 1
-            pointCount = pointCount + 1
-            
-        bigMessage.append( "%d points checked. No errors detected in %d points" % (pointCount, noErrors))
-        
-        noErrors = 0
-        rootCount = 0
-        query = PointRoot.query()
-        for pointRoot in query.iter():
-            foundError, newMessages = self.checkRoot(pointRoot)
-            bigMessage = bigMessage + newMessages
-                      
-            if not foundError:
-                noErrors = noErrors + 1
-            rootCount = rootCount + 1
-            
-        bigMessage.append( "%d roots checked. No errors detected in %d roots" % (rootCount, noErrors))        
-        return bigMessage
-    
-    def checkDBPoint(self, pointURL):
-        point, pointRoot = Point.getCurrentByUrl(pointURL)
-        
-        if point:
-            isError1, messages1 = self.checkPointNew(point)
-            
-        if pointRoot:
-            isError2, messages2 = self.checkRoot(pointRoot)
-        
-        if not isError1 and not isError2:
-            message = 'No errors were found.'
-        else:
-            messages = []
-            if messages1:
-                messages += messages1
-            if messages2:
-                messages += messages2
-            if messages == []:
-                messages = ['Errors generated, but no messages generated.']
-            
+        self.response.out.write(self.template_render('message.html', template_values))
+
+    def renderMessages(self, messages):
         template_values = {
-            'messages': messages,            
+            'messages': messages,
             'user': self.current_user,
             'currentArea':self.session.get('currentArea')
         }
-        self.response.out.write(self.template_render('message.html', template_values))        
-      
-        
-    
+        self.response.out.write(self.template_render('message.html', template_values))
+
+    def checkDBPoint(self, pointURL):
+        point, pointRoot = Point.getCurrentByUrl(pointURL)
+        if not pointRoot:
+            self.renderMessages(['Could not find point'])
+            return
+        results = checkRoots_async([pointRoot.key]).get_result()
+        self.renderMessages(results[0][1] if results else ['No errors were found.'])
+
     # This method is a static method so that it cat be used inside of pointRootsMap
     #   (see AaronTask.py)
     @staticmethod
     def checkDBPointRoot(pointRoot):
         logging.info('Checking %s ' % pointRoot.url)
-        point, pr = Point.getCurrentByUrl(pointRoot.url)
-        isError1 = False
-        isError2 = False
-        messages1 = []
-        messages2 = []
-        
-        dbc = DBIntegrityCheck()
-        if point:
-            isError1, messages1 = dbc.checkPoint(point)
-            
-        if pointRoot:
-            isError2, messages2 = dbc.checkRoot(pointRoot)
-        
-        if not isError1 and not isError2:
-            message = 'No errors were found in %s.' % pointRoot.url
-            logging.info(message)                      
-            
-        else:
-            message = []
-            if messages1:
-                message = message + messages1
-            if messages2:
-                message = message + messages2
-            if message == []:
-                message = ['Errors generated, but no messages generated.']
-            if isError1:
-                logging.info(messages1)
-            if isError2:
-                logging.info(messages2)  
-            for m in message:
-                logging.info(message)                      
-        
+        results = checkRoots_async([pointRoot.key]).get_result()
+        if not results:
+            logging.info('No errors were found in %s.' % pointRoot.url)
+            return []
+        message = results[0][1]
+        for m in message:
+            logging.info(m)
         return message
 
+    def showReport(self, reportID):
+        report = IntegrityReport.get_by_id(int(reportID), namespace='')
+        if not report:
+            self.renderMessages(['Could not find report'])
+            return
+        status = 'Complete' if report.complete else \
+            '%d of %d namespaces done' % (len(report.namespacesDone), len(report.namespaces))
+        self.renderMessages(['%s check started %s. %s' % (
+            'Incremental' if report.incremental else 'Full',
+            str(PST.convert(report.started)), status)] + reportMessages(report))
 
+    # Starts a check, which emails its report when every namespace is done.
+    # Checks only the roots edited since the last complete check unless full is given,
+    #  or continues the latest check if it stopped before finishing when resume is given.
     def get(self):
-        mode = self.request.get('mode')     
-
-        bigMessage = []
-        
-        namespace_manager.set_namespace('') 
-        namespaces = PrivateArea.query()
-        for pa in namespaces.iter():
-            logging.info("Looking at private area: " + pa.name)
-            bigMessage = bigMessage + self.checkNamespace(pa.name)
-        bigMessage = bigMessage + self.checkNamespace('')
-         
-        template_values = {
-            'messages': bigMessage,
-            'user': self.current_user,
-            'currentArea':self.session.get('currentArea')
-        }
-                
+        mode = self.request.get('mode')
+        if self.request.get('resume'):
+            report = resumeIntegrityCheck()
+            if not report:
+                self.renderMessages(['There is no unfinished check to resume'])
+            else:
+                self.renderMessages(['Resumed check. See the <a href="/job/DBIntegrityReport/%d">report</a>.' %
+                                     report.key.id()])
+            return
 
+        report = startIntegrityCheck(incremental=not self.request.get('full'))
+        reportLink = '<a href="/job/DBIntegrityReport/%d">report</a>' % report.key.id()
         if mode and mode == 'screen':
-            self.response.out.write(self.template_render('message.html', template_values))                    
+            self.renderMessages(['Started check. See the %s.' % reportLink])
         else:
-            path = os.path.join(os.path.dirname(__file__), '../templates/dbcheck.html')
-            
-            # old version, delete once the new version is working:            
-            # mail.send_mail(sender='aaron@whysaurus.com',
-            #    to='aaronlifshin@gmail.com',
-            #    subject='Database Integrity Check Results %s' % str(PST.convert(datetime.datetime.now())),
-            #    html=template.render(path, template_values),
-            #    body=str(bigMessage),
-            #    reply_to="aaron@whysaurus.com"
-            #    )
-                
-            # new version:
-            message = mail.EmailMessage(
-                sender='aaron@whysaurus.com',
-                to='aaronlifshin@gmail.com',
-                cc='joshua@whysaurus.com',
-                subject='Database Integrity Check Results %s' % str(PST.convert(datetime.datetime.now())),
-                body=str(bigMessage),
-                reply_to="aaron@whysaurus.com"
-            )                    
-            if html:
-                message.html = template.render(path, template_values),
-            message.send()
-            # (end of new version)                    
-                
+            # Only a new run queues the next night's, so there is one nightly chain
             self.queueNightlyTask()
-            template_values = {
-                'message': "Sent email successfully. Queued nightly task.",
-                'user': self.current_user,
-                'currentArea':self.session.get('currentArea')
-            }
-            self.response.out.write(self.template_render('message.html', template_values))        
-            
+            self.renderMessages(['Started check. See the %s. Queued nightly task.' % reportLink])
@@ -5,6 +5,7 @@ from authhandler import AuthHandler
 from models.point import Point, FeaturedPoint
 from models.source import Source
 from models.reportEvent import ReportEvent
+from models.whysaurusexception import WhysaurusException
 
 # AJAX. CALLED FROM THE POINT VIEW PAGE
 class EditPoint(AuthHandler):
@@ -14,6 +15,11 @@ class EditPoint(AuthHandler):
 
             resultJSON = json.dumps({'result': False})
             oldPoint, oldPointRoot = Point.getCurrentByUrl(self.request.get('urlToEdit'))
+            # The edit is made from the version the user had open, which may since have
+            # been replaced. transactionalUpdate merges it into the current one.
+            baseVersion = self.request.get('baseVersion')
+            if oldPoint and baseVersion and int(baseVersion) != oldPoint.version:
+                oldPoint = Point.getVersion(oldPointRoot.key, int(baseVersion)) or oldPoint
             sourcesURLs=json.loads(self.request.get('sourcesURLs')) \
                 if self.request.get('sourcesURLs') else None
             sourcesNames=json.loads(self.request.get('sourcesNames')) \
@@ -27,17 +33,22 @@ class EditPoint(AuthHandler):
                 resultJSON = json.dumps({'result': False, 'error': 'This account cannot edit points.'})
             else:
                 sources = Source.constructFromArrays(sourcesURLs, sourcesNames, oldPoint.key)
-                newVersion = oldPoint.update(
-                    newTitle=self.request.get('title'),
-                    newContent=self.request.get('content'),
-                    newSummaryText=self.request.get('plainText'),
-                    user=self.current_user,
-                    imageURL=self.request.get('imageURL'),
-                    imageAuthor=self.request.get('imageAuthor'),
-                    imageDescription=self.request.get('imageDescription'),
-                    sourcesToAdd=sources,
-                    sourceKeysToRemove= sourcesToRemove            
-                )
+                error = None
+                try:
+                    newVersion = oldPoint.update(
+                        newTitle=self.request.get('title'),
+                        newContent=self.request.get('content'),
+                        newSummaryText=self.request.get('plainText'),
+                        user=self.current_user,
+                        imageURL=self.request.get('imageURL'),
+                        imageAuthor=self.request.get('imageAuthor'),
+                        imageDescription=self.request.get('imageDescription'),
+                        sourcesToAdd=sources,
+                        sourceKeysToRemove= sourcesToRemove            
+                    )
+                except WhysaurusException as e:
+                    newVersion = None
+                    error = str(e)
                 if newVersion:
                     sources = newVersion.getSources()   
                     sourcesHTML = self.template_render('sources.html', {'sources':sources})
@@ -55,8 +66,10 @@ class EditPoint(AuthHandler):
                         'sourcesHTML': sourcesHTML
                     })
                     ReportEvent.queueEventRecord(user.key.urlsafe(), newVersion.key.urlsafe(), None, "Edit Point")
+                elif error:
+                    resultJSON = json.dumps({'result': False, 'error': error})
                 else:
-                    # This is the only way newVersion will fail
+                    # This is the only other way newVersion will fail
                     resultJSON = json.dumps({'result': False, 'error': 'You appear not to be logged in.'})
                 
         self.response.headers["Content-Type"] = 'application/json; charset=utf-8'
@@ -1,6 +1,7 @@
 import os
 import constants
 import json
+import logging
 
 from google.appengine.ext import ndb
 
@@ -8,6 +9,7 @@ from google.appengine.ext.webapp import template
 
 from authhandler import AuthHandler
 from models.point import PointRoot
+from models.whysaurusexception import WhysaurusException
 
 class GetPointsList(AuthHandler):
     @ndb.toplevel        
@@ -23,20 +25,11 @@ class GetPointsList(AuthHandler):
         # NO LONGER USING "most ribbons"
         # if listType == 'topAwards':
         #    points = PointRoot.getTopAwardPoints(user)
-        if listType == 'recentActivityAll':
-            points = yield PointRoot.getRecentActivityAll_async(user)
-        if listType == 'topViewed':            
-            points = yield PointRoot.getTopViewedPoints_async(user)
-        elif listType == 'topRated':
-            points = yield PointRoot.getTopRatedPoints_async(user)
-        elif listType == 'editorsPics':
-            points = yield PointRoot.getEditorsPicks_async(user)
-        elif listType == 'lowEngagement':
-            points = yield PointRoot.getLowEngagementPoints_async(user)
-        elif listType == 'lowQuality':
-            points = yield PointRoot.getLowQualityPoints_async(user)
-        elif listType == 'highestScore':
-            points = yield PointRoot.getHighestScorePoints_async(user)
+        # Lists are served from their materialized feeds (see PointFeed)
+        try:
+            points = yield PointRoot.getListPoints_async(listType, user)
+        except WhysaurusException as e:
+            logging.warning(str(e))
 
         template_values = {
             'points':points
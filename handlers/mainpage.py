@@ -61,7 +61,7 @@ class MainPage(AuthHandler):
         if self.logged_in:
             user = self.current_user
             
-        newPoints = yield PointRoot.getRecentCurrentPoints_async(user)        
+        newPoints = yield PointRoot.getListPoints_async('recentCurrent', user)
         featuredPoint = FeaturedPoint.getFeaturedPoint()
         
         # GET RECENTLY VIEWED
@@ -1,6 +1,7 @@
 import json
 import logging
 from google.appengine.ext import ndb
+from google.appengine.datastore.datastore_query import Cursor
 from google.appengine.api import app_identity
 
 from authhandler import AuthHandler
@@ -9,6 +10,8 @@ from models.whysaurusexception import WhysaurusException
 from models.timezones import PST
 from models.notification import Notification
 from models.follow import Follow
+from models.point import Point
+from models.notificationEmailRun import NotificationEmailRun
 
 class NotificationHandler(AuthHandler):
     # This is called by the task queue
@@ -18,18 +21,26 @@ class NotificationHandler(AuthHandler):
         sourceUserUrlsafe = self.request.get('userKey')
         additionalText = self.request.get('additionalText')        
 
+        cursorUrlsafe = self.request.get('cursor')
+
         pointRootKey = ndb.Key(urlsafe=rootKeyUrlsafe)
         sourceUserKey = ndb.Key(urlsafe=sourceUserUrlsafe)
-        follows = Follow.getActiveFollowsForPoint(pointRootKey)
-        
-        for f in follows:
-            if f.user != sourceUserKey:
-                Notification.createNotificationFromFollow(self, 
-                                                          f, pointRootKey, 
-                                                          sourceUserKey, 
-                                                          int(notifyReasonCode),
-                                                          additionalText,
-                                                           )
+        follows, nextCursor, more = Follow.getActiveFollowsPageForPoint(
+            pointRootKey, Cursor(urlsafe=cursorUrlsafe) if cursorUrlsafe else None)
+
+        Notification.createNotificationsFromFollows(self, 
+                                                    [f for f in follows if f.user != sourceUserKey],
+                                                    pointRootKey, 
+                                                    sourceUserKey, 
+                                                    int(notifyReasonCode),
+                                                    additionalText)
+
+        # Followers beyond this page are notified by a continuation task, queued once
+        #  this page is written
+        if more and nextCursor:
+            Point.addNotificationTask(pointRootKey, sourceUserKey, notifyReasonCode,
+                                      additionalText, cursor=nextCursor,
+                                      parentTaskName=self.request.headers.get('X-AppEngine-TaskName'))
                 
     def NewNotificationChannel(self):
         user = self.current_user
@@ -71,6 +82,24 @@ class NotificationHandler(AuthHandler):
             return
         WhysaurusUser.sendNotificationEmails(self)
         self.response.out.write('') # succeed!
+
+    # This is called by the notificationEmails task queue, one page of users per task
+    def sendNotificationEmailsPage(self):
+        runId = self.request.get('runId')
+        frequency = self.request.get('frequency')
+        cursorUrlsafe = self.request.get('cursor')
+        emailsSent, errors = WhysaurusUser.sendNotificationEmailsPage(
+            self, runId, frequency, cursorUrlsafe)
+        self.response.out.write('Sent %d. Errors %d' % (emailsSent, errors))
+
+    def notificationEmailStatus(self):
+        runs = NotificationEmailRun.getLatestRuns()
+        template_values = {
+            'messages': [run.statusText for run in runs] if runs else ['No notification email runs found'],
+            'user': self.current_user,
+            'currentArea':self.session.get('currentArea')
+        }
+        self.response.out.write(self.template_render('message.html', template_values))
         
         
         
@@ -2,7 +2,10 @@ import os
 import constants
 import json
 
+from google.appengine.ext import ndb
 from google.appengine.ext.webapp import template
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.api.datastore_errors import BadValueError
 
 from authhandler import AuthHandler
 from models.point import Point
@@ -26,6 +29,29 @@ class PointHistory(AuthHandler):
         }
         self.response.out.write(json.dumps(json_values))
 
+    # AJAX. A page of a point's versions as JSON, newest first, with a cursor for the next
+    @ndb.toplevel
+    def getHistoryPage(self):
+        resultJSON = json.dumps({'result': False})
+        try:
+            pageSize = int(self.request.get('pageSize', Point.HISTORY_PAGE_SIZE))
+        except ValueError:
+            pageSize = Point.HISTORY_PAGE_SIZE
+        pageSize = max(1, min(pageSize, Point.HISTORY_MAX_PAGE_SIZE))
+        self.response.headers["Content-Type"] = 'application/json; charset=utf-8'
+        try:
+            cursor = Cursor(urlsafe=self.request.get('cursor')) if self.request.get('cursor') else None
+        except BadValueError:
+            self.response.out.write(resultJSON)
+            return
+
+        point, pointRoot = Point.getCurrentByUrl(self.request.get('pointUrl'))
+        if pointRoot:
+            page = Point.getHistoryPageJSON_async(pointRoot.key, cursor, pageSize).get_result()
+            page['result'] = True
+            resultJSON = json.dumps(page)
+        self.response.out.write(resultJSON)
+
     """ should this get replaced by adding fields to the database?  """  
     def getPointCreator(self):
         result = {'result': False}
@@ -4,9 +4,11 @@ import json
 import logging
 
 from google.appengine.ext.webapp import template
+from google.appengine.ext import ndb
 from authhandler import AuthHandler
 from models.notification import Notification
 from models.whysaurususer import WhysaurusUser
+from models.point import getPointCards_async
 from models.whysaurusexception import WhysaurusException
 from google.appengine.api import namespace_manager
 
@@ -14,27 +16,66 @@ from google.appengine.api import namespace_manager
 class Profile(AuthHandler):
     
     def makeTemplateValues(self, user, profileUser):
+        return self.makeTemplateValues_async(user, profileUser).get_result()
+
+    # Every list on the page is gathered in two rounds of parallel RPCs:
+    # the keys, counts and notifications, then the point cards of all of them together
+    @ndb.tasklet
+    def makeTemplateValues_async(self, user, profileUser):
         viewingOwnPage = False
         if user and profileUser.url == user.url:
             viewingOwnPage = True
-        if user:
-            user.getActiveNotifications()
-                    
+
+        # The created and edited lists are paged separately
+        createdCursor = self.request.get('createdCursor')
+        editedCursor = self.request.get('editedCursor')
+
+        # Started first so they run alongside the lists below
+        activeNotificationsFuture = user.getActiveNotifications_async() if user else None
+        notificationsFuture = Notification.getAllNotificationsForUser_async(
+            profileUser.key) if viewingOwnPage else None
+
+        createdPage, editedPage, activity, createdCount, editedCount = yield (
+            profileUser.getPointRootKeysPage_async('created', createdCursor or None),
+            profileUser.getPointRootKeysPage_async('edited', editedCursor or None),
+            profileUser.getActivity_async(),
+            profileUser.getPointCount_async('created'),
+            profileUser.getPointCount_async('edited'))
+        if activeNotificationsFuture:
+            yield activeNotificationsFuture
+        notifications = (yield notificationsFuture) if notificationsFuture else []
+        createdKeys, nextCreatedCursor, moreCreated = createdPage
+        editedKeys, nextEditedCursor, moreEdited = editedPage
+        recentKeys = profileUser.filterKeylistByCurrentNamespace(
+            activity.recentlyViewedRootKeys) if viewingOwnPage else []
+
+        cards, _ = yield (
+            getPointCards_async(list(set(createdKeys + editedKeys + recentKeys))),
+            Notification.prefetchReferences_async(notifications))
+        cardsByRoot = dict((card.key.parent(), card) for card in cards)
+        createdPoints = [cardsByRoot[k] for k in createdKeys if k in cardsByRoot]
+        editedPoints = [cardsByRoot[k] for k in editedKeys if k in cardsByRoot]
+        recentlyViewed = [cardsByRoot[k] for k in recentKeys if k in cardsByRoot]
+
         template_values = {
             'user': self.current_user,
             'profileUser': profileUser,
             'viewingOwnPage': viewingOwnPage,
-            'createdPoints': profileUser.getCreated(),
-            'editedPoints': profileUser.getEdited(),
+            'createdPoints': createdPoints,
+            'editedPoints': editedPoints,
+            'nextCreatedCursor': nextCreatedCursor,
+            'nextEditedCursor': nextEditedCursor,
+            # The page each list is on, kept when the other one is paged
+            'createdCursor': createdCursor,
+            'editedCursor': editedCursor,
             'currentArea': self.session.get('currentArea'),
             'currentAreaDisplayName':self.session.get('currentAreaDisplayName')
         }
         if viewingOwnPage:
-            template_values['recentlyViewed'] = profileUser.getRecentlyViewed()
-            template_values['notifications'] = Notification.getAllNotificationsForUser(profileUser.key)
-
+            template_values['recentlyViewed'] = recentlyViewed
+            template_values['notifications'] = notifications
 
-        return template_values
+        raise ndb.Return(template_values)
 
     def post(self, userURL):
         userNamespace = namespace_manager.get_namespace()        
@@ -51,7 +51,8 @@ class ViewPoint(AuthHandler):
             # We need to get the recently viewed points here
             # Because the user can add them as counter/supporting points
             if user:                
-                vote, relevanceVotes, recentlyViewed, sources, supportingPoints, counterPoints = yield \
+                vote, relevanceVotes, recentlyViewed, sources, supportingPoints, counterPoints, \
+                    supportedPoints, counteredPoints = yield \
                     user.getVote_async(point.key.parent()), \
                     user.getRelevanceVotes_async(point), \
                     user.getRecentlyViewed_async( \
@@ -60,17 +61,23 @@ class ViewPoint(AuthHandler):
                         point.getLinkedPointsRootKeys("counter")), \
                     point.getSources_async(), \
                     point.getLinkedPoints_async("supporting", user), \
-                    point.getLinkedPoints_async("counter", user)
+                    point.getLinkedPoints_async("counter", user), \
+                    pointRoot.getBacklinkPoints_async("supporting"), \
+                    pointRoot.getBacklinkPoints_async("counter")
                 point.addRelevanceVotes(relevanceVotes, supportingPoints, counterPoints)
 
                 addedToRecentlyViewed = user.updateRecentlyViewed(point.key.parent())
             else:
-                sources, supportingPoints, counterPoints = yield point.getSources_async(), \
+                sources, supportingPoints, counterPoints, supportedPoints, counteredPoints = yield \
+                    point.getSources_async(), \
                     point.getLinkedPoints_async("supporting", None), \
-                    point.getLinkedPoints_async("counter", None)
+                    point.getLinkedPoints_async("counter", None), \
+                    pointRoot.getBacklinkPoints_async("supporting"), \
+                    pointRoot.getBacklinkPoints_async("counter")
                 recentlyViewed = None
             
             # For now add to a point's view count if user is not logged in or if view point is added to the recently viewed list
+            # This writes a view counter shard, not the point root
             if addedToRecentlyViewed or not user:
                 viewCountFuture = pointRoot.addViewCount()
         
@@ -85,8 +92,8 @@ class ViewPoint(AuthHandler):
                 'recentlyViewedPoints': recentlyViewed,
                 'supportingPoints': supportingPoints,
                 'counterPoints': counterPoints,
-                'supportedPoints':pointRoot.getBacklinkPoints("supporting"),
-                'counteredPoints':pointRoot.getBacklinkPoints("counter"),
+                'supportedPoints':supportedPoints,
+                'counteredPoints':counteredPoints,
                 'sources': sources,
                 'user': user,
                 'voteValue': voteValue,
@@ -126,7 +133,7 @@ class ViewPoint(AuthHandler):
             # Try to find a redirector
             newURL = RedirectURL.getByFromURL(url)
             if newURL:
-                point, pointRoot = Point.getCurrentByUrl(url)   
+                point, pointRoot = Point.getCurrentByUrl(newURL)   
         if pointRoot:
             template_values = {
                 'user': self.current_user,                
@@ -141,6 +148,33 @@ class ViewPoint(AuthHandler):
         self.response.headers["Content-Type"] = 'application/json; charset=utf-8'
         self.response.out.write(resultJSON) 
                   
+    # AJAX. The argument tree below a point to a given depth, for the argument map
+    @ndb.toplevel
+    def getPointTree(self):
+        resultJSON = json.dumps({'result': False})
+
+        url = self.request.get('url')
+        try:
+            depth = int(self.request.get('depth', Point.TREE_DEFAULT_DEPTH))
+            maxNodes = int(self.request.get('maxNodes', Point.TREE_DEFAULT_NODES))
+        except ValueError:
+            depth = Point.TREE_DEFAULT_DEPTH
+            maxNodes = Point.TREE_DEFAULT_NODES
+        depth = max(1, min(depth, Point.TREE_MAX_DEPTH))
+        maxNodes = max(1, min(maxNodes, Point.TREE_MAX_NODES))
+
+        point, pointRoot = Point.findCurrent_async(url).get_result()
+        if point:
+            tree = point.getTree_async(self.current_user, depth, maxNodes).get_result()
+            resultJSON = json.dumps({
+                'result': True,
+                'depth': depth,
+                'tree': tree
+            })
+
+        self.response.headers["Content-Type"] = 'application/json; charset=utf-8'
+        self.response.out.write(resultJSON)
+
     def getPointContent(self):  
         resultJSON = json.dumps({'result': False})
 
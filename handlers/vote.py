@@ -9,16 +9,16 @@ class Vote(AuthHandler):
         resultJSON = json.dumps({'result': False})
         point, pointRoot = Point.getCurrentByUrl(self.request.get('pointURL'))
         parentPointURL = self.request.get('parentPointURL')
-        parentPoint = None
-        if parentPointURL:
-            parentPoint, parentPointRoot = Point.getCurrentByUrl(parentPointURL)
         user = self.current_user
         if point and user:
             if user.addVote(point, int(self.request.get('vote'))):
+                # This also refreshes the stored score of the points linking to this one
                 point.updateBacklinkedSorts(pointRoot)
                 parentNewScore = None
-                if parentPoint:
-                    parentNewScore = parentPoint.pointValue()
+                if parentPointURL:
+                    parentPoint, parentPointRoot = Point.getCurrentByUrl(parentPointURL)
+                    if parentPoint:
+                        parentNewScore = parentPoint.pointValue()
                 resultJSON = json.dumps({'result': True,
                                          'newVote': self.request.get('vote'),
                                          'newScore': point.pointValue(),
@@ -0,0 +1,102 @@
+import time
+import logging
+import threading
+import httplib2
+
+from collections import OrderedDict
+from oauth2client.client import GoogleCredentials
+
+FIREBASE_URL = "https://whysaurus.firebaseio.com"
+# FIREBASE_URL = "https://whysaurustest.firebaseio.com"
+FIREBASE_SCOPES = [
+    'https://www.googleapis.com/auth/firebase.database',
+    'https://www.googleapis.com/auth/userinfo.email']
+
+
+class FirebaseClient(object):
+    """Client for the Firebase realtime database REST API, shared by the instance.
+
+    Keeps one httplib2.Http per thread so connections are reused between
+    messages, and caches the access token until shortly before it expires.
+    To run against a local HTTP stand-in, pass its base URL and no credentials.
+    """
+    TOKEN_EXPIRY_MARGIN_SECS = 60
+    DEFAULT_TOKEN_LIFETIME_SECS = 3000
+
+    def __init__(self, baseURL=FIREBASE_URL, credentials=None, timeout=10):
+        self.baseURL = baseURL
+        self.credentials = credentials
+        self.timeout = timeout
+        self._local = threading.local()
+        self._tokenLock = threading.Lock()
+        self._accessToken = None
+        self._accessTokenExpires = 0
+
+    @classmethod
+    def fromApplicationDefault(cls, baseURL=FIREBASE_URL):
+        # Use application default credentials to make the Firebase calls
+        # https://firebase.google.com/docs/reference/rest/database/user-auth
+        credentials = GoogleCredentials.get_application_default().create_scoped(FIREBASE_SCOPES)
+        return cls(baseURL, credentials)
+
+    def _getHttp(self):
+        # httplib2.Http is not thread safe, so each thread gets its own
+        http = getattr(self._local, 'http', None)
+        if http is None:
+            http = httplib2.Http(timeout=self.timeout)
+            self._local.http = http
+        return http
+
+    def _getAccessToken(self, forceRefresh=False):
+        if self.credentials is None:
+            return None
+        with self._tokenLock:
+            now = time.time()
+            if forceRefresh or self._accessToken is None or \
+                    now >= self._accessTokenExpires - self.TOKEN_EXPIRY_MARGIN_SECS:
+                if forceRefresh:
+                    self.credentials.refresh(self._getHttp())
+                tokenInfo = self.credentials.get_access_token()
+                self._accessToken = tokenInfo.access_token
+                self._accessTokenExpires = now + (tokenInfo.expires_in or
+                                                  self.DEFAULT_TOKEN_LIFETIME_SECS)
+            return self._accessToken
+
+    def request(self, path, method, body=None):
+        url = '{}/{}.json'.format(self.baseURL, path)
+        response, content = None, None
+        # A 401 means the cached token was revoked early: refresh it and try once more
+        for forceRefresh in (False, True):
+            headers = {}
+            accessToken = self._getAccessToken(forceRefresh)
+            if accessToken:
+                headers['Authorization'] = 'Bearer ' + accessToken
+            response, content = self._getHttp().request(url, method, body=body, headers=headers)
+            if response.status != 401 or self.credentials is None:
+                break
+        if response.status >= 300:
+            logging.warning('Firebase %s %s returned %d: %s' % (method, path, response.status, content))
+        return response, content
+
+    def patchChannel(self, channelToken, message):
+        return self.request('channels/' + channelToken, 'PATCH', body=message)
+
+    def deleteChannel(self, channelToken):
+        return self.request('channels/' + channelToken, 'DELETE')
+
+    def patchChannels(self, messages):
+        """Sends a list of (channel token, message) pairs.
+
+        A channel only holds its latest message, so messages for the same token
+        are coalesced and only the last one is sent. Returns the number of PATCHes.
+        """
+        latestMessages = OrderedDict()
+        for channelToken, message in messages:
+            latestMessages.pop(channelToken, None)
+            latestMessages[channelToken] = message
+        for channelToken, message in latestMessages.iteritems():
+            try:
+                self.patchChannel(channelToken, message)
+            except Exception, e:
+                logging.exception(e)
+        return len(latestMessages)
@@ -19,14 +19,31 @@ class Follow(ndb.Model):
             f = Follow(user=userKey, pointRoot = pointRootKey, reason=reason)
             f.put()
         return f
-    
-            
+
+    # The checks for existing follows run in parallel and the new ones are written
+    # with one put_multi
+    @classmethod
+    def createFollows(cls, userKey, pointRootKeys, reason):
+        futures = [cls.query(ndb.AND(cls.user == userKey, cls.pointRoot == k)).get_async()
+                   for k in pointRootKeys]
+        follows = [Follow(user=userKey, pointRoot=k, reason=reason)
+                   for k, future in zip(pointRootKeys, futures) if not future.get_result()]
+        if follows:
+            ndb.put_multi(follows)
+        return follows
+
 
     @classmethod
     def getActiveFollowsForPoint(cls, pointRootKey):
         q = cls.query(ndb.AND(cls.pointRoot == pointRootKey, cls.shouldFollow == True))     
         follows = q.fetch(100)
         return follows
+
+    # Returns follows, next cursor, more
+    @classmethod
+    def getActiveFollowsPageForPoint(cls, pointRootKey, cursor=None, pageSize=100):
+        q = cls.query(ndb.AND(cls.pointRoot == pointRootKey, cls.shouldFollow == True))     
+        return q.fetch_page(pageSize, start_cursor=cursor)
     
     
         
@@ -0,0 +1,69 @@
+import datetime
+
+from google.appengine.ext import ndb
+
+# A shard keeps this many messages; past that it only counts them, to stay well
+#  under the entity size limit however broken a namespace is.
+MAX_SHARD_MESSAGES = 500
+
+# One run of the database integrity check.
+# Each namespace is checked by its own chain of tasks, which records its cursor
+#  and results in an IntegrityShard after every page, so a run that stops can be
+#  resumed from where each namespace got to.
+# Reports and shards are always in the default namespace.
+class IntegrityReport(ndb.Model):
+    started = ndb.DateTimeProperty(auto_now_add=True)
+    finished = ndb.DateTimeProperty(indexed=False)
+    # Incremental runs check only the roots with versions written since the last complete run
+    since = ndb.DateTimeProperty(indexed=False)
+    namespaces = ndb.StringProperty(repeated=True, indexed=False)
+    namespacesDone = ndb.StringProperty(repeated=True, indexed=False)
+    complete = ndb.BooleanProperty(default=False)
+
+    @property
+    def incremental(self):
+        return self.since is not None
+
+    @classmethod
+    def getLatest(cls):
+        return cls.query(namespace='').order(-cls.started).get()
+
+    @classmethod
+    def getLastComplete(cls):
+        return cls.query(cls.complete == True, namespace='').order(-cls.started).get()
+
+    def shardKeys(self):
+        return [IntegrityShard.keyFor(self.key, ns) for ns in self.namespaces]
+
+    # Returns True if this was the last namespace to finish
+    def namespaceDone(self, namespace):
+        if namespace not in self.namespacesDone:
+            self.namespacesDone.append(namespace)
+        if len(self.namespacesDone) == len(self.namespaces):
+            self.complete = True
+            self.finished = datetime.datetime.now()
+        return self.complete
+
+
+class IntegrityShard(ndb.Model):
+    report = ndb.KeyProperty(indexed=False)
+    namespace = ndb.StringProperty(indexed=False)
+    cursor = ndb.StringProperty(indexed=False) # urlsafe, None before the first page
+    done = ndb.BooleanProperty(default=False, indexed=False)
+    rootsChecked = ndb.IntegerProperty(default=0, indexed=False)
+    rootsWithErrors = ndb.IntegerProperty(default=0, indexed=False)
+    messages = ndb.TextProperty(repeated=True)
+    messagesDropped = ndb.IntegerProperty(default=0, indexed=False)
+
+    @staticmethod
+    def keyFor(reportKey, namespace):
+        return ndb.Key('IntegrityShard', '%d|%s' % (reportKey.id(), namespace), namespace='')
+
+    # Adds the results of a page: the messages of each root with errors
+    def addPage(self, rootsChecked, rootMessages):
+        self.rootsChecked = self.rootsChecked + rootsChecked
+        self.rootsWithErrors = self.rootsWithErrors + len(rootMessages)
+        for messages in rootMessages:
+            room = max(MAX_SHARD_MESSAGES - len(self.messages), 0)
+            self.messages.extend(messages[:room])
+            self.messagesDropped = self.messagesDropped + len(messages[room:])
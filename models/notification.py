@@ -4,19 +4,16 @@ import logging
 import constants
 import os
 import json
-import httplib2
 
 from google.appengine.ext import ndb
 from follow import Follow
 from google.appengine.api import channel
 from google.appengine.ext.webapp import template
-from oauth2client.client import GoogleCredentials
+from firebaseclient import FirebaseClient
+from point import getCurrentPointsByRootKeys_async
 
-FIREBASE_URL = "https://whysaurus.firebaseio.com"
-# FIREBASE_URL = "https://whysaurustest.firebaseio.com"
-FIREBASE_SCOPES = [
-    'https://www.googleapis.com/auth/firebase.database',
-    'https://www.googleapis.com/auth/userinfo.email']
+# One client per instance, so the connection and access token are reused across requests
+_firebaseClient = None
 
 class Notification(ndb.Model):
     targetUser = ndb.KeyProperty()
@@ -105,6 +102,17 @@ class Notification(ndb.Model):
         notificationHTML = self.handler.template_render(
             'notificationMenu.html', 
             { 'notification': self})
+        return self.makeNotificationMessage(notificationHTML)
+
+    # Everything notificationMenu.html reads that can differ between recipients
+    # of the same change. Notifications with equal keys render identically.
+    @property
+    def notificationMenuKey(self):
+        return (self.notificationReasonCode, self.followReason, self.sourceUser,
+                self.cleared, len(self.additionalUserKeys), 
+                self.additionalActions, self.timeText())
+
+    def makeNotificationMessage(self, notificationHTML):
         message = {
                     'type': 'notification',
                     'notificationHTML': notificationHTML,
@@ -115,14 +123,12 @@ class Notification(ndb.Model):
         return json.dumps(message)
 
     @classmethod
-    def getFirebaseHttp(cls):
-        """Provides an authed http object."""
-        http = httplib2.Http()
-        # Use application default credentials to make the Firebase calls
-        # https://firebase.google.com/docs/reference/rest/database/user-auth
-        creds = GoogleCredentials.get_application_default().create_scoped(FIREBASE_SCOPES)
-        creds.authorize(http)
-        return http
+    def getFirebaseClient(cls):
+        """Provides the instance-wide Firebase client."""
+        global _firebaseClient
+        if _firebaseClient is None:
+            _firebaseClient = FirebaseClient.fromApplicationDefault()
+        return _firebaseClient
 
     @classmethod
     def sendUserFirebaseNotification(cls, targetUser, message):
@@ -133,8 +139,7 @@ class Notification(ndb.Model):
                 return
 
             logging.info('Sending Firebase:  %s' % targetUser.token)
-            url = '{}/channels/{}.json'.format(FIREBASE_URL, targetUser.token)
-            cls.getFirebaseHttp().request(url, 'PATCH', body=message)
+            cls.getFirebaseClient().patchChannel(targetUser.token, message)
             logging.info('Firebase Sent:  %s' % targetUser.token)
         # Copied exception handling from below - how do we want to handle going forward?
         except Exception, e:
@@ -152,8 +157,7 @@ class Notification(ndb.Model):
 
         try:
             logging.info('Deleting Firebase Notifications:  %s' % targetUser.token)
-            url = '{}/channels/{}.json'.format(FIREBASE_URL, targetUser.token)
-            cls.getFirebaseHttp().request(url, 'DELETE')
+            cls.getFirebaseClient().deleteChannel(targetUser.token)
             logging.info('Deleted Firebase Notifications:  %s' % targetUser.token)
         # Copied exception handling from below - how do we want to handle going forward?
         except Exception, e:
@@ -161,60 +165,114 @@ class Notification(ndb.Model):
 
     @classmethod
     def createNotificationFromFollow(cls, handler, follow, pointKey, userKey, notificationReasonCode, additionalText=None):
-        try:
-            if notificationReasonCode == 3: # commented on does not "stack" with similar notifications
-                n = None
+        cls.createNotificationsFromFollows(handler, [follow], pointKey, userKey, 
+                                           notificationReasonCode, additionalText)
+
+    # Stacks this change onto n if it is a similar notification, 
+    # otherwise creates a new notification for the follower
+    @classmethod
+    def mergeOrCreateNotification(cls, n, follow, pointKey, userKey, notificationReasonCode, additionalText=None):
+        if n:                                
+            if userKey != n.sourceUser:
+                if not hasattr(n, 'additionalUserKeys') or n.additionalUserKeys is None:
+                    n.additionalUserKeys = [userKey]
+                elif userKey not in n.additionalUserKeys: 
+                    # A new user has triggered the notification
+                    n.additionalUserKeys =  n.additionalUserKeys + [userKey]
             else:
-                n = Notification.getSimilarNotification(
-                        follow.user, 
-                        pointKey,
-                        notificationReasonCode )
+                logging.info('NCFF ' + 'adding an action')                    
+                # additional actions by the initial user that caused the notification
+                n.additionalActions = n.additionalActions + 1 if n.additionalActions else 1
+            
+            n.raisedDate = datetime.datetime.now()
+            if n.additionalText and additionalText:
+                n.additionalText = n.additionalText + "; " + additionalText
 
-            if n:                                
-                if userKey != n.sourceUser:
-                    if not hasattr(n, 'additionalUserKeys') or n.additionalUserKeys is None:
-                        n.additionalUserKeys = [userKey]
-                    elif userKey not in n.additionalUserKeys: 
-                        # A new user has triggered the notification
-                        n.additionalUserKeys =  n.additionalUserKeys + [userKey]
-                else:
-                    logging.info('NCFF ' + 'adding an action')                    
-                    # additional actions by the initial user that caused the notification
-                    n.additionalActions = n.additionalActions + 1 if n.additionalActions else 1
-                
-                n.raisedDate = datetime.datetime.now()
-                if n.additionalText and additionalText:
-                    n.additionalText = n.additionalText + "; " + additionalText
+        else:
+            n = Notification(targetUser=follow.user, 
+                             pointRoot = pointKey,
+                             followReason = follow.reason,
+                             notificationReasonCode=notificationReasonCode,                         
+                             sourceUser=userKey,                          
+                             additionalText = additionalText                                 
+                            )
+        return n
 
-            else:
-                n = Notification(targetUser=follow.user, 
-                                 pointRoot = pointKey,
-                                 followReason = follow.reason,
-                                 notificationReasonCode=notificationReasonCode,                         
-                                 sourceUser=userKey,                          
-                                 additionalText = additionalText                                 
-                                )
-            n.put()
+    # Fans one change out to a page of followers:
+    #  parallel lookups for notifications to stack onto, one get_multi for the point root,
+    #  target users and source users, one get for the point, one put_multi,
+    #  one template render per distinct message and one PATCH per user token
+    @classmethod
+    def createNotificationsFromFollows(cls, handler, follows, pointKey, userKey, notificationReasonCode, additionalText=None):
+        if not follows:
+            return []
+        if notificationReasonCode == 3: # commented on does not "stack" with similar notifications
+            similarNotifications = [None] * len(follows)
+        else:
+            futures = [cls.getSimilarNotification_async(f.user, pointKey, notificationReasonCode)
+                       for f in follows]
+            similarNotifications = [f.get_result() for f in futures]
 
-            n.handler = handler
+        # A stacked notification keeps the user who first raised it as its source user
+        sourceUserKeys = list(set([userKey] + [n.sourceUser for n in similarNotifications
+                                               if n and n.sourceUser]))
+        entities = ndb.get_multi([pointKey] + [f.user for f in follows] + sourceUserKeys)
+        pointRoot, targetUsers = entities[0], entities[1:len(follows) + 1]
+        sourceUsers = dict(zip(sourceUserKeys, entities[len(follows) + 1:]))
+        point = pointRoot.getCurrent() if pointRoot else None
+        if point is None:
+            logging.error('Notification fan-out: no current point for %s' % str(pointKey))
+            return []
 
-            targetUser = follow.user.get()
-            # if targetUser.token and targetUser.tokenExpires > datetime.datetime.now():
-            #     # n.handler = handler
-            #     channel.send_message(targetUser.token, n.notificationMessage)
+        notifications = [
+            cls.mergeOrCreateNotification(n, f, pointKey, userKey, 
+                                          notificationReasonCode, additionalText)
+            for f, n in zip(follows, similarNotifications)]
+        ndb.put_multi(notifications)
 
-            cls.sendUserFirebaseNotification(targetUser, n.notificationMessage)
-        except Exception, e:
-            logging.exception(e)
+        renderedHTML = {}
+        firebaseMessages = []
+        for n, targetUser in zip(notifications, targetUsers):
+            try:
+                # Prefetched values for the cached properties read by the template
+                n.pointRootFull = pointRoot
+                n.referencePoint = point
+                n.sourceUserFull = sourceUsers.get(n.sourceUser)
+                menuKey = n.notificationMenuKey
+                if menuKey not in renderedHTML:
+                    renderedHTML[menuKey] = handler.template_render(
+                        'notificationMenu.html', { 'notification': n})
+                if not targetUser:
+                    logging.warning('Notification fan-out: missing target user %s' % str(n.targetUser))
+                elif not targetUser.token:
+                    logging.warning('No token for target user firebase notification: %s' % targetUser.name)
+                else:
+                    firebaseMessages.append(
+                        (targetUser.token, n.makeNotificationMessage(renderedHTML[menuKey])))
+            except Exception, e:
+                logging.exception(e)
+
+        if firebaseMessages:
+            try:
+                sent = cls.getFirebaseClient().patchChannels(firebaseMessages)
+                logging.info('Firebase Sent: %d messages to %d channels' % (len(firebaseMessages), sent))
+            except Exception, e:
+                logging.exception(e)
+        return notifications
 
     @classmethod
     def getLatestNotificationsForUser(cls, userKey):
+        return cls.getLatestNotificationsForUser_async(userKey).get_result()
+
+    @classmethod
+    @ndb.tasklet
+    def getLatestNotificationsForUser_async(cls, userKey):
         q = cls.query(cls.targetUser == userKey)
         q = q.order(-cls.raisedDate)     
-        notifications = q.fetch(11)      
+        notifications = yield q.fetch_async(11)      
         newCount = sum(1 for n in notifications if not n.cleared)        
         moreExist = len(notifications) == 11
-        return notifications[0:10], newCount, moreExist 
+        raise ndb.Return((notifications[0:10], newCount, moreExist))
         
     @classmethod
     def getUnreadNotificationsForUser(cls, userKey):
@@ -230,31 +288,63 @@ class Notification(ndb.Model):
         
     @classmethod
     def getUnreadNotificationsForUserAfterDate(cls, userKey, afterDate):
+        return cls.getUnreadNotificationsForUserAfterDate_async(userKey, afterDate).get_result()
+
+    @classmethod
+    @ndb.tasklet
+    def getUnreadNotificationsForUserAfterDate_async(cls, userKey, afterDate):
         q = cls.query(ndb.AND(
             cls.targetUser == userKey, 
             cls.cleared==False,
             cls.raisedDate > afterDate
         )) 
         q = q.order(-cls.raisedDate)     
-        notifications = q.fetch(11)      
+        notifications = yield q.fetch_async(11)      
         newCount = len(notifications)        
         moreExist = len(notifications) == 11
-        return notifications[0:10], newCount, moreExist 
+        raise ndb.Return((notifications[0:10], newCount, moreExist))
+
+    # Fills the point root, current point and source user of many notifications
+    #  with one get_multi for the roots and users and one for the current points
+    @classmethod
+    def prefetchReferences(cls, notifications):
+        cls.prefetchReferences_async(notifications).get_result()
+
+    @classmethod
+    @ndb.tasklet
+    def prefetchReferences_async(cls, notifications):
+        rootKeys = list(set(n.pointRoot for n in notifications if n.pointRoot))
+        userKeys = list(set(n.sourceUser for n in notifications if n.sourceUser))
+        entities = yield ndb.get_multi_async(rootKeys + userKeys)
+        entitiesByKey = dict(zip(rootKeys + userKeys, entities))
+        currentPoints = yield getCurrentPointsByRootKeys_async(rootKeys)
+        for n in notifications:
+            n.pointRootFull = entitiesByKey.get(n.pointRoot)
+            n.referencePoint = currentPoints.get(n.pointRoot)
+            n.sourceUserFull = entitiesByKey.get(n.sourceUser)
            
     @classmethod
     def getAllNotificationsForUser(cls, userKey):
+        return cls.getAllNotificationsForUser_async(userKey).get_result()
+
+    @classmethod
+    def getAllNotificationsForUser_async(cls, userKey):
         q = cls.query(cls.targetUser == userKey)
         q = q.order(-cls.raisedDate)     
-        notifications = q.fetch(100)           
-        return notifications
+        return q.fetch_async(100)
     
     @classmethod
     def getSimilarNotification(cls, userKey, pointRootKey, reasonCode):
+        return cls.getSimilarNotification_async(userKey, pointRootKey, reasonCode).get_result()
+
+    @classmethod
+    @ndb.tasklet
+    def getSimilarNotification_async(cls, userKey, pointRootKey, reasonCode):
         q = cls.query(cls.targetUser == userKey).filter(cls.pointRoot == pointRootKey)
         q = q.filter(cls.cleared==False)
         q = q.filter(cls.notificationReasonCode==int(reasonCode))
-        notification = q.fetch(1)
-        return notification[0] if notification else None
+        notification = yield q.fetch_async(1)
+        raise ndb.Return(notification[0] if notification else None)
         
     @classmethod
     def clearNotifications(cls, userKey, latestTimestamp, earliestTimestamp=None):
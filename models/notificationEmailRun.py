@@ -0,0 +1,79 @@
+import logging
+import datetime
+from google.appengine.ext import ndb
+
+# Progress of one run of the notification email job.
+# There is one run per day, keyed by date, so a repeated cron request does not start a second run.
+# Each shard records the cursor of its next page along with the counts of each page,
+#  so a retried page is counted once and queues the next page once.
+class NotificationEmailRun(ndb.Model):
+    started = ndb.DateTimeProperty(auto_now_add=True)
+    lastUpdated = ndb.DateTimeProperty(auto_now=True)
+    finished = ndb.DateTimeProperty()
+    status = ndb.StringProperty(default='running') # running, complete
+    shards = ndb.StringProperty(repeated=True)
+    shardsComplete = ndb.StringProperty(repeated=True)
+    shardCursors = ndb.StringProperty(repeated=True, indexed=False) # urlsafe, by shard; '' before the first page
+    pagesProcessed = ndb.IntegerProperty(default=0)
+    usersChecked = ndb.IntegerProperty(default=0)
+    emailsSent = ndb.IntegerProperty(default=0)
+    errors = ndb.IntegerProperty(default=0)
+
+    @property
+    def statusText(self):
+        return '%s %s: %d/%d shards complete, %d pages, %d users checked, %d emails sent, %d errors. Last update %s' % \
+            (self.key.id(), self.status, len(self.shardsComplete), len(self.shards),
+             self.pagesProcessed, self.usersChecked, self.emailsSent, self.errors,
+             str(self.lastUpdated))
+
+    @classmethod
+    def runIdForDate(cls, date):
+        return date.strftime('%Y-%m-%d')
+
+    @classmethod
+    @ndb.transactional
+    def start(cls, runId, shards):
+        """Returns the new run, or None if a run with this id was already started."""
+        if cls.get_by_id(runId):
+            return None
+        run = cls(id=runId, shards=shards, shardCursors=[''] * len(shards))
+        run.put()
+        return run
+
+    # Whether the page of shard at cursor (urlsafe, '' for the first) is already recorded
+    def pageDone(self, shard, cursor):
+        return shard in self.shardsComplete or \
+            self.shardCursors[self.shards.index(shard)] != cursor
+
+    # Records the page of shard at cursor and calls queueNextPage(nextCursor) in the
+    #  same transaction, unless the page was already recorded by an earlier try.
+    # nextCursor is None for the last page of the shard.
+    @classmethod
+    @ndb.transactional
+    def recordProgress(cls, runId, shard, cursor, nextCursor, usersChecked, emailsSent, errors,
+                       queueNextPage):
+        run = cls.get_by_id(runId)
+        if not run:
+            logging.error('Notification email run %s not found' % runId)
+            return None
+        if run.pageDone(shard, cursor):
+            logging.info('Notification email run %s already recorded this page of %s' % (runId, shard))
+            return None
+        run.pagesProcessed = run.pagesProcessed + 1
+        run.usersChecked = run.usersChecked + usersChecked
+        run.emailsSent = run.emailsSent + emailsSent
+        run.errors = run.errors + errors
+        if nextCursor:
+            run.shardCursors[run.shards.index(shard)] = nextCursor
+            queueNextPage(nextCursor)
+        else:
+            run.shardsComplete = run.shardsComplete + [shard]
+            if set(run.shardsComplete) >= set(run.shards):
+                run.status = 'complete'
+                run.finished = datetime.datetime.now()
+        run.put()
+        return run
+
+    @classmethod
+    def getLatestRuns(cls, count=10):
+        return cls.query().order(-cls.started).fetch(count)
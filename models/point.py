@@ -27,11 +27,14 @@ from __future__ import division
 import re
 import logging
 import math
+import hashlib
+from collections import OrderedDict
 
 from google.appengine.ext import ndb
-from google.appengine.ext.db import BadRequestError, TransactionFailedError
+from google.appengine.ext.db import TransactionFailedError
 from google.appengine.api import search
-from google.appengine.api.taskqueue import Task
+from google.appengine.api import memcache
+from google.appengine.api.taskqueue import Task, TaskAlreadyExistsError, TombstonedTaskError
 from google.appengine.ext import deferred
 
 from imageurl import ImageUrl
@@ -40,8 +43,16 @@ from redirecturl import RedirectURL
 from source import Source
 from timezones import PST
 from follow import Follow
-from uservote import RelevanceVote
+from uservote import UserVote, RelevanceVote
 from comment import Comment 
+from pointFeed import PointFeed
+from viewCounter import PointViewShard
+from userPoint import recordUserPoints
+from unitOfWork import unitOfWork, putLater, allocateKeys, getPendingOrGet
+from pointURL import PointURL
+from pointAdjacency import PointAdjacency
+from pointCard import PointCard
+import versionDelta
 
 
 def convertListToKeys(urlsafeList):
@@ -57,31 +68,57 @@ def convertListToKeys(urlsafeList):
 Every point must have a unique URL
 If it already exists, add a number, and store how many times this URL existed, 
   so number can be added next time
-Also check redirects
-(Redirects are created when a URL of a point changes)
+URLs are claimed in the PointURL registry, which also holds the former URLs of
+  renamed points, so a claim is a transactional get-or-create with no queries.
+Until the namespace is migrated, a URL with no entry is checked against the
+  points and redirects from before the registry.
 
 """
-def makeURL(sourceStr):
+def makeURL(sourceStr, pointRootKey=None):
+    return makeURL_async(sourceStr, pointRootKey).get_result()
+
+def urlForTitle(sourceStr):
     longURL = sourceStr.replace(" ", "_")
-    newUrl = re.sub('[\W]+', '', longURL[0:140])
-    # Check if it already exists
-    pointRootQuery = PointRoot.gql("WHERE url= :1", newUrl)
-    pointRoot = pointRootQuery.get()
-    
-    if pointRoot:
-        # Existing URL notes how many URLs+number exist for that URL
-        pointRoot.numCopies = pointRoot.numCopies + 1
-        newUrl = newUrl + str(pointRoot.numCopies)
-        pointRoot.put()
-    else:
-        redirectQuery = RedirectURL.gql("WHERE fromURL= :1", newUrl)
-        redirectURL = redirectQuery.get()
-        if redirectURL:
-            redirectURL.numCopies = redirectURL.numCopies + 1
-            newUrl = newUrl + str(redirectURL.numCopies)
-            redirectURL.put()        
-    return newUrl
+    return re.sub('[\W]+', '', longURL[0:140])
+
+@ndb.tasklet
+def makeURL_async(sourceStr, pointRootKey=None):
+    newUrl = urlForTitle(sourceStr)
+    entry, migrated = yield PointURL.lookup_async(newUrl)
+    legacyCopies = None
+    if entry is None and not migrated:
+        pointRoot = yield PointRoot.gql("WHERE url= :1", newUrl).get_async()
+        if pointRoot:
+            legacyCopies = pointRoot.numCopies or 0
+        else:
+            redirectURL = yield RedirectURL.gql("WHERE fromURL= :1", newUrl).get_async()
+            if redirectURL:
+                legacyCopies = redirectURL.numCopies or 0
+    url = yield PointURL.claim_async(newUrl, pointRootKey, legacyCopies)
+    raise ndb.Return(url)
+
+# Claims the URLs of titles that make the same URL one after another, since each
+#  claim is a transaction on that URL's entry. Returns the URLs in order.
+@ndb.tasklet
+def makeURLsInTurn_async(titlesAndRootKeys):
+    urls = []
+    for title, pointRootKey in titlesAndRootKeys:
+        url = yield makeURL_async(title, pointRootKey)
+        urls.append(url)
+    raise ndb.Return(urls)
   
+# Point URLs are resolved through memcache to (root key, current version key).
+# memcache is namespaced like the points, so each private area has its own entries.
+POINT_URL_CACHE_PREFIX = 'pointURL:'
+
+def pointURLCacheKey(url):
+    return POINT_URL_CACHE_PREFIX + url.encode('utf8')
+
+def uncachePointURLs(urls):
+    urls = [url for url in urls if url]
+    if urls:
+        memcache.delete_multi([pointURLCacheKey(url) for url in urls])
+
 @ndb.tasklet
 def getCurrent_async(pointRoot):
     if pointRoot:
@@ -89,6 +126,121 @@ def getCurrent_async(pointRoot):
         raise ndb.Return(current)
     else:
         raise ndb.Return(None)
+
+# Maps root keys to their current versions with one get_multi for the roots
+# and one for the current versions
+@ndb.tasklet
+def getCurrentPointsByRootKeys_async(rootKeys):
+    roots = yield ndb.get_multi_async(rootKeys)
+    currentKeys = [root.current for root in roots if root and root.current]
+    currents = (yield ndb.get_multi_async(currentKeys)) if currentKeys else []
+    raise ndb.Return(dict((p.key.parent(), p) for p in currents if p))
+
+# Reads outside of any enclosing transaction so that scoring a point does not
+# pull every linked point's entity group into an xg transaction
+@ndb.non_transactional
+def getCurrentPointsByRootKeys(rootKeys):
+    return getCurrentPointsByRootKeys_async(rootKeys).get_result()
+
+# List-level scoring stage: scores every point of a list that has no stored
+# score yet, resolving the linked points of the whole list together
+@ndb.tasklet
+def addPointValues_async(points):
+    unscored = [p for p in points if p and p.pointValueCached is None] if points else []
+    rootKeys = set()
+    for point in unscored:
+        rootKeys.update([link.root for link in point.supportingLinks + point.counterLinks
+                         if link.root])
+    if rootKeys:
+        childPoints = yield getCurrentPointsByRootKeys_async(list(rootKeys))
+    else:
+        childPoints = {}
+    for point in unscored:
+        point.pointValueCached = point.calculatePointValueFromChildren(childPoints)
+    raise ndb.Return(points)
+
+# The adjacency entries of rootKeys, by root key. Roots that have none yet are
+#  given one built in memory from their current versions.
+@ndb.tasklet
+def getAdjacencies_async(rootKeys):
+    adjacencies = yield PointAdjacency.getForRoots_async(rootKeys)
+    byRoot = dict((k, a) for k, a in zip(rootKeys, adjacencies) if a)
+    missingKeys = [k for k in rootKeys if k not in byRoot]
+    if missingKeys:
+        currentPoints = yield getCurrentPointsByRootKeys_async(missingKeys)
+        for rootKey, point in currentPoints.items():
+            adjacency = PointAdjacency(key=PointAdjacency.keyForRoot(rootKey))
+            adjacency.setLinks(point)
+            byRoot[rootKey] = adjacency
+    raise ndb.Return(byRoot)
+
+# The cards of the current versions of rootKeys, in order, for lists and menus.
+# The cards are read with their roots in one get_multi, and a card is used only if
+#  it is of the root's current version: a query on Point.current is eventually
+#  consistent, so the version it returns may already have been replaced.
+# Missing or stale cards are rebuilt from the current versions and written back
+#  by a task, so the read does not wait on a transaction per card.
+@ndb.tasklet
+def getPointCards_async(rootKeys):
+    entities = yield ndb.get_multi_async(
+        [PointCard.keyForRoot(k) for k in rootKeys] + list(rootKeys))
+    cards = entities[:len(rootKeys)]
+    currentKeys = [root.current if root else None for root in entities[len(rootKeys):]]
+    staleKeys = [currentKey for card, currentKey in zip(cards, currentKeys)
+                 if currentKey and not (card and card.isFreshFor(currentKey))]
+    rebuilt = {}
+    if staleKeys:
+        points = yield ndb.get_multi_async(staleKeys)
+        points = yield addPointValues_async([p for p in points if p and p.current])
+        sourceKeys = [key for p in points for key in p.sources]
+        sources = (yield ndb.get_multi_async(sourceKeys)) if sourceKeys else []
+        sourcesByKey = dict(zip(sourceKeys, sources))
+        for p in points:
+            rebuilt[p.key] = PointCard.fromPoint(
+                p, [sourcesByKey[key] for key in p.sources if sourcesByKey.get(key)])
+        try:
+            deferred.defer(putCardsIfCurrent, rebuilt.values())
+        except Exception, e:
+            # The cards are rebuilt again on the next read
+            logging.exception(e)
+    views = []
+    for card, currentKey in zip(cards, currentKeys):
+        card = rebuilt.get(currentKey) or (card if card and card.point == currentKey else None)
+        if currentKey and card:
+            views.append(card.view())
+    raise ndb.Return(views)
+
+# Writes rebuilt cards, each unless an edit has replaced its version since it was
+#  read, in which case the edit has written the newer card
+def putCardsIfCurrent(cards):
+    futures = [_putCardIfCurrent_async(card) for card in cards]
+    for future in futures:
+        future.get_result() # so a failed write retries the task
+
+@ndb.transactional_tasklet
+def _putCardIfCurrent_async(card):
+    root = yield card.key.parent().get_async()
+    if root and root.current == card.point:
+        yield card.put_async()
+
+# The side effects of an edit, run by one deferred task once the edit commits rather
+# than a task each. The notification goes last, so a retry does not repeat it.
+def pointEdited(userKey, newPointKey, notifyReasonCode, additionalText=None,
+                oldURL=None, newURL=None):
+    rootKey = newPointKey.parent()
+    if oldURL:
+        PointRoot.redirectRenamed(rootKey, oldURL, newURL)
+    recordUserPoints(userKey, [rootKey], 'edited') # Add to the user's edited list
+    Follow.createFollow(userKey, rootKey, "edited")
+    # THIS COULD CHECK WHETHER IT IS NECESSARY TO UPDATE THE INDEX
+    newPoint = newPointKey.get()
+    if newPoint:
+        newPoint.addToSearchIndexNew()
+    Point.addNotificationTask(rootKey, userKey, notifyReasonCode, additionalText)
+
+# The side effects of importing a tree, in one deferred task for all of its points
+def treeCreated(userKey, pointRootKeys):
+    Follow.createFollows(userKey, pointRootKeys, "created")
             
 class Link(ndb.Model):
     version = ndb.KeyProperty(indexed=False)
@@ -152,13 +304,28 @@ class Point(ndb.Model):
     isTop = ndb.BooleanProperty(default=True)
     isLowQualityAdmin = ndb.BooleanProperty(default=False)
     engagementScoreBase = ndb.IntegerProperty(default=0) # accrued engagement score - access via engagementScore prop
-    # pointValueCached = ndb.FloatProperty(indexed=False)  # cache of pointValue for indexing
+    pointValueCached = ndb.IntegerProperty(default=None)  # cache of pointValue, used in sorting
+    # For a version no longer current, the changes that turn the next version back
+    # into it; the fields in DELTA_FIELDS are then not stored (see expandVersions_async)
+    delta = ndb.PickleProperty(compressed=True)
+    _expanded = False
 
     ENGAGEMENT_PER_VOTE = 1
     ENGAGEMENT_PER_COMMENT = 2
     ENGAGEMENT_PER_LINK = 4
     ENGAGEMENT_PER_CONTRIBUTOR = 10
 
+    DELTA_FIELDS = ['content', 'summaryText', 'supportingLinks', 'counterLinks',
+                    'sources', 'usersContributed']
+    DELTA_TEXT_FIELDS = ['content', 'summaryText']
+    # Changed in place while a version is current (link ratings and order, contributors),
+    # so a delta against it always holds its own copy
+    DELTA_WHOLE_FIELDS = ['supportingLinks', 'counterLinks', 'usersContributed']
+    # Every version with a multiple of this as its number is kept whole, so any
+    # version is at most this many versions from one it can be rebuilt from
+    HISTORY_SNAPSHOT_INTERVAL = 10
+    VERSION_CACHE_PREFIX = 'pointVersion2:'
+
     @property
     def numSupporting(self):
         return len(self.supportingLinks) if self.supportingLinks else 0
@@ -177,10 +344,29 @@ class Point(ndb.Model):
         +1 for including a source
         + having agrees >= disagrees
         + having sub-arguments weighed in its favor
+
+        The value is stored in pointValueCached and refreshed by
+        updateCachedValues whenever votes, relevance, links or sources change,
+        so reading it does not touch the linked points.
         """
+        if self.pointValueCached is None:
+            self.pointValueCached = self.calculatePointValue()
+        return self.pointValueCached
+
+    def calculatePointValue(self, linkedPoints=None):
+        return self.calculatePointValueFromChildren(self.getChildPoints(linkedPoints))
+
+    # childPoints maps linked root keys to their current versions
+    def calculatePointValueFromChildren(self, childPoints):
         return (min(1, len(self.sources))
                 + self.upVotes - self.downVotes
-                + self.getChildrenPointRating())
+                + self.sumChildrenPointRating(childPoints))
+
+    # Recalculates the stored score. The caller is responsible for the put.
+    # linkedPoints are versions already in memory (e.g. created in this transaction)
+    def updateCachedValues(self, linkedPoints=None):
+        self.pointValueCached = self.calculatePointValue(linkedPoints)
+        return self.pointValueCached
 
     @property
     def engagementScore(self):
@@ -270,6 +456,119 @@ class Point(ndb.Model):
         else:
             return self._relevanceVote.value
         
+    # The version an edit was made from
+    @classmethod
+    def getVersion(cls, pointRootKey, version):
+        point = cls.query(cls.version == version, ancestor=pointRootKey).get()
+        if point:
+            cls.expandVersions_async([point]).get_result()
+        return point
+
+    # Stores this version, which has just been replaced by newer, as a delta against it.
+    # newer must be complete, so this is called once it has all its links and sources.
+    def encodeAsDelta(self, newer):
+        if self.current or self.delta is not None or \
+                self.version % Point.HISTORY_SNAPSHOT_INTERVAL == 0:
+            return
+        self.delta = versionDelta.encode(self, newer, Point.DELTA_FIELDS,
+                                         Point.DELTA_TEXT_FIELDS, Point.DELTA_WHOLE_FIELDS)
+        self.content = None
+        self.summaryText = None
+        self.supportingLinks = []
+        self.counterLinks = []
+        self.sources = []
+        self.usersContributed = []
+
+    def _setExpanded(self, values):
+        for name, value in values.items():
+            setattr(self, name, value)
+        self._expanded = True
+
+    @classmethod
+    def versionCacheKey(cls, pointKey):
+        return cls.VERSION_CACHE_PREFIX + pointKey.urlsafe()
+
+    @classmethod
+    @ndb.tasklet
+    def expandVersions_async(cls, points):
+        """
+        Fills in the fields of versions stored as deltas, in place, and returns points.
+
+        Versions never change once replaced, so rebuilt ones are kept in memcache.
+        The others are rebuilt from the nearest whole version above them, reading
+        the versions in between with one keys only query and get_multi per root.
+        Only the versions passed in are rebuilt, so history is rebuilt a page at
+        a time. A root with two versions of the same number, left by concurrent
+        edits before edits were transactional, is not rebuilt: the delta may have
+        been made against either of them.
+        """
+        deltas = [p for p in points if p and p.delta is not None and not p._expanded]
+        if not deltas:
+            raise ndb.Return(points)
+        ctx = ndb.get_context()
+        cached = yield [ctx.memcache_get(cls.versionCacheKey(p.key)) for p in deltas]
+        byRoot = {}
+        duplicated = set()
+        def addVersion(versions, point):
+            other = versions.setdefault(point.version, point)
+            if other.key != point.key:
+                duplicated.add(point.key.parent())
+        for point, values in zip(deltas, cached):
+            if values is not None:
+                point._setExpanded(values)
+            else:
+                addVersion(byRoot.setdefault(point.key.parent(), {}), point)
+        if not byRoot:
+            raise ndb.Return(points)
+
+        futures = []
+        for rootKey, wanted in byRoot.items():
+            minVersion, maxVersion = min(wanted), max(wanted)
+            futures.append(cls.query(cls.version > minVersion,
+                                     cls.version <= maxVersion + cls.HISTORY_SNAPSHOT_INTERVAL,
+                                     ancestor=rootKey).order(cls.version).fetch_async(keys_only=True))
+        keyLists = yield futures
+        chainKeys = [k for keys in keyLists for k in keys]
+        chain = (yield ndb.get_multi_async(chainKeys)) if chainKeys else []
+        chainByRoot = {}
+        for point in chain:
+            if point:
+                addVersion(chainByRoot.setdefault(point.key.parent(), {}), point)
+
+        toCache = {}
+        for rootKey, wanted in byRoot.items():
+            versions = chainByRoot.get(rootKey, {})
+            for point in wanted.values():
+                addVersion(versions, point)
+            # The passed in points, rather than the copies read by the query, are filled in
+            versions.update(wanted)
+            if rootKey in duplicated:
+                logging.error('Not rebuilding versions of %s, which has duplicate version numbers' % \
+                              str(rootKey))
+                continue
+            minVersion, maxVersion = min(wanted), max(wanted)
+            # The lowest version above the wanted ones that is stored whole
+            whole = min([v for v, p in versions.items() if v > maxVersion and
+                         (p.delta is None or p._expanded)] or [None])
+            if whole is None:
+                logging.error('No whole version to rebuild %s from' % str(rootKey))
+                continue
+            newer = versions[whole]
+            for version in range(whole - 1, minVersion - 1, -1):
+                point = versions.get(version)
+                if point is None:
+                    logging.error('Version %d of %s is missing' % (version, str(rootKey)))
+                    break
+                if point.delta is not None and not point._expanded:
+                    values = versionDelta.decode(point.delta, newer, cls.DELTA_FIELDS,
+                                                 cls.DELTA_TEXT_FIELDS)
+                    point._setExpanded(values)
+                    toCache[cls.versionCacheKey(point.key)] = values
+                newer = point
+        if toCache:
+            memcache.set_multi(toCache)
+        raise ndb.Return(points)
+
     @classmethod
     def getByKey(cls, pointKey):
         return ndb.Key('Point', pointKey).get()
@@ -279,25 +578,79 @@ class Point(ndb.Model):
     The /addNotification task will notify all the users that are following the point
     """
     @classmethod
-    def addNotificationTask(cls, pointRootKey, userKey, notifyReasonCode, additionalText=None):
+    def addNotificationTask(cls, pointRootKey, userKey, notifyReasonCode, additionalText=None,
+                            cursor=None, parentTaskName=None):
         taskParams = {'rootKey':pointRootKey.urlsafe(),
                          'userKey':userKey.urlsafe(),
                          'notifyReasonCode': notifyReasonCode }
         if additionalText:
             taskParams['additionalText'] = additionalText
+        taskName = None
+        if cursor:
+            # Continues the fan-out with the next page of followers.
+            # Named from the task queueing it, so a retry of that task does not start a second chain.
+            taskParams['cursor'] = cursor.urlsafe()
+            if parentTaskName:
+                taskName = 'notify-' + hashlib.sha1(parentTaskName + cursor.urlsafe()).hexdigest()
         t = Task(url='/addNotifications', 
-                 params=taskParams)
-        t.add(queue_name="notifications", transactional=ndb.in_transaction())
+                 params=taskParams,
+                 name=taskName)
+        try:
+            t.add(queue_name="notifications", transactional=ndb.in_transaction())
+        except (TaskAlreadyExistsError, TombstonedTaskError):
+            logging.info('Notification task %s was already queued' % taskName)
         
+    # A cached entry is only used if the root still has that version as current,
+    # so a missed invalidation costs a fallback to the queries, not a stale point
+    @staticmethod
+    @ndb.tasklet
+    def getCachedByUrl_async(url, followRedirects=True):
+        ctx = ndb.get_context()
+        cached = yield ctx.memcache_get(pointURLCacheKey(url))
+        if cached:
+            pointRoot, point = yield ndb.get_multi_async(list(cached))
+            if pointRoot and point and point.current and pointRoot.current == point.key \
+                    and (followRedirects or pointRoot.url == url):
+                raise ndb.Return(point, pointRoot)
+        raise ndb.Return(None, None)
+
+    @staticmethod
+    @ndb.tasklet
+    def cacheUrl_async(url, point, pointRoot):
+        if point and pointRoot:
+            yield ndb.get_context().memcache_set(
+                pointURLCacheKey(url), (pointRoot.key, point.key))
+
+    # Resolves url with key gets through the PointURL registry. Returns the root,
+    # which may have been renamed since, and whether a URL with no root in the
+    # registry might still be found by the queries used before the registry
+    @staticmethod
+    @ndb.tasklet
+    def getRegisteredRoot_async(url):
+        entry, migrated = yield PointURL.lookup_async(url)
+        if entry and entry.pointRoot:
+            pointRoot = yield entry.pointRoot.get_async()
+            raise ndb.Return(pointRoot, False)
+        raise ndb.Return(None, not migrated or entry is not None)
+
     @staticmethod
     def getCurrentByUrl(url):
-        pointRootQuery = PointRoot.gql("WHERE url= :1", url)
-        pointRoot = pointRootQuery.get()
+        point, pointRoot = Point.getCachedByUrl_async(url, followRedirects=False).get_result()
+        if point:
+            return point, pointRoot
+
+        pointRoot, checkLegacy = Point.getRegisteredRoot_async(url).get_result()
+        if pointRoot and pointRoot.url != url:
+            pointRoot = None # A former URL
+        elif checkLegacy:
+            pointRootQuery = PointRoot.gql("WHERE url= :1", url)
+            pointRoot = pointRootQuery.get()
         point = None        
         if pointRoot:
             point = pointRoot.getCurrent()
                         
         if point:
+            Point.cacheUrl_async(url, point, pointRoot).get_result()
             return point, pointRoot
         else:
             return (None, None)
@@ -306,24 +659,31 @@ class Point(ndb.Model):
     @staticmethod
     @ndb.tasklet
     def findCurrent_async(url):
-        q = PointRoot.query(PointRoot.url == url)
-        pointRoot = yield q.get_async()
+        point, pointRoot = yield Point.getCachedByUrl_async(url)
+        if point:
+            raise ndb.Return(point, pointRoot)
+
+        pointRoot, checkLegacy = yield Point.getRegisteredRoot_async(url)
+        if pointRoot is None and checkLegacy:
+            q = PointRoot.query(PointRoot.url == url)
+            pointRoot = yield q.get_async()
         if pointRoot:
             point = yield getCurrent_async(pointRoot)            
-            raise ndb.Return(point, pointRoot)            
-        else:
+        elif checkLegacy:
             # Try to find a redirector
             newRedirectURL = yield RedirectURL.getByFromURL_asynch(url)
             if newRedirectURL:
-                q = PointRoot.query(PointRoot.url == newRedirectURL.toURL)
-                pointRoot = yield q.get_async()
+                pointRoot, checkLegacyTarget = yield Point.getRegisteredRoot_async(newRedirectURL.toURL)
+                if pointRoot is None and checkLegacyTarget:
+                    q = PointRoot.query(PointRoot.url == newRedirectURL.toURL)
+                    pointRoot = yield q.get_async()
                 if pointRoot:
                     point = yield getCurrent_async(pointRoot)                
-                    raise ndb.Return(point, pointRoot)
-                else:
-                    raise ndb.Return(None, None)                            
-            else:
-                raise ndb.Return(None, None)                            
+        if point and pointRoot:
+            yield Point.cacheUrl_async(url, point, pointRoot)
+            raise ndb.Return(point, pointRoot)
+        else:
+            raise ndb.Return(None, None)                            
 
     @staticmethod
     def getCurrentByRootKey(rootKey):
@@ -336,34 +696,98 @@ class Point(ndb.Model):
         pointRoot = PointRoot.query(PointRoot.url == url).get()
         if pointRoot:
             # Just most recent 50 for now
-            points = Point.query(ancestor=pointRoot.key).order(
-                -Point.version).fetch(50)
-            # Image code left commented for when multiple images are added
-            # images = PointImage.query(ancestor=pointRoot.key).fetch(50)
-            retVal = []
-            for point in points:
-                supportingPointsLastVersion = point.getLinkedPointsLastChange("supporting")
-                counterPointsLastVersion = point.getLinkedPointsLastChange("counter")
-                sources = point.getSources()
-
-                # pointImages = [image for image in images if image.key.parent() == point.key]
-                # image = None
-                # if pointImages:
-                #   image = pointImages[0]
-                retVal.append({"point": point,
-                               "supportingPoints": supportingPointsLastVersion,
-                               "counterPoints": counterPointsLastVersion,
-                               "sources":sources })  # , "image":image})
-            return retVal
+            history, nextCursor, more = Point.getHistoryPage_async(
+                pointRoot.key, pageSize=50).get_result()
+            return history
         else:
             return None
-            
+
+    HISTORY_PAGE_SIZE = 20
+    HISTORY_MAX_PAGE_SIZE = 50
+    HISTORY_CACHE_PREFIX = 'pointHistory:'
+    HISTORY_CACHE_SECONDS = 60 * 60
+
+    # A page of the versions of a root, newest first, each with the versions it linked
+    #  to and its sources. Those are read for the whole page with one get_multi.
+    # Returns the page, the cursor for the next one, and whether there is one.
+    @staticmethod
+    @ndb.tasklet
+    def getHistoryPage_async(pointRootKey, cursor=None, pageSize=HISTORY_PAGE_SIZE):
+        points, nextCursor, more = yield Point.query(ancestor=pointRootKey).order(
+            -Point.version).fetch_page_async(pageSize, start_cursor=cursor)
+        yield Point.expandVersions_async(points)
+        keys = set()
+        for point in points:
+            keys.update([link.version for link in point.supportingLinks + point.counterLinks
+                         if link.version])
+            keys.update(point.sources)
+        keys = list(keys)
+        entities = (yield ndb.get_multi_async(keys)) if keys else []
+        yield Point.expandVersions_async([e for e in entities if isinstance(e, Point)])
+        byKey = dict((k, e) for k, e in zip(keys, entities) if e)
+        history = []
+        for point in points:
+            history.append({"point": point,
+                            "supportingPoints": [byKey[link.version] for link in point.supportingLinks
+                                                 if link.version in byKey],
+                            "counterPoints": [byKey[link.version] for link in point.counterLinks
+                                              if link.version in byKey],
+                            "sources": [byKey[k] for k in point.sources if k in byKey]})
+        raise ndb.Return((history, nextCursor, bool(more and nextCursor)))
+
+    # Only what a version does not change after it is replaced, so pages can be cached
+    @staticmethod
+    def historyEntryJSON(entry):
+        def linkJSON(p):
+            return {"title": p.title, "url": p.url, "version": p.version,
+                    "rootURLsafe": p.rootURLsafe}
+        point = entry["point"]
+        return {"version": point.version,
+                "current": bool(point.current),
+                "title": point.title,
+                "url": point.url,
+                "content": point.content,
+                "summaryText": point.summaryText,
+                "authorName": point.authorName,
+                "authorURL": point.authorURL,
+                "dateEdited": point.PSTdateEdited.isoformat() if point.dateEdited else None,
+                "imageURL": point.imageURL,
+                "imageDescription": point.imageDescription,
+                "imageAuthor": point.imageAuthor,
+                "sources": [{"url": s.url, "name": s.name} for s in entry["sources"]],
+                "supporting": [linkJSON(p) for p in entry["supportingPoints"]],
+                "counter": [linkJSON(p) for p in entry["counterPoints"]]
+                }
+
+    # The JSON of a page of history. Pages after the first hold only replaced
+    #  versions, so they are kept in memcache by cursor. Those versions still lose
+    #  their links to a deleted point, so the pages expire after an hour.
+    @staticmethod
+    @ndb.tasklet
+    def getHistoryPageJSON_async(pointRootKey, cursor=None, pageSize=HISTORY_PAGE_SIZE):
+        ctx = ndb.get_context()
+        cacheKey = None
+        if cursor:
+            cacheKey = '%s%s:%s:%d' % (Point.HISTORY_CACHE_PREFIX, pointRootKey.urlsafe(),
+                                       cursor.urlsafe(), pageSize)
+            cached = yield ctx.memcache_get(cacheKey)
+            if cached:
+                raise ndb.Return(cached)
+        history, nextCursor, more = yield Point.getHistoryPage_async(pointRootKey, cursor, pageSize)
+        page = {"versions": [Point.historyEntryJSON(entry) for entry in history],
+                "cursor": nextCursor.urlsafe() if more else None,
+                "more": more}
+        if cacheKey and not any(entry["point"].current for entry in history):
+            yield ctx.memcache_set(cacheKey, page, time=Point.HISTORY_CACHE_SECONDS)
+        raise ndb.Return(page)
+
     @staticmethod
     @ndb.transactional(xg=True)
     def transactionalCreate(pointRoot, title, content, summaryText, user,
                             imageURL=None, imageAuthor=None, 
                             imageDescription=None, sourceURLs=None, sourceNames=None, isTop=False):
         pointRoot.put()
+        PointURL.register(pointRoot.url, pointRoot.key)
         point = Point(parent=pointRoot.key)
         point.title = title
         point.url = pointRoot.url
@@ -394,12 +818,14 @@ class Point(ndb.Model):
                 source.put()
                 sourceKeys = sourceKeys + [source.key]
             point.sources = sourceKeys
+        point.updateCachedValues()
         point.put()
         point.addToSearchIndexNew()
 
         pointRoot.current = point.key
         pointRoot.isTop = isTop
         pointRoot.put()
+        pointRoot.updateDerived(point)
 
         # No automatic agreement
         # user.addVote(point, voteValue=1, updatePoint=False)
@@ -433,6 +859,7 @@ class Point(ndb.Model):
                             pointRoot, title, content, summaryText, user,
                             imageURL, imageAuthor, imageDescription, 
                             sourceURLs, sourceNames, isTop = isTop)
+        PointFeed.invalidate()
 
         # Only do this if we are not inside of a transaction
         if urlToUse is None:
@@ -440,85 +867,109 @@ class Point(ndb.Model):
 
         return createdPoint, createdPointRoot
 
+    TREE_WRITE_CHUNK = 100 # entities per put_multi
+    SEARCH_INDEX_BATCH = 200 # the most documents search.Index.put takes at once
+
     @staticmethod
     def createTree(dataForPointTree, user):
-        for p in dataForPointTree:
-            newUrl = makeURL(p['title'])
-            p['url'] = newUrl
-        newPoint, newPointRoot = Point.transactionalCreateTree(dataForPointTree, user)
-        if newPointRoot:
-            for p in dataForPointTree:
-                Follow.createFollow(user.key, p['pointRoot'].key, "created")
-        return newPoint, newPointRoot 
+        """
+        Creates the points of an outline, the first being the main point.
 
-    @staticmethod
-    @ndb.transactional(xg=True)
-    def transactionalCreateTree(dataForPointTree, user):
-        outlineRoot = OutlineRoot()
-        outlineRoot.put()
-        # ITERATE THE FIRST TIME AND CREATE ALL POINT ROOTS WITH BACKLINKS
+        Keys are allocated up front, so the points can be linked to each other
+        in memory and written with a few put_multi calls, rather than put one at
+        a time in a transaction that would need an entity group per point.
+        The roots are written last, so a failed import leaves no point reachable.
+        """
+        pointRoots = []
         for p in dataForPointTree:
-            pointRoot = PointRoot(parent=outlineRoot.key)
-            pointRoot.url = p['url']
+            pointRoot = PointRoot()
             pointRoot.numCopies = 0
             pointRoot.editorsPick = False
             pointRoot.viewCount = 1
-            if 'parentIndex' in p:
-                parentPointRoot = dataForPointTree[p['parentIndex']]['pointRoot']
-                pointRoot.pointsSupportedByMe = [parentPointRoot.key]
-            pointRoot.put()
+            pointRoot.isTop = 'parentIndex' not in p
+            pointRoots.append(pointRoot)
             p['pointRoot'] = pointRoot
-            point = Point(parent=pointRoot.key)
+        allocateKeys(pointRoots)
+
+        # The URLs are claimed in parallel, each in its own small transaction, except
+        #  that nodes with the same URL (several "Yes" answers) take turns on its entry
+        bySlug = OrderedDict()
+        for p in dataForPointTree:
+            bySlug.setdefault(urlForTitle(p['title']), []).append(p)
+        urlFutures = [(group, makeURLsInTurn_async([(p['title'], p['pointRoot'].key) for p in group]))
+                      for group in bySlug.values()]
+
+        for p in dataForPointTree:
+            point = Point(parent=p['pointRoot'].key)
             point.title = p['title']
-            point.url = pointRoot.url
             point.content = p['furtherInfo']
             point.current = True
+            point.isTop = p['pointRoot'].isTop
             point.authorName = user.name
             point.authorURL = user.url
             point.creatorName = user.name
             point.creatorURL = user.url
-            point.put()
-            user.addVote(point, voteValue=1, updatePoint=False)
-            user.recordCreatedPoint(pointRoot.key)
             p['point'] = point
-            p['pointRoot'].current = p['point'].key            
-            pointRoot.put()
-            point.addToSearchIndexNew()
-                    
-        # ITERATE THE SECOND TIME ADD SUPPORTING POINTS
+        allocateKeys([p['point'] for p in dataForPointTree])
+
+        sources = []
+        for p in dataForPointTree:
+            p['sourceEntities'] = [Source(parent=p['point'].key, url=s['sourceURL'],
+                                          name=s['sourceTitle']) for s in p['sources']]
+            sources = sources + p['sourceEntities']
+        allocateKeys(sources)
+
+        for group, urlFuture in urlFutures:
+            for p, url in zip(group, urlFuture.get_result()):
+                p['pointRoot'].url = p['point'].url = url
+        for p in dataForPointTree:
+            p['pointRoot'].current = p['point'].key
+            p['point'].sources = [source.key for source in p['sourceEntities']]
+
         for p in dataForPointTree:
             if 'parentIndex' in p:
-                linkP = dataForPointTree[p['parentIndex']]['point']
+                parent = dataForPointTree[p['parentIndex']]
+                p['pointRoot'].pointsSupportedByMe = [parent['pointRoot'].key]
+                linkP = parent['point']
                 newLink = Link( 
                     version = p['point'].key,
                     root = p['pointRoot'].key,
                     voteCount = 0
                 )
-                linkP.supportingLinks = linkP.supportingLinks + [newLink] if \
-                    linkP.supportingPointsRoots else [newLink]
-                    
-                # OLD STORAGE SYSTEM
-                linkP.supportingPointsRoots = linkP.supportingPointsRoots + [p['pointRoot'].key] \
-                    if linkP.supportingPointsRoots else [p['pointRoot'].key]
-                linkP.supportingPointsLastChange = linkP.supportingPointsLastChange + [p['point'].key] \
-                    if linkP.supportingPointsRoots else [p['point'].key]
+                linkP.supportingLinks = linkP.supportingLinks + [newLink]
 
-        # ITERATE THE THIRD TIME AND WRITE POINTS WITH ALL SUPPORTING POINTS AND SOURCE KEYS 
+        points = [p['point'] for p in dataForPointTree]
+        entities = list(sources)
         for p in dataForPointTree:
-            if p['sources']:
-                sourceKeys = []
-                for s in p['sources']:
-                    source = Source(parent=p['point'].key)
-                    source.url = s['sourceURL']
-                    source.name = s['sourceTitle']
-                    source.put()
-                    sourceKeys = sourceKeys + [source.key]
-                p['point'].sources = sourceKeys
-            p['point'].put()
-        
+            p['point'].updateCachedValues(points)
+            # The creator agrees with their points; upVotes already counts it
+            entities.append(UserVote(key=UserVote.makeKey(user.key, p['pointRoot'].key),
+                                     pointRootKey=p['pointRoot'].key, value=1, ribbon=False))
+            entities.append(PointAdjacency.build(p['pointRoot'], p['point']))
+            entities.append(PointCard.fromPoint(p['point'], p['sourceEntities']))
+        entities = entities + points
+
+        Point._putInChunks(entities)
+        Point._putInChunks(pointRoots)
+
+        index = search.Index(name='points')
+        for i in range(0, len(points), Point.SEARCH_INDEX_BATCH):
+            index.put([point.searchDocument()
+                       for point in points[i:i + Point.SEARCH_INDEX_BATCH]])
+
+        rootKeys = [pointRoot.key for pointRoot in pointRoots]
+        user.recordCreatedPoints(rootKeys)
+        PointFeed.invalidate()
+        deferred.defer(treeCreated, user.key, rootKeys)
         return dataForPointTree[0]['point'], dataForPointTree[0]['pointRoot']
 
-                        
+    # The chunks are written in parallel
+    @staticmethod
+    def _putInChunks(entities):
+        futures = [ndb.put_multi_async(entities[i:i + Point.TREE_WRITE_CHUNK])
+                   for i in range(0, len(entities), Point.TREE_WRITE_CHUNK)]
+        for future in futures:
+            future.get_result()
 
     def shortJSON(self):
         return {"title":self.title,
@@ -529,6 +980,97 @@ class Point(ndb.Model):
                 }
                 
 
+    TREE_DEFAULT_DEPTH = 3
+    TREE_MAX_DEPTH = 8
+    TREE_DEFAULT_NODES = 100
+    TREE_MAX_NODES = 250
+
+    def treeNodeJSON(self):
+        return {"title": self.title,
+                "url": self.url,
+                "rootURLsafe": self.rootURLsafe,
+                "summaryText": self.summaryText,
+                "imageURL": self.imageURL,
+                "voteTotal": self.voteTotal,
+                "upVotes": self.upVotes,
+                "downVotes": self.downVotes,
+                "numSupporting": self.numSupporting,
+                "numCounter": self.numCounter,
+                "supporting": [],
+                "counter": []
+                }
+
+    @ndb.tasklet
+    def getTree_async(self, user=None, maxDepth=TREE_DEFAULT_DEPTH, maxNodes=TREE_DEFAULT_NODES):
+        """
+        Returns the argument tree below this point as nested dicts, to maxDepth levels.
+
+        Breadth first over the adjacency index: one get_multi for the adjacency
+        entries of each level, which give its links, and one for the cards of the
+        points they reach, then one for the user's votes on the whole tree.
+        No point's content is read. A point reached a second time (a cycle, or a
+        point supporting two others) is given as a reference without children.
+        Past maxNodes points, and at the last level, a node with links it does
+        not show is marked truncated.
+        """
+        tree = self.treeNodeJSON()
+        nodes = {self.key.parent(): tree}
+        frontier = [self.key.parent()]
+        depth = 0
+        while frontier and depth < maxDepth:
+            # The links of the whole level, adding unseen points while the budget lasts
+            adjacencies = yield getAdjacencies_async(frontier)
+            edges = []
+            levelKeys = []
+            for rootKey in frontier:
+                adjacency = adjacencies.get(rootKey)
+                if not adjacency:
+                    continue
+                for edge in adjacency.links:
+                    if edge.root not in nodes and edge.root not in levelKeys:
+                        if len(nodes) + len(levelKeys) >= maxNodes:
+                            nodes[rootKey]["truncated"] = True
+                            continue
+                        levelKeys.append(edge.root)
+                    edges.append((rootKey, edge))
+            cards = yield getPointCards_async(levelKeys)
+            cardsByRoot = dict((card.key.parent(), card) for card in cards)
+
+            frontier = []
+            for parentKey, edge in edges:
+                if edge.root in nodes:
+                    child = nodes[edge.root]
+                    childNode = {"title": child["title"], "url": child["url"], "repeated": True}
+                else:
+                    card = cardsByRoot.get(edge.root)
+                    if not card:
+                        continue
+                    childNode = card.treeNodeJSON()
+                    childNode["score"] = card.pointValue()
+                    nodes[edge.root] = childNode
+                    frontier.append(edge.root)
+                childNode["linkType"] = edge.linkType
+                childNode["relevance"] = edge.rating
+                childNode["relevanceVoteCount"] = edge.voteCount
+                nodes[parentKey][edge.linkType].append(childNode)
+            depth = depth + 1
+
+        for rootKey in frontier:
+            node = nodes[rootKey]
+            if node["numSupporting"] + node["numCounter"] > 0:
+                node["truncated"] = True
+
+        if user:
+            votes, points = yield user.getVotes_async(nodes.keys()), addPointValues_async([self])
+        else:
+            votes = {}
+            points = yield addPointValues_async([self])
+        tree["score"] = self.pointValue()
+        for rootKey, node in nodes.items():
+            vote = votes.get(rootKey)
+            node["myVote"] = vote.value if vote else 0
+        raise ndb.Return(tree)
+
     def linkCount(self, linkType):
         linkCol = self.getStructuredLinkCollection(linkType)
         return len(linkCol) if linkCol else 0
@@ -550,6 +1092,25 @@ class Point(ndb.Model):
         else:
             raise WhysaurusException( "Unknown link type: \"%s\"" % linkType)
 
+    # The links as stored: for a version kept as a delta, those in the delta.
+    # Deltas made before the links were always kept in them have none, and take
+    #  their links from the next version.
+    def getStoredLinkCollection(self, linkType):
+        self.getStructuredLinkCollection(linkType) # checks the link type
+        if self.delta is not None:
+            return list(self.delta.get(linkType + 'Links', []))
+        return list(self.getStructuredLinkCollection(linkType))
+
+    def setStoredLinkCollection(self, linkType, linkCollection):
+        if self.delta is not None:
+            delta = dict(self.delta)
+            delta[linkType + 'Links'] = linkCollection
+            self.delta = delta
+            memcache.delete(Point.versionCacheKey(self.key))
+            if not self._expanded:
+                return
+        self.setStructuredLinkCollection(linkType, linkCollection)
+
     # RETURN ROOT LINK COLLECTION ONLY FOR SUPPLIED LINK TYPE          
     def getLinkedPointsRootKeys(self, linkType):
         linkColl = self.getStructuredLinkCollection(linkType)
@@ -566,20 +1127,20 @@ class Point(ndb.Model):
 
     def getLinkedPointsForLinks(self, linkColl):
         if len(linkColl) > 0:
-            rootKeys = [link.root for link in linkColl if link.root]
-            roots = ndb.get_multi(rootKeys)
+            # One get_multi for the roots and one for their current versions.
+            # Read in any enclosing transaction, which may have just created a linked point
+            currentPoints = getCurrentPointsByRootKeys_async(
+                [link.root for link in linkColl if link.root]).get_result()
             linkedPoints = []            
                             
-            for pointRoot in roots:
-                if pointRoot:
-                    linkedPoints = linkedPoints + [pointRoot.getCurrent()]
+            for link in linkColl:
+                point = currentPoints.get(link.root)
+                if point:
+                    point._linkInfo = link
+                    linkedPoints = linkedPoints + [point]
                 else: # THIS SHOULD NEVER HAPPEN, BUT IT DID ONCE OR TWICE
                     logging.info('WARNING: Supporting point array for ' +
                                  self.url + ' contains pointer to missing root')
-
-            # logging.info('ZPL' + str(zip(points, linkColl)))            
-            for point, link in zip(linkedPoints, linkColl):
-                point._linkInfo = link
                             
             return linkedPoints
         else:
@@ -595,7 +1156,8 @@ class Point(ndb.Model):
                          (yield ndb.get_multi_async(rootKeys)))                        
             
             if user:
-                linkedPoints = yield map(lambda x: x.addVote_async(user),linkedPoints) 
+                linkedPoints = yield user.addVotesToPoints_async(linkedPoints)
+            linkedPoints = yield addPointValues_async(linkedPoints)
                                 
             i = 0
             # this let met skip over link entries that do not have a root or do not match for some reason
@@ -670,7 +1232,7 @@ class Point(ndb.Model):
                             (linkType, self.title))
                             
             linkCurrentVersion.isTop = False
-            linkCurrentVersion.put()
+            putLater(linkCurrentVersion)
             
             logging.info('Linking the new point. Have: %d, %d' % (voteCount, fRating))
             newLink = Link(
@@ -691,12 +1253,13 @@ class Point(ndb.Model):
             if root_user:
                 logging.info('Adding contributing user: %s -> %s' % (root_user, self.url))
                 self.addContributingUser(root_user)
-                self.put()
+                putLater(self)
 
-    def getChildPointRating(self, sp):
-        return max(0, sp.upVotes - sp.downVotes + 1) * (sp._linkInfo.rating / 100.0)
+    def getChildPointRating(self, sp, link=None):
+        link = link if link else sp._linkInfo
+        return max(0, sp.upVotes - sp.downVotes + 1) * (link.rating / 100.0)
 
-    def getChildrenPointRating(self):
+    def getChildrenPointRating(self, linkedPoints=None):
         """
         Looks one level down to get supporting and counter votes
         as influence.
@@ -715,14 +1278,29 @@ class Point(ndb.Model):
         make sure you exclude cycles (a sub point linking to the same point
         higher up) to avoid infinite loop calculations
         """
-        supportingPoints = self.getLinkedPoints('supporting', None) or []
-        counterPoints = self.getLinkedPoints('counter', None) or []
-        return int(round((sum([self.getChildPointRating(sp)
-                               for sp in supportingPoints
-                               if sp.upVotes >= sp.downVotes])
-                          - (sum([self.getChildPointRating(cp)
-                                  for cp in counterPoints
-                                  if cp.upVotes >= cp.downVotes])))))
+        return self.sumChildrenPointRating(self.getChildPoints(linkedPoints))
+
+    # Current versions of the linked points, keyed by root key.
+    # linkedPoints are versions already in memory, which are not fetched again
+    def getChildPoints(self, linkedPoints=None):
+        childPoints = dict((p.key.parent(), p) for p in linkedPoints) if linkedPoints else {}
+        rootKeysToGet = [link.root for link in self.supportingLinks + self.counterLinks
+                         if link.root and link.root not in childPoints]
+        if rootKeysToGet:
+            childPoints.update(getCurrentPointsByRootKeys(rootKeysToGet))
+        return childPoints
+
+    # childPoints maps linked root keys to their current versions
+    def sumChildrenPointRating(self, childPoints):
+        def linksRating(links):
+            rating = 0
+            for link in links:
+                sp = childPoints.get(link.root)
+                if sp and sp.upVotes >= sp.downVotes:
+                    rating = rating + self.getChildPointRating(sp, link)
+            return rating
+        return int(round(linksRating(self.supportingLinks)
+                         - linksRating(self.counterLinks)))
 
     def sortLinks(self, linkType=None, linksSeed=None):
         """
@@ -757,7 +1335,9 @@ class Point(ndb.Model):
             pointsAndRoots = pointRoot.getBacklinkPointRootPairs(linkType)
             for point,root in pointsAndRoots:
                 point.sortLinks(linkType)
+                point.updateCachedValues()
                 point.put()
+                point.updateCard()
                 if recurseUp:
                     # only go up one level, because further *sorting* is unaffected
                     # WARNING: if we DO recurse up, then must watch out for cycles!!
@@ -775,9 +1355,74 @@ class Point(ndb.Model):
             raise WhysaurusException(
                     "Trying to remove a %s point but root was not supplied: %s" % linkName, self.title)
 
+    # The fields an edit can change, compared against the base version when merging
+    EDIT_FIELDS = ['title', 'content', 'summaryText', 'imageURL', 'imageDescription', 'imageAuthor']
+
+    def rebaseEdit(self, editedPoint, current):
+        """
+        Returns a new version that applies the changes editedPoint made to this version
+        on top of current, the version that is current now.
+
+        Nothing is written and neither argument is changed, so a retried transaction
+        can call this again. If current was not made from this version, a field changed
+        both by the edit and since this version must have changed to the same value;
+        otherwise the edit really conflicts and a WhysaurusException is raised.
+        """
+        conflicts = []
+        newPoint = Point(key=editedPoint.key)
+        for field in Point.EDIT_FIELDS:
+            baseValue = getattr(self, field)
+            editedValue = getattr(editedPoint, field)
+            currentValue = getattr(current, field)
+            if editedValue != baseValue and currentValue != baseValue and \
+                    editedValue != currentValue:
+                conflicts.append(field)
+            setattr(newPoint, field, editedValue if editedValue != baseValue else currentValue)
+        if conflicts:
+            raise WhysaurusException(
+                "Someone else changed the %s of this point while you were editing it. Please reload the point and try again." % \
+                ', '.join(conflicts))
+        newPoint.url = editedPoint.url if editedPoint.title != self.title else current.url
+
+        # Links, contributors and votes added since the base version are kept
+        removedSources = set(self.sources) - set(editedPoint.sources)
+        newPoint.sources = [k for k in current.sources if k not in removedSources]
+        newPoint.supportingLinks = list(current.supportingLinks)
+        newPoint.counterLinks = list(current.counterLinks)
+        newPoint.usersContributed = list(current.usersContributed)
+        newPoint.creatorName = current.creatorName
+        newPoint.creatorURL = current.creatorURL
+        newPoint.upVotes = current.upVotes # number of agrees
+        newPoint.downVotes = current.downVotes # number of disagrees
+        newPoint.voteTotal = current.voteTotal
+        newPoint.ribbonTotal = current.ribbonTotal
+        newPoint.engagementScoreBase = current.engagementScoreBase
+
+        newPoint.authorName = editedPoint.authorName
+        newPoint.authorURL = editedPoint.authorURL
+        newPoint.version = current.version + 1
+        newPoint.current = True
+        return newPoint
+
+    # self is the version the edit was made from and editedPoint the edit, neither of
+    # which is changed here. The root is re-read inside the transaction; if another
+    # edit has committed since, the two are merged by rebaseEdit. A collision at
+    # commit makes ndb run this again, which merges against the newer current version.
     @ndb.transactional(xg=True)
-    def transactionalUpdate(self, newPoint, theRoot, sources, user, pointsToLink):        
-        self.put() # Save the old version
+    @unitOfWork
+    def transactionalUpdate(self, editedPoint, theRoot, sources, user, pointsToLink):        
+        theRoot = theRoot.key.get()
+        current = theRoot.getCurrent()
+        if current.key != self.key:
+            logging.info('Merging an edit of version %d of %s into version %d' % \
+                         (self.version, self.url, current.version))
+        newPoint = self.rebaseEdit(editedPoint, current)
+        oldURL = None
+        if editedPoint.title != self.title:
+            oldURL = theRoot.url
+            theRoot.url = editedPoint.url
+        current.current = False
+        putLater(current) # Save the old version
         if pointsToLink:
             for pointToLink in pointsToLink:
                 if 'voteCount' in pointToLink:
@@ -796,27 +1441,29 @@ class Point(ndb.Model):
         if sources:
             sourceKeys = newPoint.sources
             for source in sources:
-                source.put()
+                putLater(source)
                 sourceKeys = sourceKeys + [source.key]
             newPoint.sources = sourceKeys
-            
-        # CONCURRENCY FIX
-        # IN CASE A NEW CURRENT POINT HAS BEEN CREATED
-        # LET'S TRY WITHOUT THIS
-        """possiblyUpdatedRoot = theRoot.key.get()
-        possiblyNewCurrent = possiblyUpdatedRoot.getCurrent()
-        if (possiblyNewCurrent.key != self.key):
-            logging.warning('Collision on the DB was detected.  Attempting to recover.')
-            newPoint.version = possiblyNewCurrent.version + 1
-            possiblyNewCurrent.current = False
-            possiblyNewCurrent.put()"""
-
-        newPoint.put()
+
+        newPoint.updateCachedValues(
+            [p['pointCurrentVersion'] for p in pointsToLink] if pointsToLink else None)
+        current.encodeAsDelta(newPoint)
+        putLater(newPoint)
         theRoot.current = newPoint.key
-        theRoot.put()
+        putLater(theRoot)
         theRoot.setTop()
-                
-        deferred.defer(user.recordEditedPoint, theRoot.key, _transactional=ndb.in_transaction()) # Add to the user's edited list  
+        theRoot.updateDerived(newPoint)
+        uncachePointURLs([self.url, current.url, newPoint.url])
+
+        if pointsToLink:
+            # For now we only ever add a single linked point
+            notifyReasonCode = 4 if pointsToLink[0]['linkType'] == "supporting" else 5
+            additionalText = pointsToLink[0]['pointCurrentVersion'].title
+        else:
+            notifyReasonCode = 0 # "edited" notification
+            additionalText = None
+        deferred.defer(pointEdited, user.key, newPoint.key, notifyReasonCode, additionalText,
+                       oldURL, theRoot.url if oldURL else None, _transactional=True)
         return newPoint, theRoot
 
     # pointsToLink is a set of links of the new point we want to link
@@ -844,7 +1491,7 @@ class Point(ndb.Model):
             newPoint.supportingLinks = list(self.supportingLinks)
             newPoint.counterLinks = list(self.counterLinks)
                     
-            newPoint.sources = self.sources
+            newPoint.sources = list(self.sources)
             keysToRemove = convertListToKeys(sourceKeysToRemove)
             if keysToRemove:
                 for keyToRemove in keysToRemove:
@@ -861,34 +1508,27 @@ class Point(ndb.Model):
             newPoint.imageDescription = self.imageDescription if imageDescription is None else imageDescription
             newPoint.imageAuthor = self.imageAuthor if imageAuthor is None else imageAuthor
             if newPoint.title != self.title:
-                newPoint.url = theRoot.updateURL(newPoint.title)
+                # Only claimed here; the redirects are written once the edit commits
+                newPoint.url = makeURL(newPoint.title, theRoot.key)
             else:
                 newPoint.url = self.url
             newPoint.current = True
 
-            self.current = False
-
-            newPoint, theRoot = self.transactionalUpdate(newPoint, theRoot, sourcesToAdd, user, pointsToLink)    
-
-            # Not sure why this is needed: this should be getting handled by code already in addLink
+            # With keys allocated before the transaction, everything it touches
+            # is written in one put_multi when its unit of work ends
+            allocateKeys([newPoint] + (sourcesToAdd or []))
+            claimedURL = newPoint.url if newPoint.url != self.url else None
             try:
-                deferred.defer(Follow.createFollow, user.key, theRoot.key, "edited", _transactional=ndb.in_transaction())
-            # If we are in transaction this is not allowed, but will be handled elsewhere
-            except BadRequestError:
-                pass
-
-            if pointsToLink:
-                # For now we only ever add a single linked point
-                Point.addNotificationTask(
-                    theRoot.key, 
-                    user.key, 
-                    4 if pointsToLink[0]['linkType'] == "supporting" else 5,
-                    pointsToLink[0]['pointCurrentVersion'].title )
-            else:
-                Point.addNotificationTask(theRoot.key, user.key, 0) # "edited" notification
-
-            # THIS COULD CHECK WHETHER IT IS NECESSARY TO UPDATE THE INDEX
-            deferred.defer(newPoint.addToSearchIndexNew, _transactional=ndb.in_transaction() )
+                try:
+                    newPoint, theRoot = self.transactionalUpdate(newPoint, theRoot, sourcesToAdd, user, pointsToLink)    
+                except TransactionFailedError as e:
+                    raise WhysaurusException("Could not save your edit because this point is being edited by several people at the same time.  Please try again.")
+            except WhysaurusException:
+                # The edit was rejected, so the URL it claimed is freed for others
+                if claimedURL:
+                    PointURL.release(claimedURL, theRoot.key)
+                raise
+            PointFeed.invalidate()
 
             return newPoint
         else:
@@ -896,6 +1536,7 @@ class Point(ndb.Model):
 
     @classmethod
     @ndb.transactional(xg=True, retries=5)
+    @unitOfWork
     def transactionalAddSupportingPoint(cls, oldPointRoot, title, content, summaryText, user,
                             linkType, imageURL,imageAuthor,imageDescription,
                             sourcesURLs, sourcesNames, urlToUse):                             
@@ -941,6 +1582,7 @@ class Point(ndb.Model):
         except TransactionFailedError as e:
             # DO NOT edit this error message carelessly, it is checked in (for example) point.js
             raise WhysaurusException("Could not add supporting point because someone else was editing this point at the same time.  Please try again.")
+        PointFeed.invalidate()
         Follow.createFollow(user.key, newLinkPointRoot.key, "created")
         Follow.createFollow(user.key, oldPointRoot.key, "edited")        
         return newPoint, newLinkPoint
@@ -984,10 +1626,15 @@ class Point(ndb.Model):
             newPoint.usersContributed = list(self.usersContributed)
             self.current = False
             newPoint.current = True
+            newPoint.updateCachedValues()
+            self.encodeAsDelta(newPoint)
             self.put()
             newPoint.put()
             theRoot.current = newPoint.key
             theRoot.put()
+            theRoot.updateDerived(newPoint)
+            uncachePointURLs([theRoot.url])
+            PointFeed.invalidate()
             
             Follow.createFollow(user.key, theRoot.key, "edited")
             
@@ -1011,7 +1658,7 @@ class Point(ndb.Model):
 
         if userUrlContributed not in self.usersContributed:
             self.usersContributed = self.usersContributed + [userUrlContributed]
-            self.put()
+            putLater(self)
             logging.info('addContributingUser: %s -> %s' % (userUrlContributed, self.url))
 
 
@@ -1019,6 +1666,7 @@ class Point(ndb.Model):
         # TODO: Gene: Use transactional update to include versioning
         self.isLowQualityAdmin = lowQuality
         self.put()
+        PointFeed.invalidate()
         return True
 
     def getSources(self):
@@ -1036,6 +1684,7 @@ class Point(ndb.Model):
         else:
             raise ndb.Return(None)
 
+    @unitOfWork
     def unlink(self, unlinkPointURL, linkType, user):
         unlinkPoint, unlinkPointRoot = Point.getCurrentByUrl(
             unlinkPointURL)
@@ -1077,23 +1726,32 @@ class Point(ndb.Model):
                         pass 
                 searchKeys = [ndb.Key(urlsafe=rootKey) for rootKey in docIds]
                 logging.info("Search Keys %s" % str(searchKeys))          
-                resultPoints = yield map(lambda x: getCurrent_async(x), (yield ndb.get_multi_async(searchKeys)))
+                resultPoints = yield getPointCards_async(searchKeys)
                 if user:
-                    resultPoints = yield map(lambda x: x.addVote_async(user), resultPoints)                    
+                    resultPoints = yield user.addVotesToPoints_async(resultPoints)
             else:
                 resultPoints = None                
             raise ndb.Return(resultPoints)
         else:
             raise ndb.Return(None)
         
-    def addToSearchIndexNew(self):
-        index = search.Index(name='points')
+    # Rewrites the card of this version, which must be the current one.
+    # sources are given when they are already in memory.
+    def updateCard(self, sources=None):
+        if sources is None:
+            sources = [s for s in ndb.get_multi(self.sources) if s] if self.sources else []
+        putLater(PointCard.fromPoint(self, sources))
+
+    def searchDocument(self):
         fields = [
             search.TextField(name='title', value=self.title),
             search.TextField(name='content', value=self.content),         
         ]
-        d = search.Document(doc_id=self.key.parent().urlsafe(), fields=fields)
-        index.put(d)
+        return search.Document(doc_id=self.key.parent().urlsafe(), fields=fields)
+
+    def addToSearchIndexNew(self):
+        index = search.Index(name='points')
+        index.put(self.searchDocument())
         
     # If old rel vote exists, replace its value, otherwise add a new value
     # into the value total
@@ -1109,7 +1767,11 @@ class Point(ndb.Model):
             if ourLink:
                 ourLink.updateRelevanceData(oldRelVote, newRelVote) 
                 self.sortLinks(newRelVote.linkType, links)
+                self.updateCachedValues()
                 self.put()
+                pointRoot = self.key.parent().get()
+                if pointRoot and self.current:
+                    pointRoot.updateDerived(self)
                 retVal = True, ourLink.rating, ourLink.voteCount
         return retVal        
         
@@ -1177,7 +1839,7 @@ class PointRoot(ndb.Model):
     def getCurrent(self):
         # if self.current:
         #     logging.info("RETURNING CURRENT point: %s" % self.current.urlsafe())
-        return self.current.get()
+        return getPendingOrGet(self.current)
         # else:
         #     logging.info("CURRENT UNAVAILABLE in %s" % self.url)
         # return Point.query(Point.current == True, ancestor=self.key).get()    
@@ -1192,19 +1854,30 @@ class PointRoot(ndb.Model):
         
     
     def getBacklinkPointRootPairs(self, linkType):
+        return self.getBacklinkPointRootPairs_async(linkType).get_result()
+
+    @ndb.tasklet
+    def getBacklinkPointRootPairs_async(self, linkType):
         backlinkRootKeys, backlinksArchiveKeys = self.getBacklinkCollections(linkType)
-        backlinkRoots = ndb.get_multi(backlinkRootKeys)
-        currentKeys = []
+        backlinkRoots = yield ndb.get_multi_async(backlinkRootKeys)
+        roots = []
         for root in backlinkRoots:
             if root:
-                currentKeys = currentKeys + [root.current]
+                roots = roots + [root]
             else:
                 logging.error("Bad link detected in Root: %s. " % self.url)                    
-        currentPoints = ndb.get_multi(currentKeys)
-        return zip(currentPoints, backlinkRoots)
+        currentPoints = yield ndb.get_multi_async([root.current for root in roots])
+        raise ndb.Return(zip(currentPoints, roots))
     
     def getBacklinkPoints(self, linkType):
-        return [a[0] for a in self.getBacklinkPointRootPairs(linkType)]
+        return self.getBacklinkPoints_async(linkType).get_result()
+
+    # The cards of the points linking to this one, which is all the menus show
+    @ndb.tasklet
+    def getBacklinkPoints_async(self, linkType):
+        backlinkRootKeys, backlinksArchiveKeys = self.getBacklinkCollections(linkType)
+        cards = yield getPointCards_async(backlinkRootKeys)
+        raise ndb.Return(cards)
 
     # This is used to fix database problems
     def cleanEmptyLinks(self):
@@ -1213,14 +1886,16 @@ class PointRoot(ndb.Model):
         for point in allVersions:
             cleaned = False
             for linkType in ["supporting", "counter"]:
-                links = point.getStructuredLinkCollection(linkType)
+                links = point.getStoredLinkCollection(linkType)
                 cleanLinks = [l for l in links if l.version is not None and l.root is not None]
                 numCleaned = numCleaned + len(links) - len(cleanLinks)
                 if len(links) != len(cleanLinks):
                     cleaned = True                
-                    point.setStructuredLinkCollection(linkType, cleanLinks)
+                    point.setStoredLinkCollection(linkType, cleanLinks)
             if cleaned: 
                 point.put()                
+                if point.current:
+                    self.updateDerived(point)
         return numCleaned, len(allVersions)        
         
     # This is used to fix database problems
@@ -1249,22 +1924,17 @@ class PointRoot(ndb.Model):
         else:
             raise WhysaurusException( "Unknown link type: \"%s\"" % linkType)  
         self.setTop()
+        self.updateDerived()
 
     def setTop(self):
-        if len(self.pointsSupportedByMe) + len(self.pointsCounteredByMe) == 0:
-            self.isTop = True
-            self.put()
-            current = self.getCurrent()
-            if current:
-                current.isTop = True
-                current.put()
-        else:
-            self.isTop = False
-            self.put()
-            current = self.getCurrent()
-            if current:
-                current.isTop = False
-                current.put()         
+        isTop = len(self.pointsSupportedByMe) + len(self.pointsCounteredByMe) == 0
+        self.isTop = isTop
+        putLater(self)
+        current = self.getCurrent()
+        if current:
+            current.isTop = isTop
+            putLater(current)
+        PointFeed.invalidate()
 
     def getComments(self):
         return ndb.get_multi(self.comments)
@@ -1283,7 +1953,7 @@ class PointRoot(ndb.Model):
             if archive and linkPointRootKey not in self.supportedArchiveForDelete:
                 self.supportedArchiveForDelete = self.supportedArchiveForDelete + \
                 [linkPointRootKey]
-            self.put()
+            putLater(self)
             
         elif linkType == 'counter':
             try:
@@ -1294,10 +1964,11 @@ class PointRoot(ndb.Model):
             if archive and linkPointRootKey not in self.supportedArchiveForDelete:
                 self.counteredArchiveForDelete = self.counteredArchiveForDelete + \
                 [linkPointRootKey]
-            self.put()
+            putLater(self)
         else:
             raise WhysaurusException( "Unknown link type: \"%s\"" % linkType)
         self.setTop()
+        self.updateDerived()
 
 
     def addLinkedPoint(self, linkPointRootKey, linkType):
@@ -1306,26 +1977,87 @@ class PointRoot(ndb.Model):
                 self.pointsSupportedByMe = self.pointsSupportedByMe + \
                 [linkPointRootKey]      
                 self.isTop = False                          
-                self.put()
+                putLater(self)
+                self.updateDerived()
         elif linkType == 'counter':
             if linkPointRootKey not in self.pointsCounteredByMe:
                 self.pointsCounteredByMe = self.pointsCounteredByMe + \
                 [linkPointRootKey]
                 self.isTop = False                
-                self.put()
+                putLater(self)
+                self.updateDerived()
         else:
             raise WhysaurusException( "Unknown link type: \"%s\"" % linkType)
 
+    # Rewrites what is kept from the current version (the adjacency index entry
+    # of this root and its card), from current if given
+    def updateDerived(self, current=None):
+        current = current if current else self.getCurrent()
+        if current:
+            putLater(PointAdjacency.build(self, current))
+            current.updateCard()
+
+    # Views are counted in PointViewShards and added to viewCount by the
+    # FlushViewCounts job, so viewing a point does not write the root
     def addViewCount(self):
-        if not self.viewCount:
-            self.viewCount = 1
-        self.viewCount = self.viewCount + 1
-        future = self.put_async()
-        return future
+        return PointViewShard.addView_async(self.key)
 
     def getAllVersions(self):
         return Point.query(ancestor=self.key).fetch()
 
+    # Stores the replaced versions written before versions were kept as deltas as
+    # deltas; for the EncodeVersionHistory job. Returns how many were encoded.
+    def encodeHistory(self):
+        versions = Point.query(ancestor=self.key).order(Point.version).fetch()
+        # Which of two versions of the same number a delta was made against could not be told
+        if len(set(p.version for p in versions)) != len(versions):
+            logging.warning('Not encoding the history of %s, which has duplicate version numbers' % \
+                            self.url)
+            return 0
+        Point.expandVersions_async(versions).get_result()
+        encoded = []
+        # In version order, so each is encoded against a next version that is whole
+        for older, newer in zip(versions, versions[1:]):
+            if older.delta is None and newer.version == older.version + 1:
+                older.encodeAsDelta(newer)
+                if older.delta is not None:
+                    encoded.append(older)
+        if encoded:
+            ndb.put_multi(encoded)
+        return len(encoded)
+
+    # The cards of the first 50 results of a query on Points or on PointRoots.
+    # Only the keys are fetched, so the query returns none of the points' content.
+    @staticmethod
+    @ndb.tasklet
+    def getListCards_async(query, user):
+        keys = yield query.fetch_async(50, keys_only=True)
+        if query.kind == 'Point':
+            keys = [k.parent() for k in keys]
+        cards = yield getPointCards_async(keys)
+        if user:
+            cards = yield user.addVotesToPoints_async(cards)
+        raise ndb.Return(cards)
+
+    # Serves a list from its materialized feed (see PointFeed)
+    @staticmethod
+    @ndb.tasklet
+    def getListPoints_async(listType, user):
+        liveQueries = {
+            'recentCurrent': PointRoot.getRecentCurrentPoints_async,
+            'recentActivityAll': PointRoot.getRecentActivityAll_async,
+            'topViewed': PointRoot.getTopViewedPoints_async,
+            'topRated': PointRoot.getTopRatedPoints_async,
+            'editorsPics': PointRoot.getEditorsPicks_async,
+            'lowEngagement': PointRoot.getLowEngagementPoints_async,
+            'lowQuality': PointRoot.getLowQualityPoints_async,
+            'highestScore': PointRoot.getHighestScorePoints_async,
+        }
+        if listType not in liveQueries:
+            raise WhysaurusException("Unknown list type: \"%s\"" % listType)
+        points = yield PointFeed.getCards_async(listType, liveQueries[listType], user)
+        raise ndb.Return(points)
+
     @staticmethod
     def getEditorsPicks(user):
         editorsPicks = []
@@ -1339,67 +2071,43 @@ class PointRoot(ndb.Model):
     @ndb.tasklet
     def getEditorsPicks_async(user):
         rootsQuery = PointRoot.gql("WHERE editorsPick = TRUE ORDER BY editorsPickSort ASC")
-        resultPoints = yield map(lambda x: x.current.get_async(), (yield rootsQuery.fetch_async(50)))
-        if user:
-            resultPoints = yield map(
-                lambda x: x.addVote_async(user), 
-                resultPoints
-            )
+        resultPoints = yield PointRoot.getListCards_async(rootsQuery, user)
         raise ndb.Return(resultPoints)
 
     @staticmethod
     @ndb.tasklet
     def getLowEngagementPoints_async(user):
         pointsQuery = Point.gql("WHERE current = TRUE AND isLowQualityAdmin = FALSE AND isTop = TRUE AND engagementScoreBase < 15 ORDER BY engagementScoreBase ASC")
-        resultPoints = None
-        if user:
-            resultPoints = yield map(lambda x: x.addVote_async(user), (yield pointsQuery.fetch_async(50)))
-        else:
-            resultPoints = yield pointsQuery.fetch_async(50)
+        resultPoints = yield PointRoot.getListCards_async(pointsQuery, user)
         raise ndb.Return(resultPoints)
 
     @staticmethod
     @ndb.tasklet
     def getLowQualityPoints_async(user):
         pointsQuery = Point.gql("WHERE current = TRUE AND isLowQualityAdmin = TRUE ORDER BY dateEdited DESC")
-        resultPoints = None
-        if user:
-            resultPoints = yield map(lambda x: x.addVote_async(user), (yield pointsQuery.fetch_async(50)))
-        else:
-            resultPoints = yield pointsQuery.fetch_async(50)
+        resultPoints = yield PointRoot.getListCards_async(pointsQuery, user)
         raise ndb.Return(resultPoints)
 
     @staticmethod
     @ndb.tasklet
     def getRecentActivityAll_async(user):
         pointsQuery = Point.gql("WHERE current = TRUE ORDER BY dateEdited DESC")
-        resultPoints = None
-        if user:
-            resultPoints = yield map(lambda x: x.addVote_async(user), (yield pointsQuery.fetch_async(50)))
-        else:
-            resultPoints = yield pointsQuery.fetch_async(50)
+        resultPoints = yield PointRoot.getListCards_async(pointsQuery, user)
         raise ndb.Return(resultPoints)
 
     @staticmethod
     @ndb.tasklet
     def getRecentCurrentPoints_async(user):
         pointsQuery = Point.gql("WHERE current = TRUE AND isTop = TRUE AND isLowQualityAdmin = FALSE ORDER BY dateEdited DESC")
-        resultPoints = None
-        if user:
-            resultPoints = yield map(lambda x: x.addVote_async(user), (yield pointsQuery.fetch_async(50)))
-        else:
-            resultPoints = yield pointsQuery.fetch_async(50)
+        resultPoints = yield PointRoot.getListCards_async(pointsQuery, user)
         raise ndb.Return(resultPoints)
                 
     @staticmethod
     def getRecentCurrentPoints(user):
         pointsQuery = Point.gql("WHERE current = TRUE AND isTop = TRUE AND isLowQualityAdmin = FALSE ORDER BY dateEdited DESC")
-        resultPoints = None
+        resultPoints = pointsQuery.fetch(50)
         if user:
-            resultPoints =  map(lambda x: x.addVote(user), (pointsQuery.fetch(50)))
-            logging.info('RP ' + str(resultPoints))
-        else:
-            resultPoints =  pointsQuery.fetch(50)
+            resultPoints = user.addVotesToPoints_async(resultPoints).get_result()
         return resultPoints
         
     @staticmethod
@@ -1417,23 +2125,14 @@ class PointRoot(ndb.Model):
     @ndb.tasklet        
     def getTopRatedPoints_async(user):
         pointsQuery = Point.gql("WHERE current = TRUE ORDER BY voteTotal DESC")
-        resultPoints = None
-        if user:
-            resultPoints = yield map(lambda x: x.addVote_async(user), (yield pointsQuery.fetch_async(50)))
-        else:
-            resultPoints = yield pointsQuery.fetch_async(50)            
+        resultPoints = yield PointRoot.getListCards_async(pointsQuery, user)
         raise ndb.Return(resultPoints)
 
     @staticmethod
     @ndb.tasklet
     def getHighestScorePoints_async(user):
-        # TODO: Gene: How do we want to query by score?
-        pointsQuery = Point.gql("WHERE current = TRUE ORDER BY voteTotal DESC")
-        resultPoints = None
-        if user:
-            resultPoints = yield map(lambda x: x.addVote_async(user), (yield pointsQuery.fetch_async(50)))
-        else:
-            resultPoints = yield pointsQuery.fetch_async(50)
+        pointsQuery = Point.gql("WHERE current = TRUE ORDER BY pointValueCached DESC")
+        resultPoints = yield PointRoot.getListCards_async(pointsQuery, user)
         raise ndb.Return(resultPoints)
     
     
@@ -1449,12 +2148,7 @@ class PointRoot(ndb.Model):
     def getTopViewedPoints_async(user):
         rootsQuery = PointRoot.gql("ORDER BY viewCount DESC") 
             
-        resultPoints = yield map(lambda x: x.current.get_async(), (yield rootsQuery.fetch_async(50)))
-        if user:
-            resultPoints = yield map(
-                lambda x: x.addVote_async(user), 
-                resultPoints
-            )
+        resultPoints = yield PointRoot.getListCards_async(rootsQuery, user)
         raise ndb.Return(resultPoints)
 
     # NOT USED CURRENTLY
@@ -1481,15 +2175,16 @@ class PointRoot(ndb.Model):
                         continue
                     v = linkedPointRoot.getAllVersions()
                     for linkedPointVersion in v:
-                        links = linkedPointVersion.getStructuredLinkCollection(linkType)
-                        writeVersion = False
-                        for link in links:
-                            if link.root == self.key:
-                                links.remove(link)
-                                linkedPointVersion.setStructuredLinkCollection(linkType, links)                                
-                            writeVersion = True
-                            
-                        if writeVersion: linkedPointVersion.put()
+                        # Including the links kept in the deltas of replaced versions
+                        links = linkedPointVersion.getStoredLinkCollection(linkType)
+                        keptLinks = [link for link in links if link.root != self.key]
+                        if len(keptLinks) != len(links):
+                            linkedPointVersion.setStoredLinkCollection(linkType, keptLinks)
+                            if linkedPointVersion.current:
+                                linkedPointVersion.updateCachedValues()
+                            linkedPointVersion.put()
+                            if linkedPointVersion.current:
+                                linkedPointRoot.updateDerived(linkedPointVersion)
 
 
         points = self.getAllVersions()
@@ -1508,7 +2203,10 @@ class PointRoot(ndb.Model):
         # TODO: Find the user that created and edited this, and delete REFS
 
         self.deleteFromSearchIndex()
+        ndb.delete_multi([PointAdjacency.keyForRoot(self.key), PointCard.keyForRoot(self.key)])
         self.key.delete()
+        uncachePointURLs([self.url])
+        PointFeed.invalidate()
 
         return True, ''
 
@@ -1517,20 +2215,19 @@ class PointRoot(ndb.Model):
         doc_index = search.Index(name="points")
         doc_index.delete(self.key.urlsafe())
 
-    def updateURL(self, newTitle):
-        newURL = makeURL(newTitle)
-        oldURL = self.url
-        self.url = newURL
-        # self.put()
-
-        redirectURL = RedirectURL()
-        redirectURL.fromURL = oldURL
-        redirectURL.toURL = newURL
-        redirectURL.put()
-        # If there is already a redirector object going to this URL, update it
+    # Run by pointEdited once the edit that renamed the root has committed
+    @staticmethod
+    def redirectRenamed(pointRootKey, oldURL, newURL):
+        pointRoot = pointRootKey.get()
+        # The old URL stays registered to this root, so it resolves here
+        PointURL.register(oldURL, pointRootKey, (pointRoot.numCopies or 0) if pointRoot else 0)
+
+        RedirectURL.create(oldURL, newURL)
+        # If there are already redirector objects going to this URL, update them all
         RedirectURL.updateRedirects(oldURL, newURL)
-        return newURL
+        uncachePointURLs([oldURL, newURL])
     
+    @unitOfWork
     def addComment(self, comment):        
         if self.comments:
             if comment.parentComment:
@@ -1543,7 +2240,7 @@ class PointRoot(ndb.Model):
                 self.comments = [comment.key] + self.comments
         else:
             self.comments = [comment.key]
-        self.put()
+        putLater(self)
 
         cur = self.current.get()
         if cur:
@@ -1552,7 +2249,7 @@ class PointRoot(ndb.Model):
                 cur.addContributingUser(root_user)
 
             cur.engagementScoreBase += Point.ENGAGEMENT_PER_COMMENT
-            cur.put()
+            putLater(cur)
         
     # shift this comment and all its childern into the archived array
     # return the number of comments archived
@@ -1595,8 +2292,10 @@ class PointRoot(ndb.Model):
         self.editorsPick = editorsPick
         self.editorsPickSort = editorsPickSort
         self.put()
+        PointFeed.invalidate()
         return True
 
+    @unitOfWork
     def populateCreatorUrl(self):
         pointCurrent = self.getCurrent()
         if pointCurrent is None:
@@ -1623,12 +2322,13 @@ class PointRoot(ndb.Model):
                 authors.append(thisAuthor)
                 pointCurrent.addContributingUser(point.authorURL)
 
-        pointCurrent.put()
+        putLater(pointCurrent)
         return True
 
 # A dummy class to create an entity group
 # For large groups this will cause issues with sharding them across datastore nodes
 # Eventually a BG task should be written to copy these out of the OutlineRoot
+# Trees are no longer created under one; their roots are top level like any other
 class OutlineRoot(ndb.Model):
     pass
 
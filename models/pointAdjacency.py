@@ -0,0 +1,53 @@
+from google.appengine.ext import ndb
+
+LINK_TYPES = ["supporting", "counter"]
+
+class Edge(ndb.Model):
+    root = ndb.KeyProperty(indexed=False)
+    linkType = ndb.StringProperty(indexed=False) # supporting, counter
+    rating = ndb.IntegerProperty(indexed=False)
+    voteCount = ndb.IntegerProperty(indexed=False)
+
+# The links of a point root in a few hundred bytes: the roots its current version
+#  links to, with link type and rating, and the roots that link to it.
+# A child of the root, so it is written in the root's entity group along with the
+#  versions it is built from. Traversals and checks read these instead of whole
+#  Points with their content. Roots written before this existed have none until the
+#  BuildPointAdjacency job runs, so readers fall back to the points.
+class PointAdjacency(ndb.Model):
+    links = ndb.LocalStructuredProperty(Edge, repeated=True)
+    backlinks = ndb.LocalStructuredProperty(Edge, repeated=True)
+    version = ndb.IntegerProperty(indexed=False) # of the current version the links are from
+
+    @staticmethod
+    def keyForRoot(pointRootKey):
+        return ndb.Key('PointAdjacency', 1, parent=pointRootKey)
+
+    @classmethod
+    def build(cls, pointRoot, point):
+        adjacency = cls(key=cls.keyForRoot(pointRoot.key))
+        adjacency.setLinks(point)
+        adjacency.setBacklinks(pointRoot)
+        return adjacency
+
+    @classmethod
+    def getForRoots_async(cls, pointRootKeys):
+        return ndb.get_multi_async([cls.keyForRoot(k) for k in pointRootKeys])
+
+    def setLinks(self, point):
+        self.links = [Edge(root=link.root, linkType=linkType,
+                           rating=link.rating, voteCount=link.voteCount)
+                      for linkType in LINK_TYPES
+                      for link in point.getStructuredLinkCollection(linkType) if link.root]
+        self.version = point.version
+
+    def setBacklinks(self, pointRoot):
+        self.backlinks = [Edge(root=rootKey, linkType=linkType)
+                          for linkType in LINK_TYPES
+                          for rootKey in pointRoot.getBacklinkCollections(linkType)[0]]
+
+    def getLinkRootKeys(self, linkType=None):
+        return [e.root for e in self.links if linkType is None or e.linkType == linkType]
+
+    def getBacklinkRootKeys(self, linkType=None):
+        return [e.root for e in self.backlinks if linkType is None or e.linkType == linkType]
@@ -0,0 +1,153 @@
+import datetime
+
+from google.appengine.ext import ndb
+
+from imageurl import ImageUrl
+
+# Cards are rewritten along with the current version, its votes and its score.
+# Readers check a card's version against its root's current version, so a card
+#  is never shown for a replaced version. Older ones are rebuilt from their point
+#  on the next read, in case of a write that changed the point without rewriting its card.
+CARD_MAX_AGE = datetime.timedelta(days=1)
+
+class PointCard(ndb.Model):
+    """The display fields of a point, copied from its current version.
+    A child of the root, written in the same transaction as the root's current
+    version changes, so reading the card is enough to show a point in a list
+    or menu. A few hundred bytes however long the point's content or however
+    many links it has."""
+    point = ndb.KeyProperty(indexed=False) # the version the card was copied from
+    url = ndb.StringProperty(indexed=False)
+    title = ndb.StringProperty(indexed=False)
+    summaryText = ndb.TextProperty(indexed=False)
+    imageURL = ndb.StringProperty(default='', indexed=False)
+    creatorName = ndb.StringProperty(indexed=False)
+    creatorURL = ndb.StringProperty(indexed=False)
+    authorName = ndb.StringProperty(indexed=False)
+    authorURL = ndb.StringProperty(indexed=False)
+    numUsersContributed = ndb.IntegerProperty(indexed=False)
+    voteTotal = ndb.IntegerProperty(indexed=False)
+    upVotes = ndb.IntegerProperty(default=0, indexed=False)
+    downVotes = ndb.IntegerProperty(default=0, indexed=False)
+    pointValueCached = ndb.IntegerProperty(indexed=False)
+    numSupporting = ndb.IntegerProperty(indexed=False)
+    numCounter = ndb.IntegerProperty(indexed=False)
+    linksRatio = ndb.IntegerProperty(indexed=False)
+    # The sources as parallel lists rather than structures, to keep the card one flat entity
+    sourceKeys = ndb.KeyProperty(repeated=True, indexed=False)
+    sourceURLs = ndb.StringProperty(repeated=True, indexed=False)
+    sourceNames = ndb.StringProperty(repeated=True, indexed=False)
+    refreshed = ndb.DateTimeProperty(indexed=False)
+
+    @staticmethod
+    def keyForRoot(pointRootKey):
+        return ndb.Key('PointCard', 1, parent=pointRootKey)
+
+    @classmethod
+    def fromPoint(cls, point, sources):
+        return cls(key=cls.keyForRoot(point.key.parent()),
+                   point=point.key,
+                   url=point.url,
+                   title=point.title,
+                   summaryText=point.summaryText,
+                   imageURL=point.imageURL or '',
+                   creatorName=point.creatorName,
+                   creatorURL=point.creatorURL,
+                   authorName=point.authorName,
+                   authorURL=point.authorURL,
+                   numUsersContributed=point.numUsersContributed,
+                   voteTotal=point.voteTotal,
+                   upVotes=point.upVotes,
+                   downVotes=point.downVotes,
+                   pointValueCached=point.pointValue(),
+                   numSupporting=point.numSupporting,
+                   numCounter=point.numCounter,
+                   linksRatio=int(point.linksRatio),
+                   sourceKeys=[s.key for s in sources],
+                   sourceURLs=[s.url or '' for s in sources],
+                   sourceNames=[s.name or '' for s in sources],
+                   refreshed=datetime.datetime.now())
+
+    def isFresh(self):
+        return self.refreshed is not None and \
+            datetime.datetime.now() - self.refreshed < CARD_MAX_AGE
+
+    def isFreshFor(self, pointKey):
+        return self.point == pointKey and self.isFresh()
+
+    def view(self):
+        return CardView(self)
+
+
+class CardSource(object):
+    __slots__ = ('key', 'url', 'name')
+
+    def __init__(self, key, url, name):
+        self.key = key
+        self.url = url
+        self.name = name
+
+
+class CardView(object):
+    """A PointCard as templates render it: a plain slotted object, so lists build one
+    small object per point rather than a model with a property for every field.
+    key is the key of the point version, so user votes can be added the same
+    way as for points. card is the PointCard it shows."""
+    __slots__ = ('card', 'key', 'url', 'title', 'summaryText', 'imageURL', 'creatorName',
+                 'creatorURL', 'authorName', 'authorURL', 'numUsersContributed', 'voteTotal',
+                 'upVotes', 'downVotes', 'pointValueCached', 'numSupporting', 'numCounter', 'linksRatio',
+                 'sources', 'belowRelevanceThreshold', '_vote')
+    summaryBigImage = ImageUrl('SummaryBig')
+
+    def __init__(self, card):
+        self.card = card
+        self.key = card.point
+        self.url = card.url
+        self.title = card.title
+        self.summaryText = card.summaryText
+        self.imageURL = card.imageURL or ''
+        self.creatorName = card.creatorName
+        self.creatorURL = card.creatorURL
+        self.authorName = card.authorName
+        self.authorURL = card.authorURL
+        self.numUsersContributed = card.numUsersContributed
+        self.voteTotal = card.voteTotal
+        self.upVotes = card.upVotes or 0
+        self.downVotes = card.downVotes or 0
+        self.pointValueCached = card.pointValueCached
+        self.numSupporting = card.numSupporting
+        self.numCounter = card.numCounter
+        self.linksRatio = card.linksRatio
+        self.sources = [CardSource(key, url, name) for key, url, name in
+                        zip(card.sourceKeys, card.sourceURLs, card.sourceNames)]
+        self.belowRelevanceThreshold = False
+        self._vote = None
+
+    def numSupportingPlusCounter(self):
+        return self.numSupporting + self.numCounter
+
+    def pointValue(self):
+        return self.pointValueCached
+
+    # As Point.treeNodeJSON
+    def treeNodeJSON(self):
+        return {"title": self.title,
+                "url": self.url,
+                "rootURLsafe": self.key.parent().urlsafe(),
+                "summaryText": self.summaryText,
+                "imageURL": self.imageURL,
+                "voteTotal": self.voteTotal,
+                "upVotes": self.upVotes,
+                "downVotes": self.downVotes,
+                "numSupporting": self.numSupporting,
+                "numCounter": self.numCounter,
+                "supporting": [],
+                "counter": []
+                }
+
+    def getSources(self):
+        return self.sources if self.sources else None
+
+    @property
+    def vote(self):
+        return 0 if self._vote is None else self._vote
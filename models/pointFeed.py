@@ -0,0 +1,88 @@
+import time
+import logging
+import datetime
+
+from google.appengine.ext import ndb
+from google.appengine.api import memcache
+
+from pointCard import PointCard
+
+# Feeds older than this are rebuilt from the live query on the next read
+FEED_MAX_AGE = datetime.timedelta(minutes=5)
+# The list queries are eventually consistent, so a feed rebuilt this soon after an
+#  invalidate may miss the write; it is only kept until this long after the invalidate
+FEED_SETTLE_SECONDS = 30
+# Set on writes that change which points are in the lists, or their order, to the
+#  time of the write in milliseconds, so a counter recreated after eviction never
+#  repeats the generation of an old feed.
+# memcache is namespaced like the feeds, so each private area has its own generation.
+FEED_GENERATION_KEY = 'pointFeedGeneration'
+
+def _nowMillis():
+    return int(time.time() * 1000)
+
+class PointFeed(ndb.Model):
+    """A materialized home page list: the cards of one list type, in order.
+    Keyed by list type and stored in the namespace of the area it lists.
+    The cards are copies of the points' PointCards, and render the same way."""
+    cards = ndb.LocalStructuredProperty(PointCard, repeated=True, keep_keys=True)
+    generation = ndb.IntegerProperty(indexed=False)
+    refreshed = ndb.DateTimeProperty(indexed=False)
+    expires = ndb.DateTimeProperty(indexed=False)
+
+    @property
+    def rootKeys(self):
+        return [card.key.parent() for card in self.cards]
+
+    @staticmethod
+    def currentGeneration():
+        generation = memcache.get(FEED_GENERATION_KEY)
+        if generation is None:
+            # Treated as a fresh invalidate, as writes may have been missed
+            memcache.add(FEED_GENERATION_KEY, _nowMillis())
+            generation = memcache.get(FEED_GENERATION_KEY)
+        return generation
+
+    @staticmethod
+    def invalidate():
+        memcache.set(FEED_GENERATION_KEY, _nowMillis())
+
+    def isFresh(self, generation):
+        return generation is not None and self.generation == generation and \
+            self.expires and datetime.datetime.now() < self.expires
+
+    # generation must be read before the live query, so an invalidate during the
+    #  rebuild leaves the new feed stale
+    @classmethod
+    @ndb.tasklet
+    def refresh_async(cls, listType, views, generation):
+        cards = [view.card for view in views if view]
+        now = datetime.datetime.now()
+        lifetime = FEED_MAX_AGE
+        if generation is not None:
+            unsettled = generation / 1000.0 + FEED_SETTLE_SECONDS - time.time()
+            if unsettled > 0:
+                lifetime = min(lifetime, datetime.timedelta(seconds=unsettled))
+        feed = cls(id=listType, cards=cards, generation=generation,
+                   refreshed=now, expires=now + lifetime)
+        yield feed.put_async()
+        raise ndb.Return(feed)
+
+    # Serves a list from its feed with one get, falling back to liveQuery_async
+    #  (a tasklet returning card views) and rebuilding the feed from its result
+    @classmethod
+    @ndb.tasklet
+    def getCards_async(cls, listType, liveQuery_async, user):
+        generation = cls.currentGeneration()
+        feed = yield cls.get_by_id_async(listType)
+        if feed and feed.isFresh(generation):
+            cards = [card.view() for card in feed.cards]
+        else:
+            cards = yield liveQuery_async(None)
+            try:
+                yield cls.refresh_async(listType, cards, generation)
+            except Exception, e:
+                logging.exception(e)
+        if user:
+            cards = yield user.addVotesToPoints_async(cards)
+        raise ndb.Return(cards)
@@ -0,0 +1,116 @@
+from google.appengine.ext import ndb
+
+from whysaurusexception import WhysaurusException
+
+# The registry of point URLs, keyed by the URL itself, so that claiming a URL is a
+#  transactional get-or-create and resolving one is a key get, without queries.
+# An entry stays with its root when the point is renamed, so the root's former URLs
+#  resolve to it too. numCopies counts the numbered copies made of the URL.
+# Entries are in the namespace of their points.
+class PointURL(ndb.Model):
+    pointRoot = ndb.KeyProperty(indexed=False) # None until the point is created
+    numCopies = ndb.IntegerProperty(default=0, indexed=False)
+
+    MAX_COPY_ATTEMPTS = 10
+    # Written in a namespace once all of its points and redirects have entries.
+    # Not a possible URL, since makeURL keeps only word characters.
+    MIGRATED_ID = ':migrated'
+
+    @classmethod
+    def keyForUrl(cls, url):
+        return ndb.Key(cls, url)
+
+    @classmethod
+    def isMigrated(cls):
+        return ndb.Key(cls, cls.MIGRATED_ID).get() is not None
+
+    @classmethod
+    def setMigrated(cls):
+        cls(key=ndb.Key(cls, cls.MIGRATED_ID)).put()
+
+    # Returns the entry for url and whether the namespace is migrated, in one get_multi
+    @classmethod
+    @ndb.tasklet
+    def lookup_async(cls, url):
+        entry, marker = yield ndb.get_multi_async(
+            [cls.keyForUrl(url), ndb.Key(cls, cls.MIGRATED_ID)])
+        raise ndb.Return((entry, marker is not None))
+
+    @classmethod
+    @ndb.transactional_tasklet(xg=True)
+    def claim_async(cls, url, pointRootKey=None, legacyCopies=None):
+        """
+        Returns url if it is free, or else url with the next free copy number,
+        having registered it. legacyCopies is given for a URL that was
+        taken before it had an entry here, and is its number of copies.
+        """
+        entry = yield cls.keyForUrl(url).get_async()
+        if entry is None:
+            if legacyCopies is None:
+                yield cls(key=cls.keyForUrl(url), pointRoot=pointRootKey).put_async()
+                raise ndb.Return(url)
+            entry = cls(key=cls.keyForUrl(url), numCopies=legacyCopies)
+        for i in range(cls.MAX_COPY_ATTEMPTS):
+            entry.numCopies = entry.numCopies + 1
+            copyKey = cls.keyForUrl(url + str(entry.numCopies))
+            copy = yield copyKey.get_async()
+            if copy is None:
+                yield ndb.put_multi_async([entry, cls(key=copyKey, pointRoot=pointRootKey)])
+                raise ndb.Return(copyKey.id())
+        raise WhysaurusException('Could not find a free URL for %s' % url)
+
+    @classmethod
+    def claim(cls, url, pointRootKey=None, legacyCopies=None):
+        return cls.claim_async(url, pointRootKey, legacyCopies).get_result()
+
+    # Frees a URL claimed for an edit that was then rejected.
+    # An entry that copies have been numbered from is kept, to keep its count.
+    @classmethod
+    @ndb.transactional
+    def release(cls, url, pointRootKey):
+        entry = cls.keyForUrl(url).get()
+        if entry is None or entry.pointRoot != pointRootKey:
+            return
+        if entry.numCopies:
+            entry.pointRoot = None
+            entry.put()
+        else:
+            entry.key.delete()
+
+    # Points the entry for a claimed URL at the root that took it.
+    # Joins an enclosing transaction, adding the entry's entity group to it.
+    @classmethod
+    @ndb.transactional_tasklet
+    def register_async(cls, url, pointRootKey, numCopies=0):
+        entry = yield cls.keyForUrl(url).get_async()
+        if entry is None:
+            entry = cls(key=cls.keyForUrl(url), numCopies=numCopies)
+        elif entry.pointRoot == pointRootKey:
+            raise ndb.Return(entry)
+        entry.pointRoot = pointRootKey
+        yield entry.put_async()
+        raise ndb.Return(entry)
+
+    @classmethod
+    def register(cls, url, pointRootKey, numCopies=0):
+        return cls.register_async(url, pointRootKey, numCopies).get_result()
+
+    # Gives URLs taken before the registry existed their entries; for the migration job.
+    # A former URL whose point is not known is left to resolve through its RedirectURL.
+    @classmethod
+    @ndb.transactional
+    def addLegacy(cls, url, pointRootKey, numCopies):
+        entry = cls.keyForUrl(url).get()
+        if entry is None:
+            cls(key=cls.keyForUrl(url), pointRoot=pointRootKey, numCopies=numCopies or 0).put()
+            return True
+        changed = False
+        if pointRootKey and entry.pointRoot is None:
+            entry.pointRoot = pointRootKey
+            changed = True
+        if numCopies and numCopies > entry.numCopies:
+            entry.numCopies = numCopies
+            changed = True
+        if changed:
+            entry.put()
+        return changed
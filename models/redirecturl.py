@@ -1,30 +1,73 @@
 from google.appengine.ext import ndb
 
+from pointURL import PointURL
+
+# Keyed by fromURL, so resolving a redirect is one key get, which ndb serves from
+#  its caches. Redirects written before were given generated ids; they are found
+#  by query until the MigratePointURLs job has re-keyed them.
 class RedirectURL(ndb.Model):
     fromURL = ndb.StringProperty()
     toURL = ndb.StringProperty()
     numCopies = ndb.IntegerProperty(default=0)
 
+    UPDATE_PAGE_SIZE = 100
+
+    @staticmethod
+    def keyForFromURL(url):
+        return ndb.Key(RedirectURL, url)
+
+    @staticmethod
+    def create(fromURL, toURL):
+        redirectURL = RedirectURL(key=RedirectURL.keyForFromURL(fromURL),
+                                  fromURL=fromURL, toURL=toURL)
+        redirectURL.put()
+        return redirectURL
+
     @staticmethod
     def getByFromURL(url):
-        redirectQuery = RedirectURL.gql("WHERE fromURL= :1", url)
-        redirectURL = redirectQuery.get()
+        redirectURL = RedirectURL.getByFromURL_asynch(url).get_result()
         if redirectURL:
             return redirectURL.toURL
         else:
             return None
-            
+
     @staticmethod
     @ndb.tasklet
     def getByFromURL_asynch(url):
-        redirectQuery = RedirectURL.gql("WHERE fromURL= :1", url)
-        redirectURLfuture = yield redirectQuery.get_async()
-        raise ndb.Return(redirectURLfuture)
+        redirectURL, marker = yield ndb.get_multi_async(
+            [RedirectURL.keyForFromURL(url), ndb.Key(PointURL, PointURL.MIGRATED_ID)])
+        if redirectURL is None and marker is None:
+            redirectQuery = RedirectURL.gql("WHERE fromURL= :1", url)
+            redirectURL = yield redirectQuery.get_async()
+        raise ndb.Return(redirectURL)
 
+    # Points every redirect to toURL at updatedToURL, so no redirect is more than one
+    #  step from its point. Pages through them with a cursor, one put_multi per page.
     @staticmethod
     def updateRedirects(toURL, updatedToURL):
-        redirectQuery = RedirectURL.gql("WHERE toURL= :1", toURL)
-        redirectURLs = redirectQuery.fetch(50)
-        for redirectURL in redirectURLs:
-            redirectURL.toURL = updatedToURL
-            redirectURL.put()
+        query = RedirectURL.query(RedirectURL.toURL == toURL)
+        cursor = None
+        more = True
+        numUpdated = 0
+        while more:
+            redirectURLs, cursor, more = query.fetch_page(
+                RedirectURL.UPDATE_PAGE_SIZE, start_cursor=cursor)
+            for redirectURL in redirectURLs:
+                redirectURL.toURL = updatedToURL
+            if redirectURLs:
+                ndb.put_multi(redirectURLs)
+            numUpdated = numUpdated + len(redirectURLs)
+            more = more and cursor
+        return numUpdated
+
+    # Replaces a redirect with a generated id by one keyed by its fromURL
+    @ndb.transactional(xg=True)
+    def rekey(self, toURL=None):
+        keyed = RedirectURL.keyForFromURL(self.fromURL).get()
+        if keyed is None:
+            keyed = RedirectURL(key=RedirectURL.keyForFromURL(self.fromURL),
+                                fromURL=self.fromURL, toURL=toURL or self.toURL,
+                                numCopies=self.numCopies)
+            keyed.put()
+        self.key.delete()
+        return keyed
@@ -0,0 +1,90 @@
+import functools
+from collections import OrderedDict
+from google.appengine.ext import ndb
+
+# Coalesces repeated puts of the same entity within a request or transaction.
+# Gets are already deduplicated by ndb's in-context cache, which hands back the same
+#  instance for a key, and concurrent async gets are merged into one get_multi by
+#  its autobatcher. What ndb does not do is collapse puts: a method that sets a
+#  flag and puts, followed by another that sets a field and puts, costs two writes.
+#
+# Inside a unitOfWork, putLater records the entity and the outermost unitOfWork
+#  writes everything recorded with one put_multi as it exits. Outside of one,
+#  putLater is a plain put. Until then the entities are only in the unit of work,
+#  so code that may read one back uses getPendingOrGet. The pending entities belong to the current ndb context,
+#  so a transaction (which runs in its own context) needs its own unitOfWork,
+#  placed inside ndb.transactional so the writes are flushed before the commit.
+
+def _pending(ctx):
+    pending = getattr(ctx, '_unitOfWorkPending', None)
+    if pending is None:
+        pending = ctx._unitOfWorkPending = OrderedDict()
+        ctx._unitOfWorkDepth = 0
+    return pending
+
+def inUnitOfWork():
+    return getattr(ndb.get_context(), '_unitOfWorkDepth', 0) > 0
+
+def putLater(entity):
+    ctx = ndb.get_context()
+    # A new entity is put at once, since its caller usually needs the allocated key
+    if not inUnitOfWork() or entity.key is None or not entity.key.id():
+        entity.put()
+        return
+    _pending(ctx)[entity.key] = entity
+
+# Gets key, or the entity pending for it in this unit of work. ndb's in-context
+#  cache already hands back an instance that was read and then changed, but not
+#  one built anew for its key, like a new version or a rebuilt index entry.
+def getPendingOrGet(key):
+    pending = getattr(ndb.get_context(), '_unitOfWorkPending', None)
+    if pending and key in pending:
+        return pending[key]
+    return key.get()
+
+def putLaterMulti(entities):
+    for entity in entities:
+        putLater(entity)
+
+def flush():
+    ctx = ndb.get_context()
+    pending = _pending(ctx)
+    if pending:
+        entities = pending.values()
+        pending.clear()
+        ndb.put_multi(entities)
+
+def unitOfWork(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwds):
+        ctx = ndb.get_context()
+        _pending(ctx)
+        ctx._unitOfWorkDepth += 1
+        try:
+            result = func(*args, **kwds)
+        except:
+            ctx._unitOfWorkDepth -= 1
+            if not ctx._unitOfWorkDepth:
+                _pending(ctx).clear()
+            raise
+        ctx._unitOfWorkDepth -= 1
+        if not ctx._unitOfWorkDepth:
+            flush()
+        return result
+    return wrapper
+
+# Gives new entities their keys with one allocate_ids per kind and parent, so they
+#  can be written in a unit of work's put_multi rather than put one by one for a key
+def allocateKeys(entities):
+    groups = OrderedDict()
+    for entity in entities:
+        if entity.key is None or not entity.key.id():
+            parent = entity.key.parent() if entity.key else None
+            groups.setdefault((type(entity), parent), []).append(entity)
+    futures = [(modelClass, parent, group,
+                modelClass.allocate_ids_async(size=len(group), parent=parent))
+               for (modelClass, parent), group in groups.items()]
+    for modelClass, parent, group, future in futures:
+        start, end = future.get_result()
+        for entity, entityId in zip(group, range(start, end + 1)):
+            entity.key = ndb.Key(modelClass, entityId, parent=parent)
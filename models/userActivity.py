@@ -0,0 +1,77 @@
+import datetime
+from google.appengine.ext import ndb
+
+# Recently viewed points and visit statistics of a user.
+# Kept apart from WhysaurusUser so that viewing a point writes this small entity
+#  rather than the whole user record. Keyed by the user id, in the user's namespace.
+class UserActivity(ndb.Model):
+    recentlyViewedRootKeys = ndb.KeyProperty(repeated=True, indexed=False)
+    viewCount = ndb.IntegerProperty(default=0, indexed=False)
+    lastViewed = ndb.DateTimeProperty(indexed=False)
+    lastVisitDate = ndb.DateTimeProperty(indexed=False)
+    lastVisitCount = ndb.IntegerProperty(default=0, indexed=False)
+    lastVisitAvgIntervalDays = ndb.FloatProperty(default=0, indexed=False)
+
+    MAX_RECENTLY_VIEWED = 10
+
+    @classmethod
+    def keyForUser(cls, userKey):
+        return ndb.Key(cls, userKey.id(), namespace=userKey.namespace())
+
+    # Users from before this entity existed carry these values on the user record
+    @classmethod
+    def fromUser(cls, user):
+        return cls(key=cls.keyForUser(user.key),
+                   recentlyViewedRootKeys=list(user.recentlyViewedRootKeys or []),
+                   viewCount=user.viewCount or 0,
+                   lastViewed=user.lastViewed,
+                   lastVisitDate=user.lastVisitDate,
+                   lastVisitCount=user.lastVisitCount or 0,
+                   lastVisitAvgIntervalDays=user.lastVisitAvgIntervalDays or 0)
+
+    @classmethod
+    @ndb.tasklet
+    def getForUser_async(cls, user):
+        activity = yield cls.keyForUser(user.key).get_async()
+        raise ndb.Return(activity if activity else cls.fromUser(user))
+
+    @classmethod
+    def getForUsers(cls, users):
+        activities = ndb.get_multi([cls.keyForUser(user.key) for user in users])
+        return [activity if activity else cls.fromUser(user)
+                for user, activity in zip(users, activities)]
+
+    # Returns whether the point was added to the recently viewed list. The caller puts.
+    def recordView(self, pointRootKey):
+        addedToList = False
+
+        if pointRootKey in self.recentlyViewedRootKeys:
+            self.recentlyViewedRootKeys.remove(pointRootKey)
+        else:
+            addedToList = True
+        self.recentlyViewedRootKeys.insert(0, pointRootKey)
+
+        if len(self.recentlyViewedRootKeys) > self.MAX_RECENTLY_VIEWED:
+            self.recentlyViewedRootKeys.pop()
+
+        if not self.viewCount:
+            self.viewCount = len(self.recentlyViewedRootKeys)
+        else:
+            self.viewCount += 1
+
+        now = datetime.datetime.now()
+        self.lastViewed = now
+
+        if self.lastVisitDate:
+            if self.lastVisitDate.date() != now.date():
+                daysSinceLastVisit = (now.date() - self.lastVisitDate.date()).days
+                self.lastVisitAvgIntervalDays = (daysSinceLastVisit + self.lastVisitAvgIntervalDays * self.lastVisitCount) / (self.lastVisitCount + 1)
+                self.lastVisitCount += 1
+                self.lastVisitDate = now
+        else:
+            # Let's not count the very first visit so we're consistent
+            self.lastVisitCount = 0
+            self.lastVisitAvgIntervalDays = 0
+            self.lastVisitDate = now
+
+        return addedToList
@@ -0,0 +1,66 @@
+import datetime
+from google.appengine.ext import ndb
+
+# A point a user created or edited.
+# Replaces the unbounded createdPointRootKeys/editedPointRootKeys lists on WhysaurusUser.
+# Keyed by user, role and root, and stored in the namespace of the point,
+#  so a user's points in the current area are one query.
+class UserPoint(ndb.Model):
+    user = ndb.KeyProperty()
+    pointRoot = ndb.KeyProperty(indexed=False)
+    role = ndb.StringProperty() # created, edited
+    timestamp = ndb.DateTimeProperty()
+
+    @classmethod
+    def makeKey(cls, userKey, pointRootKey, role):
+        return ndb.Key(cls, '%s|%s|%s' % (userKey.id(), role, pointRootKey.urlsafe()),
+                       namespace=pointRootKey.namespace())
+
+    @classmethod
+    def recordPoints(cls, userKey, pointRootKeys, role, timestamp=None):
+        """Records the points with one get_multi and one put_multi.
+        An edit moves an already recorded point to the top; a creation is recorded once."""
+        timestamp = timestamp if timestamp else datetime.datetime.now()
+        keys = [cls.makeKey(userKey, rootKey, role) for rootKey in pointRootKeys]
+        toPut = []
+        for key, rootKey, userPoint in zip(keys, pointRootKeys, ndb.get_multi(keys)):
+            if userPoint is None:
+                userPoint = cls(key=key, user=userKey, pointRoot=rootKey, role=role)
+            elif role == 'created':
+                continue
+            userPoint.timestamp = timestamp
+            toPut.append(userPoint)
+        if toPut:
+            ndb.put_multi(toPut)
+        return len(toPut)
+
+    @classmethod
+    def getPage(cls, userKey, role, cursor=None, pageSize=50):
+        return cls.getPage_async(userKey, role, cursor, pageSize).get_result()
+
+    @classmethod
+    @ndb.tasklet
+    def getPage_async(cls, userKey, role, cursor=None, pageSize=50):
+        """Returns a page of root keys in the current namespace, newest first"""
+        q = cls.query(cls.user == userKey, cls.role == role).order(-cls.timestamp)
+        userPoints, nextCursor, more = yield q.fetch_page_async(pageSize, start_cursor=cursor)
+        raise ndb.Return(([up.pointRoot for up in userPoints], nextCursor, more))
+
+    # All of a user's root keys for role in the current namespace, newest first, from
+    #  a keys only query: the root key is in each entry's key
+    @classmethod
+    @ndb.tasklet
+    def getAllRootKeys_async(cls, userKey, role):
+        q = cls.query(cls.user == userKey, cls.role == role).order(-cls.timestamp)
+        keys = yield q.fetch_async(keys_only=True)
+        raise ndb.Return([ndb.Key(urlsafe=k.id().split('|', 2)[2]) for k in keys])
+
+    @classmethod
+    def count_async(cls, userKey, role):
+        return cls.query(cls.user == userKey, cls.role == role).count_async()
+
+
+# Run by deferred, so that recording the points does not add entity groups to the
+#  transaction that created or edited them
+def recordUserPoints(userKey, pointRootKeys, role):
+    UserPoint.recordPoints(userKey, pointRootKeys, role)
@@ -2,11 +2,23 @@ from google.appengine.ext import ndb
 import logging
 from models.whysaurusexception import WhysaurusException
 
+# Key names are derived from the point root keys, so that a user's votes
+# can be read with a get (or one get_multi for a list) instead of a query.
+# The namespace is part of the name because votes are stored under the user,
+# in the default namespace, while the points can live in a private area
+def rootKeyName(pointRootKey):
+    return '%s|%s' % (pointRootKey.namespace(),
+                      '/'.join(str(part) for part in pointRootKey.flat()))
+
 class UserVote(ndb.Model):
     pointRootKey = ndb.KeyProperty(required=True)
     value = ndb.IntegerProperty(required=True, indexed=False)  # 1, 0, -1
     ribbon = ndb.BooleanProperty(default=False, indexed=False)        
 
+    @classmethod
+    def makeKey(cls, userKey, pointRootKey):
+        return ndb.Key(cls, rootKeyName(pointRootKey), parent=userKey)
+
 class RelevanceVote(ndb.Model):    
     parentPointRootKey = ndb.KeyProperty(required=True)
     childPointRootKey = ndb.KeyProperty(required=True) 
@@ -14,6 +26,13 @@ class RelevanceVote(ndb.Model):
     value = ndb.IntegerProperty(required=True, indexed=False)  # 1, 0, -1
     dateCreated = ndb.DateTimeProperty(auto_now_add=True, indexed=False)
     dateEdited = ndb.DateTimeProperty(auto_now=True, indexed=False) 
+
+    @classmethod
+    def makeKey(cls, userKey, parentRootKey, childRootKey, linkType):
+        return ndb.Key(cls, '%s>%s>%s' % (rootKeyName(parentRootKey),
+                                         rootKeyName(childRootKey),
+                                         linkType),
+                       parent=userKey)
         
     @classmethod
     def getExistingVotes(cls, fromRootKey, toRootKey, linkType):
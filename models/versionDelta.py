@@ -0,0 +1,69 @@
+import re
+import difflib
+
+# Encodes a point version as the changes that turn the next version back into it.
+# Text is diffed by words and whitespace runs, which is much faster than by
+#  characters and still small for the usual edits of a few sentences.
+# A text delta is a list of ops: an int pair copies that range of the newer
+#  version's tokens, a string is inserted as is. Other values are stored whole,
+#  and only when they differ from the newer version's, except for wholeFields,
+#  which are always stored: the newer version may still change them in place.
+
+TOKEN_RE = re.compile(r'\s+|[^\s]+')
+
+def tokenize(text):
+    return TOKEN_RE.findall(text) if text else []
+
+def encodeText(older, newer):
+    olderTokens = tokenize(older)
+    newerTokens = tokenize(newer)
+    matcher = difflib.SequenceMatcher(None, newerTokens, olderTokens, autojunk=False)
+    ops = []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            ops.append((i1, i2))
+        elif tag in ('replace', 'insert'):
+            ops.append(u''.join(olderTokens[j1:j2]))
+    return ops
+
+def decodeText(ops, newer):
+    newerTokens = tokenize(newer)
+    parts = []
+    for op in ops:
+        if isinstance(op, tuple):
+            parts.extend(newerTokens[op[0]:op[1]])
+        else:
+            parts.append(op)
+    return u''.join(parts)
+
+def encode(older, newer, fields, textFields, wholeFields=()):
+    delta = {}
+    for name in fields:
+        olderValue = getattr(older, name)
+        newerValue = getattr(newer, name)
+        if name in wholeFields:
+            delta[name] = list(olderValue) if isinstance(olderValue, list) else olderValue
+            continue
+        if olderValue == newerValue:
+            continue
+        if name in textFields and olderValue and newerValue:
+            ops = encodeText(olderValue, newerValue)
+            # A rewrite is stored whole, since its ops would be no smaller
+            if sum(len(op) for op in ops if not isinstance(op, tuple)) < len(olderValue):
+                delta[name] = ops
+                continue
+        delta[name] = olderValue
+    return delta
+
+# Returns the values of fields for the version that delta was made from
+def decode(delta, newer, fields, textFields):
+    values = {}
+    for name in fields:
+        newerValue = getattr(newer, name)
+        if name not in delta:
+            values[name] = list(newerValue) if isinstance(newerValue, list) else newerValue
+        elif name in textFields and isinstance(delta[name], list):
+            values[name] = decodeText(delta[name], newerValue)
+        else:
+            values[name] = delta[name]
+    return values
@@ -0,0 +1,66 @@
+import random
+import logging
+from google.appengine.ext import ndb
+
+NUM_VIEW_SHARDS = 10
+
+# Views of a point not yet added to PointRoot.viewCount.
+# Each view increments one of NUM_VIEW_SHARDS small entities, outside the point root's
+#  entity group, and flushViewCounts periodically moves the pending views onto the root.
+class PointViewShard(ndb.Model):
+    pending = ndb.IntegerProperty(default=0)
+
+    @classmethod
+    def shardKey(cls, pointRootKey, index):
+        return ndb.Key(cls, '%s|%d' % (pointRootKey.urlsafe(), index),
+                       namespace=pointRootKey.namespace())
+
+    @staticmethod
+    def rootKeyForShardKey(shardKey):
+        return ndb.Key(urlsafe=shardKey.id().rsplit('|', 1)[0])
+
+    @classmethod
+    @ndb.transactional_tasklet
+    def _increment_async(cls, shardKey):
+        shard = yield shardKey.get_async()
+        if shard is None:
+            shard = cls(key=shardKey)
+        shard.pending = shard.pending + 1
+        yield shard.put_async()
+
+    @classmethod
+    def addView_async(cls, pointRootKey):
+        index = random.randint(0, NUM_VIEW_SHARDS - 1)
+        return cls._increment_async(cls.shardKey(pointRootKey, index))
+
+    # Returns a page of roots with pending views
+    @classmethod
+    def getPendingRootKeysPage(cls, cursor=None, pageSize=100):
+        shardKeys, nextCursor, more = cls.query(cls.pending > 0).fetch_page(
+            pageSize, start_cursor=cursor, keys_only=True)
+        rootKeys = []
+        for shardKey in shardKeys:
+            rootKey = cls.rootKeyForShardKey(shardKey)
+            if rootKey not in rootKeys:
+                rootKeys.append(rootKey)
+        return rootKeys, nextCursor, more
+
+    @classmethod
+    @ndb.transactional(xg=True)
+    def flushRoot(cls, pointRootKey):
+        shardKeys = [cls.shardKey(pointRootKey, i) for i in range(NUM_VIEW_SHARDS)]
+        entities = ndb.get_multi([pointRootKey] + shardKeys)
+        pointRoot = entities[0]
+        shards = [s for s in entities[1:] if s and s.pending]
+        views = sum(s.pending for s in shards)
+        if not views:
+            return 0
+        for shard in shards:
+            shard.pending = 0
+        if pointRoot:
+            pointRoot.viewCount = (pointRoot.viewCount or 0) + views
+            ndb.put_multi([pointRoot] + shards)
+        else:
+            logging.info('Dropping %d views of deleted point root %s' % (views, str(pointRootKey)))
+            ndb.put_multi(shards)
+        return views
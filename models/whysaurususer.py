@@ -8,6 +8,8 @@ import webapp2
 from random import randint
 
 from google.appengine.ext import ndb
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import deferred
 from google.appengine.api import search
 import webapp2_extras.appengine.auth.models as auth_models
 from webapp2_extras.appengine.auth.models import Unique
@@ -16,11 +18,12 @@ from webapp2_extras import security
 from google.appengine.api import namespace_manager
 from google.appengine.api import mail
 from google.appengine.api import channel
+from google.appengine.api.taskqueue import Task
 #from google.cloud import error_reporting
 
 from models.notification import Notification
 from models.chatUser import ChatUser
-from models.point import getCurrent_async
+from models.point import getPointCards_async
 from models.areauser import AreaUser
 
 from whysaurusexception import WhysaurusException
@@ -29,6 +32,13 @@ from uservote import RelevanceVote
 from timezones import PST
 
 from models.reportEvent import ReportEvent
+from models.notificationEmailRun import NotificationEmailRun
+from models.userActivity import UserActivity
+from models.userPoint import UserPoint, recordUserPoints
+
+NOTIFICATION_EMAIL_FREQUENCIES = ['Daily', 'Weekly']
+# Users per page task. With the notificationEmails queue rate this bounds the send rate
+NOTIFICATION_EMAIL_PAGE_SIZE = 25
 
 
 class WhysaurusUser(auth_models.User):
@@ -40,14 +50,19 @@ class WhysaurusUser(auth_models.User):
     admin = ndb.BooleanProperty(default=False)
     internal = ndb.BooleanProperty(default=False)
     role = ndb.StringProperty(default="")
+    # Recently viewed and visit statistics are now kept in UserActivity
+    # These are no longer written; they seed UserActivity for existing users
     recentlyViewedRootKeys = ndb.KeyProperty(repeated=True)
     viewCount = ndb.IntegerProperty(default=0)
     lastViewed = ndb.DateTimeProperty()
     lastVisitDate = ndb.DateTimeProperty()
     lastVisitCount = ndb.IntegerProperty(default=0)
     lastVisitAvgIntervalDays = ndb.FloatProperty(default=0)
+    # Created and edited points are now recorded as UserPoint entities
+    # These lists are emptied by migratePointIndex, and read until then
     createdPointRootKeys = ndb.KeyProperty(repeated=True)
     editedPointRootKeys = ndb.KeyProperty(repeated=True)
+    pointIndexMigrated = ndb.BooleanProperty(default=False)
     websiteURL = ndb.StringProperty()
     areasOfExpertise = ndb.StringProperty()
     currentProfession = ndb.StringProperty()
@@ -63,7 +78,11 @@ class WhysaurusUser(auth_models.User):
     loginAvgIntervalDays = ndb.FloatProperty(default=0)
     notificationFrequency = ndb.StringProperty(default="Weekly")
     lastEmailSent = ndb.DateTimeProperty()
+    votesMigrated = ndb.BooleanProperty(default=False) # votes are keyed by point root
     _notifications = None
+    _activity = None
+    _pointCounts = None
+    _legacyVotes = None
     
     # linkedInProfileLink = ndb.StringProperty()
     # facebookProfileLink =  ndb.StringProperty()
@@ -80,7 +99,17 @@ class WhysaurusUser(auth_models.User):
 
     @property
     def PSTlastView(self):
-        return PST.convert(self.lastViewed)
+        return PST.convert(self.activity.lastViewed)
+
+    @ndb.tasklet
+    def getActivity_async(self):
+        if self._activity is None:
+            self._activity = yield UserActivity.getForUser_async(self)
+        raise ndb.Return(self._activity)
+
+    @property
+    def activity(self):
+        return self.getActivity_async().get_result()
         
     @property
     def notifications(self):
@@ -115,10 +144,14 @@ class WhysaurusUser(auth_models.User):
         return self.isAdmin
        
     def getActiveNotifications(self):
+        return self.getActiveNotifications_async().get_result()
+
+    @ndb.tasklet
+    def getActiveNotifications_async(self):
         self._notifications, self._newNotificationCount, \
             self._moreNotificationsExist = \
-                Notification.getLatestNotificationsForUser(self.key)
-        return self._notifications
+                yield Notification.getLatestNotificationsForUser_async(self.key)
+        raise ndb.Return(self._notifications)
 
     def getUnreadNotifications(self):
         self._notifications, self._newNotificationCount, \
@@ -389,47 +422,161 @@ class WhysaurusUser(auth_models.User):
         
     @property
     def createdCount(self):
-        return len(self.createdPointRootKeys)
+        return self.getPointCount('created')
  
     @property
     def editedCount(self):
-        return len(self.editedPointRootKeys)
+        return self.getPointCount('edited')
+
+    def _getLegacyPointRootKeys(self, role):
+        rootKeys = self.createdPointRootKeys if role == 'created' else self.editedPointRootKeys
+        return self.filterKeylistByCurrentNamespace(rootKeys)
+
+    # Number of points in the current area the user has created or edited
+    def getPointCount(self, role):
+        return self.getPointCount_async(role).get_result()
+
+    @ndb.tasklet
+    def getPointCount_async(self, role):
+        if self._pointCounts is None:
+            self._pointCounts = {}
+        if role not in self._pointCounts:
+            if self.pointIndexMigrated:
+                count = yield UserPoint.count_async(self.key, role)
+            else:
+                rootKeys = yield self._getUnmigratedPointRootKeys_async(role)
+                count = len(rootKeys)
+            self._pointCounts[role] = count
+        raise ndb.Return(self._pointCounts[role])
+
+    # Fills in the created and edited counts of many users, running all of their
+    #  queries at once rather than two at a time as a table of users renders
+    @classmethod
+    def prefetchPointCounts(cls, users):
+        ndb.Future.wait_all([u.getPointCount_async(role) for u in users
+                             for role in ['created', 'edited']])
 
     @property
     def viewedCount(self):
-        if self.viewCount and self.viewCount > len(self.recentlyViewedRootKeys):
-            return self.viewCount
-        return len(self.recentlyViewedRootKeys)
+        activity = self.activity
+        if activity.viewCount and activity.viewCount > len(activity.recentlyViewedRootKeys):
+            return activity.viewCount
+        return len(activity.recentlyViewedRootKeys)
 
     def getVoteFuture(self, pointRootKey):
-        return UserVote.query(            
-            UserVote.pointRootKey==pointRootKey, ancestor=self.key).get_async()
+        return self.getVote_async(pointRootKey)
 
     @ndb.tasklet
     def getVote_async(self, pointRootKey):
-        vote = yield UserVote.query(            
-            UserVote.pointRootKey==pointRootKey, ancestor=self.key).get_async()
-        raise ndb.Return(vote)
+        votes = yield self.getVotes_async([pointRootKey])
+        raise ndb.Return(votes.get(pointRootKey))
         
     def getVoteValue(self, pointRootKey):
-        vote = UserVote.query(            
-            UserVote.pointRootKey==pointRootKey, ancestor=self.key).get()
+        vote = self.getVote_async(pointRootKey).get_result()
         return vote.value if vote else 0
 
     @ndb.tasklet
     def getVoteValue_async(self, pointRootKey):
-        vote = yield UserVote.query(            
-            UserVote.pointRootKey==pointRootKey, ancestor=self.key).get_async()
+        vote = yield self.getVote_async(pointRootKey)
         raise ndb.Return(vote.value if vote else 0)
         
     def getVoteValues(self, pointRootKey):
-        vote = UserVote.query(            
-            UserVote.pointRootKey==pointRootKey, ancestor=self.key).get()
+        vote = self.getVote_async(pointRootKey).get_result()
         if vote:
             return vote.value, vote.ribbon
         else:
             return 0, False                    
 
+    # The most point roots in one legacy vote query: the limit of an IN filter
+    LEGACY_VOTE_QUERY_ROOTS = 30
+
+    # This user's votes for pointRootKeys by point root, from ancestor queries limited
+    #  to those roots, run in parallel and kept for the request. Only for users whose
+    #  votes migrateVotes has not re-keyed, so a list or tree costs a query per 30
+    #  points rather than one per point.
+    @ndb.tasklet
+    def _getLegacyVotes_async(self, pointRootKeys):
+        if self._legacyVotes is None:
+            self._legacyVotes = {}
+        unqueried = [k for k in set(pointRootKeys) if k not in self._legacyVotes]
+        if unqueried:
+            n = self.LEGACY_VOTE_QUERY_ROOTS
+            results = yield [UserVote.query(UserVote.pointRootKey.IN(unqueried[i:i + n]),
+                                            ancestor=self.key).fetch_async()
+                             for i in range(0, len(unqueried), n)]
+            for k in unqueried:
+                self._legacyVotes[k] = None
+            for votes in results:
+                for vote in votes:
+                    self._legacyVotes[vote.pointRootKey] = vote
+        raise ndb.Return(dict((k, self._legacyVotes[k]) for k in pointRootKeys
+                              if self._legacyVotes.get(k)))
+
+    # Returns a dict of point root key -> this user's UserVote, 
+    # reading the votes for all the roots with one get_multi
+    @ndb.tasklet
+    def getVotes_async(self, pointRootKeys):
+        votes = yield ndb.get_multi_async(
+            [UserVote.makeKey(self.key, rootKey) for rootKey in pointRootKeys])
+        votesByRoot = dict((vote.pointRootKey, vote) for vote in votes if vote)
+        if not self.votesMigrated:
+            # Votes recorded before keys were derived from the root
+            # can only be found by a query until migrateVotes has run
+            missingKeys = [k for k in pointRootKeys if k not in votesByRoot]
+            if missingKeys:
+                legacyVotes = yield self._getLegacyVotes_async(missingKeys)
+                votesByRoot.update(legacyVotes)
+        raise ndb.Return(votesByRoot)
+
+    # Attaches this user's vote to every point in a list
+    @ndb.tasklet
+    def addVotesToPoints_async(self, points):
+        if points:
+            votes = yield self.getVotes_async(
+                [point.key.parent() for point in points if point])
+            for point in points:
+                if point:
+                    vote = votes.get(point.key.parent())
+                    point._vote = vote.value if vote else 0
+        raise ndb.Return(points)
+
+    # Moves votes stored under auto-allocated ids to keys derived from the point roots
+    def migrateVotes(self):
+        movedCount = 0
+        for voteClass, makeKey in [
+                (UserVote, lambda v: UserVote.makeKey(
+                    self.key, v.pointRootKey)),
+                (RelevanceVote, lambda v: RelevanceVote.makeKey(
+                    self.key, v.parentPointRootKey, v.childPointRootKey, v.linkType))]:
+            legacyVotes = [v for v in voteClass.query(ancestor=self.key).fetch()
+                           if v.key != makeKey(v)]
+            if not legacyVotes:
+                continue
+            newKeys = [makeKey(v) for v in legacyVotes]
+            existingVotes = ndb.get_multi(newKeys)
+            newVotes = []
+            for legacyVote, newKey, existingVote in zip(legacyVotes, newKeys, existingVotes):
+                if not existingVote:
+                    newVote = voteClass(key=newKey)
+                    newVote.populate(**legacyVote.to_dict())
+                    newVotes.append(newVote)
+            ndb.put_multi(newVotes)
+            ndb.delete_multi([v.key for v in legacyVotes])
+            movedCount = movedCount + len(newVotes)
+        self.votesMigrated = True
+        self._setVotesMigrated(self.key)
+        return movedCount
+
+    # Sets the flag on a fresh copy of the user, so a change made to the user while
+    #  its votes were moved is not overwritten
+    @staticmethod
+    @ndb.transactional
+    def _setVotesMigrated(userKey):
+        user = userKey.get()
+        if user and not user.votesMigrated:
+            user.votesMigrated = True
+            user.put()
+
     def updateUserSettings(self, pas, role = None):
         oldPas = AreaUser.query(AreaUser.userKey==self.key.urlsafe()).fetch()
         
@@ -448,14 +595,13 @@ class WhysaurusUser(auth_models.User):
         self.put()            
 
     def _getOrCreateVote(self, pointRootKey):
-        vote = UserVote.query(             
-            UserVote.pointRootKey==pointRootKey, ancestor=self.key).get()            
+        vote = self.getVote_async(pointRootKey).get_result()
         if not vote:  # No vote yet, create a new one
             vote = UserVote(
+                key=UserVote.makeKey(self.key, pointRootKey),
                 pointRootKey=pointRootKey,
                 value=0,
-                ribbon=False,
-                parent=self.key
+                ribbon=False
             )        
         return vote
         
@@ -494,7 +640,10 @@ class WhysaurusUser(auth_models.User):
                 point.downVotes = point.downVotes + 1
                 point.upVotes = point.upVotes - 1
             point.voteTotal = point.upVotes - point.downVotes
+            point.updateCachedValues()
             point.put()
+            if point.current:
+                point.updateCard()
 
         return vote
 
@@ -524,14 +673,17 @@ class WhysaurusUser(auth_models.User):
         pointRoot = parentRootKey.get()
         curPoint = pointRoot.current.get()
         
-        oldRelVote = RelevanceVote.query(
-            RelevanceVote.parentPointRootKey == parentRootKey,
-            RelevanceVote.childPointRootKey == childRootKey,
-            RelevanceVote.linkType == linkType,
-            ancestor=self.key).get()
+        relVoteKey = RelevanceVote.makeKey(self.key, parentRootKey, childRootKey, linkType)
+        oldRelVote = relVoteKey.get()
+        if not oldRelVote and not self.votesMigrated:
+            oldRelVote = RelevanceVote.query(
+                RelevanceVote.parentPointRootKey == parentRootKey,
+                RelevanceVote.childPointRootKey == childRootKey,
+                RelevanceVote.linkType == linkType,
+                ancestor=self.key).get()
             
         newRelVote = RelevanceVote(
-            parent=self.key,
+            key=relVoteKey,
             parentPointRootKey = parentRootKey,
             childPointRootKey = childRootKey,
             value = vote,
@@ -591,131 +743,108 @@ class WhysaurusUser(auth_models.User):
 
             
 
-    def _updateRecentlyViewed(self, pointRootKey):
-        addedToList = False
-
-        if not self.recentlyViewedRootKeys:
-            self.recentlyViewedRootKeys = [pointRootKey]
-            addedToList = True
-
-        if pointRootKey in self.recentlyViewedRootKeys:
-            self.recentlyViewedRootKeys.remove(pointRootKey)
-            self.recentlyViewedRootKeys.insert(0, pointRootKey)
-        else:
-            self.recentlyViewedRootKeys.insert(0, pointRootKey)
-            addedToList = True
-
-        if len(self.recentlyViewedRootKeys) > 10:
-            self.recentlyViewedRootKeys.pop()
-
-        if not self.viewCount:
-            self.viewCount = len(self.recentlyViewedRootKeys)
-        else:
-            self.viewCount += 1
-
-        now = datetime.datetime.now()
-        self.lastViewed = now
-
-        if self.lastVisitDate:
-            if self.lastVisitDate.date() == now.date():
-                pass
-            else:
-                daysSinceLastVisit = (now.date() - self.lastVisitDate.date()).days
-                self.lastVisitAvgIntervalDays = (daysSinceLastVisit + self.lastVisitAvgIntervalDays * self.lastVisitCount) / (self.lastVisitCount + 1)
-                self.lastVisitCount += 1
-                self.lastVisitDate = now
-        else:
-            # Let's not count the very first visit so we're consistent
-            self.lastVisitCount = 0
-            self.lastVisitAvgIntervalDays = 0
-            self.lastVisitDate = now
-
-        # We won't put here as each call here is responsible to put afterward
-        
-        return addedToList
-
-    
+    # Writes only the UserActivity entity, not the user
     def updateRecentlyViewed(self, pointRootKey):
-        self._updateRecentlyViewed(pointRootKey)
-        self.put_async()
-        return self.recentlyViewedRootKeys
+        activity = self.activity
+        activity.recordView(pointRootKey)
+        activity.put_async()
+        return activity.recentlyViewedRootKeys
     
     def recordCreatedPoint(self, pointRootKey):
-        self._updateRecentlyViewed(pointRootKey)
-
-        if not self.createdPointRootKeys:
-            self.createdPointRootKeys = [pointRootKey]
-            self.put()            
-        else:
-            if not pointRootKey in self.createdPointRootKeys:
-                self.createdPointRootKeys.insert(0, pointRootKey)
-                self.put()
-                            
+        self.recordCreatedPoints([pointRootKey])
+
+    # The index entries are written by a task queued with the transaction, if any,
+    # so they do not add entity groups to it
+    def recordCreatedPoints(self, pointRootKeys):
+        activity = self.activity
+        for pointRootKey in pointRootKeys:
+            activity.recordView(pointRootKey)
+        activity.put()
+        deferred.defer(recordUserPoints, self.key, pointRootKeys, 'created',
+                       _transactional=ndb.in_transaction())
         
     def recordEditedPoint(self, pointRootKey, write=True):
-        if not self.editedPointRootKeys:
-            self.editedPointRootKeys = [pointRootKey]
-        else:
-            if not pointRootKey in self.editedPointRootKeys:
-                self.editedPointRootKeys.insert(0, pointRootKey)
-            else:
-                self.editedPointRootKeys.remove(pointRootKey)
-                self.editedPointRootKeys.insert(0, pointRootKey)
         if write:
-            self.put()
-        return self.editedPointRootKeys
-
+            UserPoint.recordPoints(self.key, [pointRootKey], 'edited')
+
+    # Moves the createdPointRootKeys/editedPointRootKeys lists into UserPoint entities
+    def migratePointIndex(self):
+        movedCount = 0
+        baseTime = self.created if self.created else datetime.datetime(2000, 1, 1)
+        for role, rootKeys in [('created', self.createdPointRootKeys),
+                               ('edited', self.editedPointRootKeys)]:
+            # The lists are newest first. Entries recorded since the index was
+            # introduced are newer than any of them, so they keep their place.
+            keys = [UserPoint.makeKey(self.key, rootKey, role) for rootKey in rootKeys]
+            existing = ndb.get_multi(keys)
+            toPut = []
+            for i, (key, rootKey, userPoint) in enumerate(zip(keys, rootKeys, existing)):
+                if userPoint is None:
+                    toPut.append(UserPoint(key=key, user=self.key, pointRoot=rootKey, role=role,
+                        timestamp=baseTime + datetime.timedelta(seconds=len(rootKeys) - i)))
+            ndb.put_multi(toPut)
+            movedCount += len(toPut)
+        self.createdPointRootKeys = []
+        self.editedPointRootKeys = []
+        self.pointIndexMigrated = True
+        self.put()
+        return movedCount
 
     def getRecentlyViewed(self, excludeList=None):
-        recentlyViewedPoints = []
-        keysToGet = self.filterKeylistByCurrentNamespace(self.recentlyViewedRootKeys)
-        if excludeList:
-            for x in excludeList:
-                try:
-                    keysToGet.remove(x)
-                except ValueError:
-                    pass
-        pointRoots = ndb.get_multi(keysToGet)
-        for pointRoot in pointRoots:
-            if pointRoot:
-                recentlyViewedPoints = recentlyViewedPoints + [
-                    pointRoot.getCurrent()]
-        return recentlyViewedPoints
+        return self.getRecentlyViewed_async(excludeList).get_result()
     
     @ndb.tasklet
     def getRecentlyViewed_async(self, excludeList=None):
         recentlyViewedPoints = []
-        keysToGet = self.filterKeylistByCurrentNamespace(self.recentlyViewedRootKeys)
+        activity = yield self.getActivity_async()
+        keysToGet = self.filterKeylistByCurrentNamespace(activity.recentlyViewedRootKeys)
         if excludeList:
             for x in excludeList:
                 try:
                     keysToGet.remove(x)
                 except ValueError:
                     pass
-        recentlyViewedPoints = yield map(lambda x: getCurrent_async(x), (yield ndb.get_multi_async(keysToGet)))
+        recentlyViewedPoints = yield getPointCards_async(keysToGet)
         raise ndb.Return(recentlyViewedPoints)             
         
+    # Returns a page of the current versions of the points the user created or edited
+    # in the current area, newest first
+    def getPointsPage(self, role, cursor=None, pageSize=50):
+        rootKeys, nextCursor, more = self.getPointRootKeysPage_async(role, cursor, pageSize).get_result()
+        points = getPointCards_async(rootKeys).get_result()
+        return points, nextCursor, more
+
+    # Until migrated, the points listed on the user follow the indexed ones
+    @ndb.tasklet
+    def _getUnmigratedPointRootKeys_async(self, role):
+        rootKeys = yield UserPoint.getAllRootKeys_async(self.key, role)
+        indexed = set(rootKeys)
+        raise ndb.Return(rootKeys + [k for k in self._getLegacyPointRootKeys(role) if k not in indexed])
+
+    # Cursors of pages taken by offset; not urlsafe base64, so never a query cursor
+    OFFSET_CURSOR_PREFIX = 'offset.'
+
+    # Returns a page of root keys, the urlsafe cursor of the next page and whether there is one.
+    # A user whose points are not yet all indexed is paged by offset through the
+    #  indexed points and then those listed on the user.
+    @ndb.tasklet
+    def getPointRootKeysPage_async(self, role, cursor=None, pageSize=50):
+        if self.pointIndexMigrated and not (cursor and cursor.startswith(self.OFFSET_CURSOR_PREFIX)):
+            rootKeys, nextCursor, more = yield UserPoint.getPage_async(
+                self.key, role, Cursor(urlsafe=cursor) if cursor else None, pageSize)
+            raise ndb.Return((rootKeys, nextCursor.urlsafe() if more and nextCursor else None, more))
+        offset = int(cursor[len(self.OFFSET_CURSOR_PREFIX):]) if cursor else 0
+        allKeys = yield self._getUnmigratedPointRootKeys_async(role)
+        more = offset + pageSize < len(allKeys)
+        raise ndb.Return((allKeys[offset:offset + pageSize],
+                          self.OFFSET_CURSOR_PREFIX + str(offset + pageSize) if more else None, more))
+
     def getCreated(self):
-        createdPoints = []
-        # logging.info("Create point root keys: %d" % len(self.createdPointRootKeys))
-        rootKeys = self.filterKeylistByCurrentNamespace(self.createdPointRootKeys)
-        # logging.info("Filtered root keys by %s: %d" %  \
-        #    (namespace_manager.get_namespace(), len(rootKeys)))
-        # logging.info("Root key list " + str(rootKeys))
-        pointRoots = ndb.get_multi(rootKeys[0:50])
-        for pointRoot in pointRoots:
-            if pointRoot:
-                createdPoints = createdPoints + [pointRoot.getCurrent()]
+        createdPoints, nextCursor, more = self.getPointsPage('created')
         return createdPoints
-        
 
     def getEdited(self):
-        editedPoints = []
-        rootKeys = self.filterKeylistByCurrentNamespace(self.editedPointRootKeys)
-        pointRoots = ndb.get_multi(rootKeys[0:50])
-        for pointRoot in pointRoots:
-            if pointRoot:
-                editedPoints = editedPoints + [pointRoot.getCurrent()]
+        editedPoints, nextCursor, more = self.getPointsPage('edited')
         return editedPoints
     
     def update(self, handler, newWebsiteURL, newUserAreas, newUserProfession, newUserBio, newEmail, newNotificationFrequency):
@@ -873,94 +1002,132 @@ class WhysaurusUser(auth_models.User):
         #     # error_reporting.Client().report_exception()
         #     return
 
-    @classmethod
-    def sendNotificationEmails(cls, handler):
-        # retrieve and iterate all users where the frequency is daily or weekly
-        cntErrors = 0
-        cntErrorsConsecutive = 0
-        qry = cls.query(WhysaurusUser.notificationFrequency.IN(['Daily', 'Weekly']))
-        for user in qry.iter():        
-            # TODO: Renable exception handling once comfortable with reporting
-            # try:
-
-            lastSentTime = user.lastEmailSent if user.lastEmailSent else datetime.datetime(2000,1,1)
-            now = datetime.datetime.now() 
-            today = datetime.datetime(now.year, now.month, now.day)
-            lastDaySent = datetime.datetime(lastSentTime.year, lastSentTime.month, lastSentTime.day)            
-            timeDelta = today - lastDaySent            
-            daysDiff = timeDelta.days
-        
-            shouldEmail = False
+    # Returns the time to collect notifications from if the user is due an email, otherwise None
+    def notificationEmailSince(self, now):
+        lastSentTime = self.lastEmailSent if self.lastEmailSent else datetime.datetime(2000,1,1)
+        today = datetime.datetime(now.year, now.month, now.day)
+        lastDaySent = datetime.datetime(lastSentTime.year, lastSentTime.month, lastSentTime.day)
+        daysDiff = (today - lastDaySent).days
+
+        if self.notificationFrequency == "Daily" and daysDiff >= 1:
+            return lastSentTime
+        elif self.notificationFrequency == "Weekly" and daysDiff >= 7:
+            return lastSentTime
+        return None
+
+    # Expects self.notifications to be loaded, with their references prefetched
+    def sendNotificationEmail(self, handler):
+        notifications = self.notifications
+        logging.info('Sending %d notifications to user %s' % (len(notifications), self.name))
+
+        # generate the email body from the notifications
+        html = handler.template_render(
+            'notificationEmail.html',
+            {'user':self, 'notifications':notifications}
+        )
+
+        points = [(n.referencePoint.title if n.referencePoint else '') + '\n' for n in notifications]
+        points = list(set(points))
+        text = handler.template_render(
+            'notificationEmailText.html',
+            {'user':self, 'pointTitles':points}
+        )
 
-            if user.notificationFrequency == "Daily" and daysDiff >= 1:
-                shouldEmail = True
-            elif user.notificationFrequency == "Weekly" and daysDiff >= 7:
-                shouldEmail = True
+        message = mail.EmailMessage(
+            sender='Whysaurus <community@whysaurus.com>',
+            to=self.email,
+            bcc='notification.copies@whysaurus.com',
+            subject=self.name + ' people are reacting to your arguments on Whysaurus!',
+            body=text,
+            reply_to="community@whysaurus.com"
+        )
+        if html:
+            message.html = html
+        message.send()
 
-            if shouldEmail:
-                if not user.canSendUserEmail():
-                    logging.info('User %s has unread notifications but email unavailable' % user.name)
-                    continue
+        logging.info('Sent mail to user %s' % self.name)
+        # write the time the last notification was sent
+        # this is the checkpoint that keeps a retried page from emailing the user twice
+        self.lastEmailSent = datetime.datetime.now()
+        self.put()
 
-                logging.info('Checking for active notifications for user %s' % user.name)
-                notifications = user.getUnreadNotificationsAfter(lastSentTime)
-                if notifications:
-                    logging.info('Sending %d notifications to user %s' % (len(notifications), user.name))
-
-                    # generate the email body from the notifications
-                    html = handler.template_render(
-                        'notificationEmail.html',
-                        {'user':user, 'notifications':notifications}
-                    )
-
-                    points = [(n.referencePoint.title if n.referencePoint else '') + '\n' for n in notifications]
-                    points = list(set(points))
-                    text = handler.template_render(
-                        'notificationEmailText.html',
-                        {'user':user, 'pointTitles':points}
-                    )
-
-                    # old version, delete once the new version is working:
-                    # mail.send_mail(sender='Whysaurus <community@whysaurus.com>',
-                    #    to=[user.email, 'notification.copies@whysaurus.com'],
-                    #    subject=user.name + ', People are reacting to your views on Whysaurus!',
-                    #    body=text,
-                    #    html=html,
-                    #    reply_to="community@whysaurus.com"
-                    # )
-                    
-                    # new version:
-                    message = mail.EmailMessage(
-                        sender='Whysaurus <community@whysaurus.com>',
-                        to=user.email,
-                        bcc='notification.copies@whysaurus.com',
-                        subject=user.name + ' people are reacting to your arguments on Whysaurus!',
-                        body=text,
-                        reply_to="community@whysaurus.com"
-                    )                    
-                    if html:
-                        message.html = html
-                    message.send()
-                    # (end of new version)                                    
-
-                    logging.info('Sent mail to user %s' % user.name)
-                    # write the time the last notification was sent
-                    user.lastEmailSent = datetime.datetime.now()
-                    user.put()
+    # Starts today's run: one chain of page tasks per notification frequency
+    @classmethod
+    def sendNotificationEmails(cls, handler):
+        runId = NotificationEmailRun.runIdForDate(datetime.datetime.now())
+        run = NotificationEmailRun.start(runId, NOTIFICATION_EMAIL_FREQUENCIES)
+        if not run:
+            logging.warning('Notification email run %s was already started' % runId)
+            return None
+        for frequency in NOTIFICATION_EMAIL_FREQUENCIES:
+            cls.addNotificationEmailTask(runId, frequency)
+        return run
 
-            else:
-                logging.info('User %s has no unread notifications or was emailed recently' % user.name)
-
-            # except:
-            #     logging.error('Exception processing notifications for user: %s' % user.name)
-            #     # TODO: Support full error reporting  (Needs google-cloud imports)
-            #     # error_reporting.Client().report_exception()
-            #     cntErrors += 1
-            #     cntErrorsConsecutive += 1
-            #     if cntErrorsConsecutive >= 3 or cntErrors >= 10:
-            #         logging.error('Too Many Exceptions Processing User Notifications - Abort!')
-            #     continue
+    # cursor is urlsafe. Pages after the first are queued in the transaction that
+    #  records the page before them (see NotificationEmailRun.recordProgress).
+    @classmethod
+    def addNotificationEmailTask(cls, runId, frequency, cursor=None, transactional=False):
+        taskParams = {'runId': runId, 'frequency': frequency}
+        if cursor:
+            taskParams['cursor'] = cursor
+        t = Task(url='/job/sendNotificationEmailsPage', params=taskParams)
+        t.add(queue_name="notificationEmails", transactional=transactional)
+
+    # Sends the emails due to one page of users with this frequency and queues the next page.
+    # The notifications of the whole page are fetched in parallel and their points in one batch.
+    # cursor is urlsafe, '' for the first page.
+    @classmethod
+    def sendNotificationEmailsPage(cls, handler, runId, frequency, cursor=''):
+        run = NotificationEmailRun.get_by_id(runId)
+        if not run or run.pageDone(frequency, cursor):
+            logging.info('Notification email page of %s already done' % frequency)
+            return 0, 0
+        qry = cls.query(cls.notificationFrequency == frequency)
+        users, nextCursor, more = qry.fetch_page(
+            NOTIFICATION_EMAIL_PAGE_SIZE, start_cursor=Cursor(urlsafe=cursor) if cursor else None)
 
+        now = datetime.datetime.now()
+        dueUsers = []
+        for user in users:
+            since = user.notificationEmailSince(now)
+            if since is None:
+                logging.info('User %s was emailed recently' % user.name)
+            elif not user.canSendUserEmail():
+                logging.info('User %s is due notifications but email unavailable' % user.name)
+            else:
+                dueUsers.append((user, since))
+
+        futures = [Notification.getUnreadNotificationsForUserAfterDate_async(user.key, since)
+                   for user, since in dueUsers]
+        usersToEmail = []
+        for (user, since), future in zip(dueUsers, futures):
+            user._notifications, user._newNotificationCount, \
+                user._moreNotificationsExist = future.get_result()
+            if user._notifications:
+                usersToEmail.append(user)
+            else:
+                logging.info('User %s has no unread notifications' % user.name)
+
+        Notification.prefetchReferences(
+            [n for user in usersToEmail for n in user.notifications])
+
+        emailsSent = 0
+        errors = 0
+        for user in usersToEmail:
+            try:
+                user.sendNotificationEmail(handler)
+                emailsSent = emailsSent + 1
+            except Exception, e:
+                # lastEmailSent is unchanged, so the user is picked up again by the next run
+                logging.error('Exception processing notifications for user: %s' % user.name)
+                logging.exception(e)
+                errors = errors + 1
+
+        NotificationEmailRun.recordProgress(
+            runId, frequency, cursor, nextCursor.urlsafe() if more and nextCursor else None,
+            len(users), emailsSent, errors,
+            lambda nextPage: cls.addNotificationEmailTask(runId, frequency, nextPage, transactional=True))
+        return emailsSent, errors
 
     def addToSearchIndex(self):
         index = search.Index(name='users')
@@ -93,6 +93,7 @@ function callPointEdit(){
 	   type: "POST",
 		 data: {
 			'urlToEdit': $('#pointArea').data('pointurl'),
+			'baseVersion': $('#pointArea').data('pointversion'),
 			'content': ed.getContent(),
 			'plainText':text.substring(0,250),
 			'title': $('#title_pointDialog').val(),
@@ -124,6 +125,7 @@ function callPointEdit(){
     				$("#pointDialog").modal('hide');
                     resetSubmitButton('#submit_pointDialog');
     				$('#pointArea').data('pointurl', obj.pointURL);			                
+    				$('#pointArea').data('pointversion', obj.version);
                 } else {
                     editDialogAlert(obj.error);
                 	stopSpinner();